@@ -245,13 +245,62 @@ class DictSerializer(ActionDispatcher):
     def default(self, data):
         return ""
 
+    def serialize_iter(self, data, action='default'):
+        """Serialize data as an iterable of chunks.
+
+        Returns None if the data is not worth streaming, in which case
+        serialize() should be used instead.
+        """
+        return None
+
 
 class JSONDictSerializer(DictSerializer):
     """Default JSON request body serialization"""
 
+    # Lists shorter than this are not worth streaming
+    stream_threshold = 100
+    # Number of list items serialized into each chunk
+    stream_chunk_size = 100
+
     def default(self, data):
         return jsonutils.dumps(data)
 
+    def serialize_iter(self, data, action='default'):
+        """Serialize large list responses a chunk at a time.
+
+        Only default serialization of a dict holding a list of at least
+        stream_threshold items (e.g. a volume detail listing) is
+        streamed; the chunks join up to what serialize() returns.
+        """
+        if action != 'default' or not isinstance(data, dict):
+            return None
+        if not any(isinstance(value, list) and
+                   len(value) >= self.stream_threshold
+                   for value in data.values()):
+            return None
+        return self._iter_dict(data)
+
+    def _iter_dict(self, data):
+        chunk = ['{']
+        for i, (key, value) in enumerate(data.items()):
+            if i:
+                chunk.append(', ')
+            chunk.append('%s: ' % jsonutils.dumps(key))
+            if not isinstance(value, list):
+                chunk.append(jsonutils.dumps(value))
+                continue
+            chunk.append('[')
+            for j, item in enumerate(value):
+                if j:
+                    chunk.append(', ')
+                    if j % self.stream_chunk_size == 0:
+                        yield ''.join(chunk)
+                        chunk = []
+                chunk.append(jsonutils.dumps(item))
+            chunk.append(']')
+        chunk.append('}')
+        yield ''.join(chunk)
+
 
 class XMLDictSerializer(DictSerializer):
 
@@ -520,7 +569,12 @@ class ResponseObject(object):
             response.headers[hdr] = value
         response.headers['Content-Type'] = content_type
         if self.obj is not None:
-            response.body = serializer.serialize(self.obj)
+            serialize_iter = getattr(serializer, 'serialize_iter', None)
+            chunks = serialize_iter and serialize_iter(self.obj)
+            if chunks is not None:
+                response.app_iter = chunks
+            else:
+                response.body = serializer.serialize(self.obj)
 
         return response
 
@@ -0,0 +1,249 @@
+# Copyright (c) 2013 OpenStack, LLC.
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Storage for the rate limit buckets of the API limits middleware.
+
+Each bucket holds the state of one `Limit` for one user as a tuple of
+(water_level, last_request, next_request, remaining). The stores only
+keep that state; the leaky bucket arithmetic lives in `Limit.consume`.
+"""
+
+import collections
+import hashlib
+import mmap
+import multiprocessing
+import struct
+
+from oslo.config import cfg
+import six
+
+from cinder.openstack.common import log as logging
+from cinder.openstack.common import timeutils
+
+try:
+    import memcache
+except ImportError:
+    memcache = None
+
+
+LOG = logging.getLogger(__name__)
+
+ratelimit_opts = [
+    cfg.StrOpt('ratelimit_backend',
+               default='local',
+               help='Where the API rate limit state is kept: local (per '
+                    'process), shared_memory (shared by the API workers '
+                    'forked from the same parent) or memcached (shared '
+                    'through memcached_servers, or an in-process stand-in '
+                    'if none are set)'),
+    cfg.IntOpt('ratelimit_max_users',
+               default=10000,
+               help='Maximum number of users whose rate limit state is '
+                    'kept; the least recently seen users are forgotten '
+                    'first'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(ratelimit_opts)
+CONF.import_opt('memcached_servers', 'cinder.common.config')
+
+
+def _bucket_id(username, index):
+    if isinstance(username, six.text_type):
+        username = username.encode('utf-8')
+    return '%s\0%d' % (username, index)
+
+
+class LocalBucketStore(object):
+    """Keeps the buckets in this process, forgetting the idlest users."""
+
+    def __init__(self, max_users):
+        self.max_users = max_users
+        self._users = collections.OrderedDict()
+
+    def _touch(self, username):
+        buckets = self._users.pop(username, None)
+        if buckets is None:
+            buckets = {}
+            if self._users and len(self._users) >= self.max_users:
+                self._users.popitem(last=False)
+        self._users[username] = buckets
+        return buckets
+
+    def get(self, username, index):
+        buckets = self._users.get(username)
+        if buckets is None:
+            return None
+        return buckets.get(index)
+
+    def update(self, username, index, func):
+        """Replace the bucket with the first item of func(bucket).
+
+        The second item of func's result is returned.
+        """
+        buckets = self._touch(username)
+        buckets[index], result = func(buckets.get(index))
+        return result
+
+
+class SharedMemoryBucketStore(object):
+    """Keeps the buckets in an anonymous shared mapping.
+
+    The mapping is inherited by the API workers forked after the store is
+    created, so all of them see the same buckets. It is a fixed size hash
+    table; when all slots a bucket may use are taken, the one which saw a
+    request least recently is reused.
+    """
+
+    SLOT = struct.Struct('Qdddd')
+    PROBES = 8
+    SLOTS_PER_USER = 4
+    NONE = -1.0
+
+    def __init__(self, max_users):
+        self.slots = max(max_users * self.SLOTS_PER_USER, self.PROBES)
+        self._mmap = mmap.mmap(-1, self.slots * self.SLOT.size)
+        self._lock = multiprocessing.Lock()
+
+    def _key(self, username, index):
+        digest = hashlib.md5(_bucket_id(username, index)).digest()
+        # zero marks an empty slot
+        return struct.unpack('Q', digest[:8])[0] | 1
+
+    def _read(self, slot):
+        return self.SLOT.unpack_from(self._mmap, slot * self.SLOT.size)
+
+    def _find(self, key):
+        """Return (slot, bucket) for key, picking a slot to use if absent."""
+        first = key % self.slots
+        victim = None
+        victim_last = None
+        for i in range(self.PROBES):
+            slot = (first + i) % self.slots
+            values = self._read(slot)
+            if values[0] == key:
+                return slot, self._to_bucket(values[1:])
+            if values[0] == 0:
+                return slot, None
+            if victim is None or values[2] < victim_last:
+                victim, victim_last = slot, values[2]
+        return victim, None
+
+    def _to_bucket(self, values):
+        return tuple(None if v == self.NONE else v for v in values)
+
+    def get(self, username, index):
+        key = self._key(username, index)
+        with self._lock:
+            slot, bucket = self._find(key)
+        return bucket
+
+    def update(self, username, index, func):
+        key = self._key(username, index)
+        with self._lock:
+            slot, bucket = self._find(key)
+            bucket, result = func(bucket)
+            values = [self.NONE if v is None else v for v in bucket]
+            self.SLOT.pack_into(self._mmap, slot * self.SLOT.size,
+                                key, *values)
+        return result
+
+
+class LocalMemcacheClient(object):
+    """In-process stand-in for the parts of memcache.Client used here.
+
+    Bucket updates do not yield, so nothing can write a key between
+    gets and cas within one process.
+    """
+
+    def __init__(self):
+        self._cache = {}
+
+    def get(self, key):
+        value, expires = self._cache.get(key, (None, 0))
+        if expires and expires < timeutils.utcnow_ts():
+            del self._cache[key]
+            return None
+        return value
+
+    gets = get
+
+    def set(self, key, value, time=0):
+        expires = time and timeutils.utcnow_ts() + time
+        self._cache[key] = (value, expires)
+        return True
+
+    cas = set
+
+    def add(self, key, value, time=0):
+        if self.get(key) is not None:
+            return False
+        return self.set(key, value, time=time)
+
+
+class MemcacheBucketStore(object):
+    """Keeps the buckets in memcached so that API nodes can share them.
+
+    Buckets expire once they have been idle for a day, which is longer
+    than any limit unit.
+    """
+
+    CAS_RETRIES = 10
+    EXPIRES = 60 * 60 * 24
+
+    def __init__(self, servers):
+        if servers:
+            if memcache is None:
+                raise RuntimeError(_('python-memcached is required for the '
+                                     'memcached rate limit backend'))
+            self._client = memcache.Client(servers, cache_cas=True)
+        else:
+            self._client = LocalMemcacheClient()
+
+    def _key(self, username, index):
+        return 'ratelimit-%s' % hashlib.md5(_bucket_id(username,
+                                                       index)).hexdigest()
+
+    def get(self, username, index):
+        return self._client.get(self._key(username, index))
+
+    def update(self, username, index, func):
+        key = self._key(username, index)
+        for i in range(self.CAS_RETRIES):
+            bucket = self._client.gets(key)
+            new_bucket, result = func(bucket)
+            if bucket is None:
+                stored = self._client.add(key, new_bucket, time=self.EXPIRES)
+            else:
+                stored = self._client.cas(key, new_bucket, time=self.EXPIRES)
+            if stored:
+                return result
+        LOG.warn(_('Gave up updating rate limit bucket %s after concurrent '
+                   'updates'), key)
+        return result
+
+
+def get_bucket_store():
+    """Return a bucket store for the configured ratelimit_backend."""
+    backend = CONF.ratelimit_backend
+    if backend == 'local':
+        return LocalBucketStore(CONF.ratelimit_max_users)
+    if backend == 'shared_memory':
+        return SharedMemoryBucketStore(CONF.ratelimit_max_users)
+    if backend == 'memcached':
+        return MemcacheBucketStore(CONF.memcached_servers)
+    raise ValueError(_('Unknown ratelimit_backend %s') % backend)
@@ -17,8 +17,6 @@
 Module dedicated functions/classes dealing with rate limiting requests.
 """
 
-import collections
-import copy
 import httplib
 import math
 import re
@@ -28,6 +26,7 @@ import webob.dec
 import webob.exc
 
 from cinder.api.openstack import wsgi
+from cinder.api import ratelimit
 from cinder.api.views import limits as limits_views
 from cinder.api import xmlutil
 from cinder.openstack.common import importutils
@@ -141,6 +140,7 @@ class Limit(object):
         self.water_level = 0
         self.capacity = self.unit
         self.request_value = float(self.capacity) / float(self.value)
+        self._regex = None
         msg = _("Only %(value)s %(verb)s request(s) can be "
                 "made to %(uri)s every %(unit_string)s.")
         self.error_message = msg % self.__dict__
@@ -152,35 +152,68 @@ class Limit(object):
         @param verb: string http verb (POST, GET, etc.)
         @param url: string URL
         """
-        if self.verb != verb or not re.match(self.regex, url):
+        if not self.matches(verb, url):
             return
 
-        now = self._get_time()
+        state, delay = self.consume(self._state(), self._get_time())
+        (self.water_level, self.last_request,
+         self.next_request, self.remaining) = state
+        return delay
 
-        if self.last_request is None:
-            self.last_request = now
+    def matches(self, verb, url):
+        """Return whether a request with the verb and url is limited."""
+        if self.verb != verb:
+            return False
+        if self._regex is None:
+            self._regex = re.compile(self.regex)
+        return self._regex.match(url) is not None
 
-        leak_value = now - self.last_request
+    def _state(self):
+        return (self.water_level, self.last_request,
+                self.next_request, self.remaining)
 
-        self.water_level -= leak_value
-        self.water_level = max(self.water_level, 0)
-        self.water_level += self.request_value
+    def initial_state(self):
+        """Return the bucket state of a limit which saw no requests."""
+        return (0, None, None, self.value)
 
-        difference = self.water_level - self.capacity
+    def consume(self, state, now):
+        """
+        Apply one request to the bucket state of this limit.
+
+        @param state: (water_level, last_request, next_request, remaining)
+                      tuple, or None for a bucket which saw no requests yet
+        @param now: time of the request
+        @return: Tuple of the new state and the delay (or None)
+        """
+        if state is None:
+            state = self.initial_state()
+        water_level, last_request, next_request, remaining = state
+
+        if last_request is None:
+            last_request = now
 
-        self.last_request = now
+        leak_value = now - last_request
+
+        water_level -= leak_value
+        water_level = max(water_level, 0)
+        water_level += self.request_value
+
+        difference = water_level - self.capacity
+
+        last_request = now
 
         if difference > 0:
-            self.water_level -= self.request_value
-            self.next_request = now + difference
-            return difference
+            water_level -= self.request_value
+            next_request = now + difference
+            return ((water_level, last_request, next_request, remaining),
+                    difference)
 
         cap = self.capacity
-        water = self.water_level
         val = self.value
 
-        self.remaining = math.floor(((cap - water) / cap) * val)
-        self.next_request = now
+        remaining = math.floor(((cap - water_level) / cap) * val)
+        next_request = now
+        return (water_level, last_request, next_request, remaining), None
 
     def _get_time(self):
         """Retrieve the current time. Broken out for testability."""
@@ -190,16 +223,23 @@ class Limit(object):
         """Display the string name of the unit."""
         return self.UNITS.get(self.unit, "UNKNOWN")
 
-    def display(self):
-        """Return a useful representation of this class."""
+    def display(self, state=None):
+        """
+        Return a useful representation of this class.
+
+        @param state: bucket state to report instead of this limit's own
+        """
+        if state is None:
+            state = self._state()
+        water_level, last_request, next_request, remaining = state
         return {
             "verb": self.verb,
             "URI": self.uri,
             "regex": self.regex,
             "value": self.value,
-            "remaining": int(self.remaining),
+            "remaining": int(remaining),
             "unit": self.display_unit(),
-            "resetTime": int(self.next_request or self._get_time()),
+            "resetTime": int(next_request or self._get_time()),
         }
 
 # "Limit" format is a dictionary with the HTTP verb, human-readable URI,
@@ -279,6 +319,9 @@ class RateLimitingMiddleware(base_wsgi.Middleware):
 class Limiter(object):
     """
     Rate-limit checking class which handles limits in memory.
+
+    The limits are shared by all users; only their bucket state is kept per
+    user, in the store selected by ratelimit_backend.
     """
 
     def __init__(self, limits, **kwargs):
@@ -287,8 +330,8 @@ class Limiter(object):
 
         @param limits: List of `Limit` objects
         """
-        self.limits = copy.deepcopy(limits)
-        self.levels = collections.defaultdict(lambda: copy.deepcopy(limits))
+        self.limits = list(limits)
+        self.levels = {}
 
         # Pick up any per-user limit information
         for key, value in kwargs.items():
@@ -296,11 +339,29 @@ class Limiter(object):
                 username = key[5:]
                 self.levels[username] = self.parse_limits(value)
 
+        self._routes = self._get_routes(self.limits)
+        self._user_routes = dict((username, self._get_routes(limits))
+                                 for username, limits in self.levels.items())
+        self._store = ratelimit.get_bucket_store()
+
+    @staticmethod
+    def _get_routes(limits):
+        """
+        Return a dict of HTTP verb to the (index, limit) pairs for the verb.
+        """
+        routes = {}
+        for index, limit in enumerate(limits):
+            routes.setdefault(limit.verb, []).append((index, limit))
+        return routes
+
     def get_limits(self, username=None):
         """
         Return the limits for a given user.
         """
-        return [limit.display() for limit in self.levels[username]]
+        return [limit.display(self._store.get(username, index) or
+                              limit.initial_state())
+                for index, limit in
+                enumerate(self.levels.get(username, self.limits))]
 
     def check_for_delay(self, verb, url, username=None):
         """
@@ -310,8 +371,13 @@ class Limiter(object):
         """
         delays = []
 
-        for limit in self.levels[username]:
-            delay = limit(verb, url)
+        routes = self._user_routes.get(username, self._routes)
+        for index, limit in routes.get(verb, []):
+            if not limit.matches(verb, url):
+                continue
+            now = limit._get_time()
+            delay = self._store.update(
+                username, index, lambda state: limit.consume(state, now))
             if delay:
                 delays.append((delay, limit.error_message))
 
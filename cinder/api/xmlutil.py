@@ -30,6 +30,15 @@ XMLNS_VOLUME_V1 = 'http://docs.openstack.org/volume/api/v1'
 XMLNS_VOLUME_V2 = ('http://docs.openstack.org/api/openstack-volume/2.0/'
                    'content')
 
+# Bumped whenever a template element gains or loses children, so that
+# compiled templates (see Template.make_tree()) are rebuilt.
+_tree_generation = 0
+
+
+def _tree_changed():
+    global _tree_generation
+    _tree_generation += 1
+
 
 def validate_schema(xml, schema_name):
     if isinstance(xml, str):
@@ -175,6 +184,7 @@ class TemplateElement(object):
         self._text = None
         self._children = []
         self._childmap = {}
+        self._compiled = {}
 
         # Run the incoming attributes through set() so that they
         # become selectorized
@@ -222,6 +232,7 @@ class TemplateElement(object):
 
         self._children.append(elem)
         self._childmap[elem.tag] = elem
+        _tree_changed()
 
     def extend(self, elems):
         """Append children to the element."""
@@ -243,6 +254,7 @@ class TemplateElement(object):
         # Update the children
         self._children.extend(elemlist)
         self._childmap.update(elemmap)
+        _tree_changed()
 
     def insert(self, idx, elem):
         """Insert a child element at the given index."""
@@ -256,6 +268,7 @@ class TemplateElement(object):
 
         self._children.insert(idx, elem)
         self._childmap[elem.tag] = elem
+        _tree_changed()
 
     def remove(self, elem):
         """Remove a child element."""
@@ -269,6 +282,7 @@ class TemplateElement(object):
 
         self._children.remove(elem)
         del self._childmap[elem.tag]
+        _tree_changed()
 
     def get(self, key):
         """Get an attribute.
@@ -613,7 +627,71 @@ class Template(object):
         nsmap = self._nsmap()
 
         # Form the element tree
-        return self._serialize(None, obj, siblings, nsmap)
+        return self._render_compiled(None, obj, self._get_compiled(siblings),
+                                     nsmap)
+
+    def _get_compiled(self, siblings):
+        """Return the compiled form of the tree rooted at siblings.
+
+        Compiled trees are kept on the root template element, so they
+        are shared by the copies of a master template handed out by
+        TemplateBuilder, and are rebuilt if any template element has
+        since gained or lost children.
+        """
+
+        key = tuple(siblings)
+        generation, compiled = self.root._compiled.get(key, (None, None))
+        if generation != _tree_generation:
+            compiled = self._compile(siblings)
+            self.root._compiled[key] = (_tree_generation, compiled)
+        return compiled
+
+    def _compile(self, siblings):
+        """Compile a template tree.
+
+        Works out once which template elements are merged at each level
+        of the tree, which _serialize() works out again for every
+        datum.  Returns a tuple of the element to render, the elements
+        patched into it and the list of compiled child trees.
+
+        :param siblings: The TemplateElement instances to compile.
+        """
+
+        children = []
+        seen = set()
+        for idx, sibling in enumerate(siblings):
+            for child in sibling:
+                # Have we handled this child already?
+                if child.tag in seen:
+                    continue
+                seen.add(child.tag)
+
+                # Determine the child's siblings
+                nieces = [child]
+                for sib in siblings[idx + 1:]:
+                    if child.tag in sib:
+                        nieces.append(sib[child.tag])
+
+                children.append(self._compile(nieces))
+
+        return siblings[0], siblings[1:], children
+
+    def _render_compiled(self, parent, obj, compiled, nsmap=None):
+        """Build a tree of etree.Element instances from a compiled tree.
+
+        Equivalent to _serialize() with the siblings compiled by
+        _compile().  Returns the first etree.Element instance rendered,
+        or None.
+        """
+
+        elem, patches, children = compiled
+        elems = elem.render(parent, obj, patches, nsmap)
+        for child in children:
+            for subelem, datum in elems:
+                self._render_compiled(subelem, datum, child)
+
+        if elems:
+            return elems[0][0]
 
     def _siblings(self):
         """Hook method for computing root siblings.
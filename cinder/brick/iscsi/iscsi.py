@@ -29,6 +29,7 @@ from oslo.config import cfg
 from cinder import exception
 from cinder.openstack.common import fileutils
 from cinder.openstack.common import log as logging
+from cinder.openstack.common import timeutils
 from cinder import utils
 from cinder.volume import utils as volume_utils
 
@@ -58,6 +59,13 @@ iscsi_helper_opt = [cfg.StrOpt('iscsi_helper',
                                      'to either perform blockio or fileio '
                                      'optionally, auto can be set and Cinder '
                                      'will autodetect type of backing device')
+                               ),
+                    cfg.IntOpt('iscsi_target_reconcile_interval',
+                               default=60,
+                               help=('Seconds after which the cached index '
+                                     'of iSCSI targets is reloaded from the '
+                                     'target daemon; 0 reloads it on every '
+                                     'lookup')
                                )
                     ]
 
@@ -70,12 +78,63 @@ class TargetAdmin(object):
     """iSCSI target administration.
 
     Base class for iSCSI target admin helpers.
+
+    Keeps an index of the targets by iqn, which is loaded from the target
+    daemon on first use, kept up to date as targets are created and
+    removed, and reloaded every iscsi_target_reconcile_interval seconds
+    to pick up changes made behind our back.
     """
 
+    _targets = None
+    _targets_loaded_at = None
+
     def __init__(self, cmd, execute):
         self._cmd = cmd
         self.set_execute(execute)
 
+    def _list_targets(self):
+        """Return the tids of all the targets the daemon has, by iqn.
+
+        Helpers which cannot list their targets return None; their index
+        then only holds the targets seen since it was last reloaded.
+        """
+        return None
+
+    def _load_targets(self):
+        targets = self._list_targets()
+        self._targets = targets if targets is not None else {}
+        self._targets_loaded_at = timeutils.utcnow()
+
+    def _reconcile_targets(self):
+        """Reload the index if it is stale; returns whether it was."""
+        interval = CONF.iscsi_target_reconcile_interval
+        if (self._targets is None or interval <= 0 or
+                timeutils.is_older_than(self._targets_loaded_at, interval)):
+            self._load_targets()
+            return True
+        return False
+
+    def _get_target(self, iqn):
+        """Return the tid of the target with the given iqn, or None.
+
+        The daemon is only asked if the index is stale or does not know
+        the iqn.
+        """
+        reloaded = self._reconcile_targets()
+        tid = self._targets.get(iqn)
+        if tid is None and not reloaded:
+            self._load_targets()
+            tid = self._targets.get(iqn)
+        return tid
+
+    def _remember_target(self, iqn, tid):
+        self._reconcile_targets()
+        self._targets[iqn] = tid
+
+    def _forget_target(self, iqn):
+        if self._targets is not None:
+            self._targets.pop(iqn, None)
+
     def set_execute(self, execute):
         """Set the function to be used to execute commands."""
         self._execute = execute
@@ -119,17 +178,35 @@ class TgtAdm(TargetAdmin):
     def __init__(self, execute=utils.execute):
         super(TgtAdm, self).__init__('tgtadm', execute)
 
-    def _get_target(self, iqn):
+    def _list_targets(self):
         (out, err) = self._execute('tgt-admin', '--show', run_as_root=True)
-        lines = out.split('\n')
-        for line in lines:
-            if iqn in line:
+        targets = {}
+        for line in out.split('\n'):
+            if line.startswith('Target '):
                 parsed = line.split()
-                tid = parsed[1]
-                return tid[:-1]
-
+                targets[parsed[2]] = parsed[1][:-1]
+        return targets
+
+    def _query_target(self, iqn):
+        """Return the tid tgtd has for the target with the given iqn.
+
+        Only asks tgtd for its targets, without the details tgt-admin
+        --show adds for each of them.
+        """
+        (out, err) = self._execute('tgtadm', '--lld', 'iscsi', '--op', 'show',
+                                   '--mode', 'target', run_as_root=True)
+        for line in out.split('\n'):
+            if line.startswith('Target '):
+                parsed = line.split()
+                if parsed[2] == iqn:
+                    return parsed[1][:-1]
         return None
 
+    def get_targets(self):
+        """Return the tids of all the targets tgtd has, by iqn."""
+        self._load_targets()
+        return dict(self._targets)
+
     def create_iscsi_target(self, name, tid, lun, path,
                             chap_auth=None, **kwargs):
         # Note(jdg) tid and lun aren't used by TgtAdm but remain for
@@ -165,6 +242,10 @@ class TgtAdm(TargetAdmin):
         if old_name is not None:
             old_persist_file = os.path.join(volumes_dir, old_name)
 
+        # --update may recreate the target with a new tid
+        iqn = '%s%s' % (CONF.iscsi_target_prefix, vol_id)
+        self._forget_target(iqn)
+
         try:
             (out, err) = self._execute('tgt-admin',
                                        '--update',
@@ -179,8 +260,7 @@ class TgtAdm(TargetAdmin):
             os.unlink(volume_path)
             raise exception.ISCSITargetCreateFailed(volume_id=vol_id)
 
-        iqn = '%s%s' % (CONF.iscsi_target_prefix, vol_id)
-        tid = self._get_target(iqn)
+        tid = self._query_target(iqn)
         if tid is None:
             LOG.error(_("Failed to create iscsi target for volume "
                         "id:%(vol_id)s. Please ensure your tgtd config file "
@@ -189,6 +269,9 @@ class TgtAdm(TargetAdmin):
                             'volumes_dir': volumes_dir,
                         })
             raise exception.NotFound()
+        # an index not loaded yet picks the target up when it is
+        if self._targets is not None:
+            self._remember_target(iqn, tid)
 
         if old_persist_file is not None and os.path.exists(old_persist_file):
             os.unlink(old_persist_file)
@@ -218,6 +301,7 @@ class TgtAdm(TargetAdmin):
                       % {'vol_id': vol_id, 'e': str(e)})
             raise exception.ISCSITargetRemoveFailed(volume_id=vol_id)
 
+        self._forget_target(iqn)
         os.unlink(volume_path)
 
     def show_target(self, tid, iqn=None, **kwargs):
@@ -273,12 +357,16 @@ class IetAdm(TargetAdmin):
                             "id:%(vol_id)s: %(e)s")
                           % {'vol_id': vol_id, 'e': str(e)})
                 raise exception.ISCSITargetCreateFailed(volume_id=vol_id)
+        self._remember_target(name, tid)
         return tid
 
     def remove_iscsi_target(self, tid, lun, vol_id, **kwargs):
         LOG.info(_('Removing iscsi_target for volume: %s') % vol_id)
         self._delete_logicalunit(tid, lun, **kwargs)
         self._delete_target(tid, **kwargs)
+        for iqn, known_tid in (self._targets or {}).items():
+            if known_tid == tid:
+                self._forget_target(iqn)
         vol_uuid_file = CONF.volume_name_template % vol_id
         conf_file = CONF.iet_conf
         if os.path.exists(conf_file):
@@ -316,9 +404,15 @@ class IetAdm(TargetAdmin):
                   **kwargs)
 
     def show_target(self, tid, iqn=None, **kwargs):
+        if iqn is not None:
+            self._reconcile_targets()
+            if self._targets.get(iqn) == tid:
+                return
         self._run('--op', 'show',
                   '--tid=%s' % tid,
                   **kwargs)
+        if iqn is not None:
+            self._remember_target(iqn, tid)
 
     def _new_logicalunit(self, tid, lun, path, **kwargs):
         self._run('--op', 'new',
@@ -365,16 +459,16 @@ class LioAdm(TargetAdmin):
             LOG.error(_('rtstool is not installed correctly'))
             raise
 
-    def _get_target(self, iqn):
+    def _list_targets(self):
         (out, err) = self._execute('rtstool',
                                    'get-targets',
                                    run_as_root=True)
-        lines = out.split('\n')
-        for line in lines:
-            if iqn in line:
-                return line
-
-        return None
+        targets = {}
+        for line in out.split('\n'):
+            line = line.strip()
+            if line:
+                targets[line] = line
+        return targets
 
     def create_iscsi_target(self, name, tid, lun, path,
                             chap_auth=None, **kwargs):
@@ -391,6 +485,9 @@ class LioAdm(TargetAdmin):
         if chap_auth is not None:
             (chap_auth_userid, chap_auth_password) = chap_auth.split(' ')[1:]
 
+        iqn = '%s%s' % (CONF.iscsi_target_prefix, vol_id)
+        self._forget_target(iqn)
+
         extra_args = []
         if CONF.lio_initiator_iqns:
             extra_args.append(CONF.lio_initiator_iqns)
@@ -412,7 +509,6 @@ class LioAdm(TargetAdmin):
 
                 raise exception.ISCSITargetCreateFailed(volume_id=vol_id)
 
-        iqn = '%s%s' % (CONF.iscsi_target_prefix, vol_id)
         tid = self._get_target(iqn)
         if tid is None:
             LOG.error(_("Failed to create iscsi target for volume "
@@ -437,6 +533,8 @@ class LioAdm(TargetAdmin):
             LOG.error("%s" % str(e))
             raise exception.ISCSITargetRemoveFailed(volume_id=vol_id)
 
+        self._forget_target(iqn)
+
     def show_target(self, tid, iqn=None, **kwargs):
         if iqn is None:
             raise exception.InvalidParameterValue(
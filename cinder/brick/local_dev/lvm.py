@@ -27,6 +27,7 @@ from itertools import izip
 from cinder.openstack.common.gettextutils import _
 from cinder.openstack.common import log as logging
 from cinder.openstack.common import processutils as putils
+from cinder.openstack.common import timeutils
 
 LOG = logging.getLogger(__name__)
 
@@ -44,14 +45,24 @@ class VolumeGroupCreationFailed(Exception):
 
 
 class LVM(object):
-    """LVM object to enable various LVM related operations."""
+    """LVM object to enable various LVM related operations.
+
+    What we know about the VG and its LVs is read with a single vgs
+    command and cached; the cache is dropped whenever we change the VG
+    and reread once it is older than cache_ttl seconds, to pick up
+    changes made by others.
+    """
+
+    METADATA_FIELDS = ['vg_name', 'vg_size', 'vg_free', 'lv_count',
+                       'vg_uuid', 'lv_name', 'lv_size', 'lv_attr']
 
     def __init__(self,
                  vg_name,
                  create_vg=False,
                  physical_volumes=None,
                  lvm_type='default',
-                 executor=putils.execute):
+                 executor=putils.execute,
+                 cache_ttl=30):
         """Initialize the LVM object.
 
         The LVM object is based on an LVM VolumeGroup, one instantiation
@@ -61,6 +72,8 @@ class LVM(object):
         :param create_vg: Indicates the VG doesn't exist
                           and we want to create it
         :param physical_volumes: List of PVs to build VG on
+        :param cache_ttl: Seconds the VG and LV metadata is cached for,
+                          0 to read it every time
 
         """
         self.vg_name = vg_name
@@ -72,6 +85,10 @@ class LVM(object):
         self.vg_uuid = None
         self._execute = executor
         self.vg_thin_pool = None
+        self.cache_ttl = cache_ttl
+        self._vg_info = None
+        self._lvs = None
+        self._loaded_at = None
 
         if create_vg and physical_volumes is not None:
             self.pv_list = physical_volumes
@@ -122,6 +139,51 @@ class LVM(object):
 
         return exists
 
+    def _load_metadata(self):
+        """Read the VG and all its LVs with one command."""
+        cmd = ['vgs', '--noheadings', '--unit=g', '--separator', ':',
+               '-o', ','.join(self.METADATA_FIELDS), self.vg_name]
+        (out, err) = self._execute(*cmd, root_helper='sudo', run_as_root=True)
+
+        vg_info = None
+        lvs = {}
+        lv_list = []
+        for line in (out or '').splitlines():
+            fields = line.strip().split(':')
+            if len(fields) != len(self.METADATA_FIELDS):
+                continue
+            row = dict(zip(self.METADATA_FIELDS, fields))
+            if vg_info is None:
+                vg_info = {'name': row['vg_name'],
+                           'size': row['vg_size'],
+                           'available': row['vg_free'],
+                           'lv_count': row['lv_count'],
+                           'uuid': row['vg_uuid']}
+            # a VG without LVs still has a row, with empty LV fields
+            if row['lv_name']:
+                lv = {'vg': row['vg_name'],
+                      'name': row['lv_name'],
+                      'size': row['lv_size'],
+                      'attr': row['lv_attr']}
+                lvs[lv['name']] = lv
+                lv_list.append(lv)
+
+        self._vg_info = vg_info
+        self._lvs = lvs
+        self.lv_list = lv_list
+        self._loaded_at = timeutils.utcnow()
+
+    def _metadata(self):
+        """Return (vg info, LVs by name), reading them if stale."""
+        if (self._loaded_at is None or self.cache_ttl <= 0 or
+                timeutils.is_older_than(self._loaded_at, self.cache_ttl)):
+            self._load_metadata()
+        return self._vg_info, self._lvs
+
+    def invalidate_cache(self):
+        """Forget the cached metadata, after the VG has been changed."""
+        self._loaded_at = None
+
     def _create_vg(self, pv_list):
         cmd = ['vgcreate', self.vg_name, ','.join(pv_list)]
         self._execute(*cmd, root_helper='sudo', run_as_root=True)
@@ -184,7 +246,7 @@ class LVM(object):
         :returns: List of Dictionaries with LV info
 
         """
-        self.lv_list = self.get_all_volumes(self.vg_name)
+        self._metadata()
         return self.lv_list
 
     def get_volume(self, name):
@@ -193,10 +255,8 @@ class LVM(object):
         :returns: dict representation of Logical Volume if exists
 
         """
-        ref_list = self.get_volumes()
-        for r in ref_list:
-            if r['name'] == name:
-                return r
+        vg_info, lvs = self._metadata()
+        return lvs.get(name)
 
     @staticmethod
     def get_all_physical_volumes(vg_name=None):
@@ -275,20 +335,20 @@ class LVM(object):
         :returns: Dictionaries of VG info
 
         """
-        vg_list = self.get_all_volume_groups(self.vg_name)
+        vg_info, lvs = self._metadata()
 
-        if len(vg_list) != 1:
+        if vg_info is None:
             LOG.error(_('Unable to find VG: %s') % self.vg_name)
             raise VolumeGroupNotFound(vg_name=self.vg_name)
 
-        self.vg_size = vg_list[0]['size']
-        self.vg_free_space = vg_list[0]['available']
-        self.vg_lv_count = vg_list[0]['lv_count']
-        self.vg_uuid = vg_list[0]['uuid']
+        self.vg_size = vg_info['size']
+        self.vg_free_space = vg_info['available']
+        self.vg_lv_count = vg_info['lv_count']
+        self.vg_uuid = vg_info['uuid']
         if self.vg_thin_pool is not None:
             self.vg_size = self.vg_size
 
-        return vg_list[0]
+        return dict(vg_info)
 
     def create_thin_pool(self, name=None, size_str=0):
         """Creates a thin provisioning pool for this VG.
@@ -324,6 +384,7 @@ class LVM(object):
         putils.execute(*cmd,
                        root_helper='sudo',
                        run_as_root=True)
+        self.invalidate_cache()
         self.vg_thin_pool = pool_path
 
     def create_volume(self, name, size_str, lv_type='default', mirror_count=0):
@@ -356,6 +417,7 @@ class LVM(object):
         self._execute(*cmd,
                       root_helper='sudo',
                       run_as_root=True)
+        self.invalidate_cache()
 
     def create_lv_snapshot(self, name, source_lv_name, lv_type='default'):
         """Creates a snapshot of a logical volume.
@@ -378,6 +440,7 @@ class LVM(object):
         self._execute(*cmd,
                       root_helper='sudo',
                       run_as_root=True)
+        self.invalidate_cache()
 
     def delete(self, name):
         """Delete logical volume or snapshot.
@@ -389,6 +452,19 @@ class LVM(object):
                       '-f',
                       '%s/%s' % (self.vg_name, name),
                       root_helper='sudo', run_as_root=True)
+        self.invalidate_cache()
+
+    def extend_volume(self, name, size_str):
+        """Extend the size of a logical volume.
+
+        :param name: Name of LV to extend
+        :param size_str: New size of the LV, in GiB
+
+        """
+        self._execute('lvextend', '-L', self._size_str(size_str),
+                      '%s/%s' % (self.vg_name, name),
+                      root_helper='sudo', run_as_root=True)
+        self.invalidate_cache()
 
     def revert(self, snapshot_name):
         """Revert an LV from snapshot.
@@ -399,13 +475,11 @@ class LVM(object):
         self._execute('lvconvert', '--merge',
                       snapshot_name, root_helper='sudo',
                       run_as_root=True)
+        self.invalidate_cache()
 
     def lv_has_snapshot(self, name):
-        out, err = self._execute('lvdisplay', '--noheading',
-                                 '-C', '-o', 'Attr',
-                                 '%s/%s' % (self.vg_name, name))
-        if out:
-            out = out.strip()
-            if (out[0] == 'o') or (out[0] == 'O'):
+        lv = self.get_volume(name)
+        if lv and lv['attr']:
+            if (lv['attr'][0] == 'o') or (lv['attr'][0] == 'O'):
                 return True
         return False
@@ -82,6 +82,8 @@ class RequestContext(object):
         self.request_id = request_id
         self.auth_token = auth_token
         self.quota_class = quota_class
+        # policy check results for this request, see policy.enforce()
+        self.policy_results = None
         if overwrite or not hasattr(local.store, 'context'):
             self.update_store()
 
@@ -327,12 +327,17 @@ def snapshot_data_get_for_project(context, project_id, volume_type_id=None,
                                               session)
 
 
-def snapshot_get_active_by_window(context, begin, end=None, project_id=None):
+def snapshot_get_active_by_window(context, begin, end=None, project_id=None,
+                                  marker=None, limit=None):
     """Get all the snapshots inside the window.
 
     Specifying a project_id will filter for a certain project.
+
+    Specifying a marker or limit returns at most limit snapshots with an
+    id greater than marker, ordered by id.
     """
-    return IMPL.snapshot_get_active_by_window(context, begin, end, project_id)
+    return IMPL.snapshot_get_active_by_window(context, begin, end, project_id,
+                                              marker=marker, limit=limit)
 
 
 ####################
@@ -399,12 +404,17 @@ def volume_type_destroy(context, id):
     return IMPL.volume_type_destroy(context, id)
 
 
-def volume_get_active_by_window(context, begin, end=None, project_id=None):
+def volume_get_active_by_window(context, begin, end=None, project_id=None,
+                                marker=None, limit=None):
     """Get all the volumes inside the window.
 
     Specifying a project_id will filter for a certain project.
+
+    Specifying a marker or limit returns at most limit volumes with an
+    id greater than marker, ordered by id.
     """
-    return IMPL.volume_get_active_by_window(context, begin, end, project_id)
+    return IMPL.volume_get_active_by_window(context, begin, end, project_id,
+                                            marker=marker, limit=limit)
 
 
 ####################
@@ -1379,11 +1379,28 @@ def snapshot_data_get_for_project(context, project_id, volume_type_id=None,
                                           session)
 
 
+def _window_page(query, model, marker, limit):
+    """Page a *_get_active_by_window query by id.
+
+    Unlike paginate_query, the marker is an id rather than a row, so
+    callers can start from any point of the id space.
+    """
+    if marker is None and limit is None:
+        return query
+    if marker is not None:
+        query = query.filter(model.id > marker)
+    query = query.order_by(model.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
 @require_context
-def snapshot_get_active_by_window(context, begin, end=None, project_id=None):
+def snapshot_get_active_by_window(context, begin, end=None, project_id=None,
+                                  marker=None, limit=None):
     """Return snapshots that were active during window."""
     session = get_session()
-    query = session.query(models.Snapshot)
+    query = session.query(models.Snapshot).options(joinedload('volume'))
 
     query = query.filter(or_(models.Snapshot.deleted_at == None,
                              models.Snapshot.deleted_at > begin))
@@ -1392,7 +1409,7 @@ def snapshot_get_active_by_window(context, begin, end=None, project_id=None):
     if project_id:
         query = query.filter_by(project_id=project_id)
 
-    return query.all()
+    return _window_page(query, models.Snapshot, marker, limit).all()
 
 
 @require_context
@@ -1679,7 +1696,9 @@ def volume_type_destroy(context, id):
 def volume_get_active_by_window(context,
                                 begin,
                                 end=None,
-                                project_id=None):
+                                project_id=None,
+                                marker=None,
+                                limit=None):
     """Return volumes that were active during window."""
     session = get_session()
     query = session.query(models.Volume)
@@ -1691,7 +1710,7 @@ def volume_get_active_by_window(context,
     if project_id:
         query = query.filter_by(project_id=project_id)
 
-    return query.all()
+    return _window_page(query, models.Volume, marker, limit).all()
 
 
 ####################
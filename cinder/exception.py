@@ -531,6 +531,11 @@ class VolumeBackendAPIException(CinderException):
                 "backend API: %(data)s")
 
 
+class VolumeJobTimeout(VolumeBackendAPIException):
+    message = _("Job %(name)s did not complete on the storage backend "
+                "within %(timeout)s seconds")
+
+
 class NfsException(CinderException):
     message = _("Unknown NFS exception")
 
@@ -0,0 +1,200 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2013 OpenStack, LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Per-node cache of the raw images volumes are created from.
+
+Images are kept converted to raw under a name made of the image id and
+checksum, so that a copy is never served for an image whose data has
+changed. Once the cache holds more than image_cache_max_count images or
+image_cache_max_size GiB, the least recently used images are evicted.
+Images are read under a shared flock, and only images nobody reads are
+evicted.
+"""
+
+import contextlib
+import fcntl
+import os
+
+from oslo.config import cfg
+
+from cinder.openstack.common import fileutils
+from cinder.openstack.common import log as logging
+from cinder import units
+from cinder import utils
+
+
+LOG = logging.getLogger(__name__)
+
+image_cache_opts = [
+    cfg.StrOpt('image_cache_dir',
+               default=None,
+               help='Directory raw copies of the images volumes are '
+                    'created from are cached in. Unset => no cache'),
+    cfg.IntOpt('image_cache_max_size',
+               default=20,
+               help='GiB of disk the image cache may use'),
+    cfg.IntOpt('image_cache_max_count',
+               default=20,
+               help='Maximum number of images kept in the image cache'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(image_cache_opts)
+
+
+def cache_key(image_id, image_meta):
+    """Return the name an image is cached under, None if it cannot be.
+
+    Only images with a checksum are cached.
+    """
+    checksum = image_meta.get('checksum')
+    if not checksum:
+        return None
+    return '%s-%s' % (image_id, checksum)
+
+
+class ImageCache(object):
+    """Raw images in a directory, evicted least recently used first."""
+
+    PARTIAL_SUFFIX = '.part'
+
+    def __init__(self, path, max_size, max_count):
+        self.path = path
+        self.max_size = max_size
+        self.max_count = max_count
+
+    def _path(self, key):
+        return os.path.join(self.path, key)
+
+    def _entries(self):
+        """Return (last used, bytes used, path) for each cached image."""
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith(self.PARTIAL_SUFFIX):
+                continue
+            path = self._path(name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                # evicted by another process
+                continue
+            entries.append((st.st_mtime, st.st_blocks * 512, path))
+        return entries
+
+    def _evict(self, keep):
+        entries = sorted(self._entries())
+        count = len(entries)
+        size = sum(used for mtime, used, path in entries)
+        for mtime, used, path in entries:
+            if count <= self.max_count and size <= self.max_size:
+                break
+            if path == keep or not self._remove_unused(path):
+                continue
+            count -= 1
+            size -= used
+
+    def _remove_unused(self, path):
+        """Remove a cached image unless it is being read; True if removed."""
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return False
+        try:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                LOG.debug(_('Not evicting %s from the image cache, it is '
+                            'in use'), path)
+                return False
+            if not self._is_open(path, f):
+                return False
+            LOG.info(_('Evicting %s from the image cache'), path)
+            fileutils.delete_if_exists(path)
+            return True
+        finally:
+            f.close()
+
+    def _is_open(self, path, f):
+        """Whether f is still the file at path."""
+        try:
+            return os.path.samestat(os.stat(path), os.fstat(f.fileno()))
+        except OSError:
+            return False
+
+    def _open(self, path):
+        """Open a cached image to read it, None if it is not cached.
+
+        The image is marked used, and cannot be evicted while it is open.
+        """
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return None
+        fcntl.flock(f, fcntl.LOCK_SH)
+        if not self._is_open(path, f):
+            # evicted while we waited for the lock
+            f.close()
+            return None
+        os.utime(path, None)
+        return f
+
+    @contextlib.contextmanager
+    def fetch(self, image_id, image_meta, fill):
+        """Yield the path of the cached raw copy of an image.
+
+        On a miss fill(path) is called to write the raw image to path.
+        Concurrent misses for an image, in this process or another one,
+        wait for the first of them rather than fetching it again. The copy
+        is not evicted, by any process, before the block is left.
+        """
+        key = cache_key(image_id, image_meta)
+        path = self._path(key)
+
+        @utils.synchronized('image-cache-%s' % key, external=True)
+        def _fill():
+            if os.path.exists(path):
+                return
+            LOG.info(_('Adding image %s to the image cache'), image_id)
+            fileutils.ensure_tree(self.path)
+            partial = path + self.PARTIAL_SUFFIX
+            with fileutils.remove_path_on_error(partial):
+                # created by us, so that we may later touch it even when
+                # it is written by a command running as root
+                open(partial, 'wb').close()
+                fill(partial)
+                os.rename(partial, path)
+            self._evict(path)
+
+        f = self._open(path)
+        if f is not None:
+            LOG.debug(_('Image %s found in the image cache'), image_id)
+        while f is None:
+            _fill()
+            f = self._open(path)
+        try:
+            yield path
+        finally:
+            f.close()
+
+
+def get_image_cache():
+    """Return the configured image cache, None if there is none."""
+    if not CONF.image_cache_dir:
+        return None
+    return ImageCache(CONF.image_cache_dir,
+                      CONF.image_cache_max_size * units.GiB,
+                      CONF.image_cache_max_count)
@@ -20,13 +20,18 @@
 
 from __future__ import absolute_import
 
+import collections
 import copy
+import hashlib
+import httplib
 import itertools
 import random
 import sys
 import time
+import urllib
 import urlparse
 
+from eventlet import greenthread
 import glanceclient
 import glanceclient.exc
 from oslo.config import cfg
@@ -35,9 +40,27 @@ from cinder import exception
 from cinder.openstack.common import jsonutils
 from cinder.openstack.common import log as logging
 from cinder.openstack.common import timeutils
-
+from cinder import units
+from cinder import utils
+
+
+glance_download_opts = [
+    cfg.IntOpt('glance_download_workers',
+               default=4,
+               help='Number of ranges of an image downloaded at once, when '
+                    'glance honours range requests. 1 => download images '
+                    'in a single request'),
+    cfg.IntOpt('glance_download_range_size',
+               default=16,
+               help='MiB in each range of an image downloaded from glance'),
+    cfg.IntOpt('glance_download_rate',
+               default=0,
+               help='MiB/s each image download from glance may use. 0 => '
+                    'unlimited'),
+]
 
 CONF = cfg.CONF
+CONF.register_opts(glance_download_opts)
 
 LOG = logging.getLogger(__name__)
 
@@ -137,6 +160,33 @@ class GlanceClientWrapper(object):
         if version in kwargs:
             version = kwargs['version']
 
+        def _call(client):
+            return getattr(client.images, method)(*args, **kwargs)
+        return self._retry(context, version, method, _call)
+
+    def data_range(self, context, image_id, start, end):
+        """Request bytes start to end - 1 of the data of an image.
+
+        Returns (ranged, body), where body iterates over the data. ranged
+        is False when glance ignored the range, and body covers all of
+        the data.
+        """
+        version = self.version or CONF.glance_api_version
+        if int(version) == 1:
+            url = '/v1/images/%s' % urllib.quote(str(image_id))
+        else:
+            url = '/v2/images/%s/file' % urllib.quote(str(image_id))
+        headers = {'Range': 'bytes=%d-%d' % (start, end - 1)}
+
+        def _request(client):
+            # the v1 client is its own http client
+            http_client = getattr(client, 'http_client', client)
+            resp, body = http_client.raw_request('GET', url, headers=headers)
+            return resp.status == httplib.PARTIAL_CONTENT, body
+        return self._retry(context, version, 'data', _request)
+
+    def _retry(self, context, version, method, func):
+        """Return func(client), retrying on connection errors."""
         retry_excs = (glanceclient.exc.ServiceUnavailable,
                       glanceclient.exc.InvalidEndpoint,
                       glanceclient.exc.CommunicationError)
@@ -146,7 +196,7 @@ class GlanceClientWrapper(object):
             client = self.client or self._create_onetime_client(context,
                                                                 version)
             try:
-                return getattr(client.images, method)(*args, **kwargs)
+                return func(client)
             except retry_excs as e:
                 netloc = self.netloc
                 extra = "retrying"
@@ -173,6 +223,111 @@ class GlanceClientWrapper(object):
                 time.sleep(1)
 
 
+class ImageDownload(object):
+    """Downloads the data of an image, checking it against its checksum.
+
+    When glance honours range requests, the image is fetched in ranges of
+    glance_download_range_size MiB, glance_download_workers of them at
+    once, and written out in order. A range which fails is fetched again,
+    up to glance_num_retries times, instead of the whole image.
+    """
+
+    def __init__(self, client, context, image_id, image_meta):
+        self.client = client
+        self.context = context
+        self.image_id = image_id
+        self.size = image_meta.get('size')
+        self.checksum = image_meta.get('checksum')
+        self.workers = CONF.glance_download_workers
+        self.range_size = CONF.glance_download_range_size * units.MiB
+        self.written = 0
+        self._md5 = hashlib.md5()
+        self._limiter = utils.RateLimiter(CONF.glance_download_rate *
+                                          units.MiB)
+
+    def _write(self, data, chunk):
+        self._md5.update(chunk)
+        self.written += len(chunk)
+        data.write(chunk)
+        self._limiter.consume(len(chunk))
+
+    def _fetch(self, start, end, body=None):
+        """Return bytes start to end - 1, from body if it is given."""
+        attempts = 1 + CONF.glance_num_retries
+        for attempt in xrange(1, attempts + 1):
+            try:
+                if body is None:
+                    ranged, body = self.client.data_range(
+                        self.context, self.image_id, start, end)
+                    if not ranged:
+                        raise IOError(_('range request not honoured'))
+                chunk = ''.join(body)
+                if len(chunk) != end - start:
+                    raise IOError(_('received %(got)d of %(expected)d '
+                                    'bytes') % {'got': len(chunk),
+                                                'expected': end - start})
+                return chunk
+            except (IOError, httplib.HTTPException) as e:
+                body = None
+                msg = (_('Failed to download bytes %(start)d-%(end)d of '
+                         'image %(image_id)s: %(err)s') %
+                       {'start': start, 'end': end - 1,
+                        'image_id': self.image_id, 'err': e})
+                if attempt == attempts:
+                    LOG.error(msg)
+                    raise exception.GlanceConnectionFailed(reason=msg)
+                LOG.warn(msg)
+
+    def _download_ranges(self, data, ranges):
+        ranges = iter(ranges)
+        pending = collections.deque(
+            greenthread.spawn(self._fetch, start, end)
+            for start, end in itertools.islice(ranges, self.workers))
+        try:
+            while pending:
+                chunk = pending.popleft().wait()
+                for start, end in itertools.islice(ranges, 1):
+                    pending.append(greenthread.spawn(self._fetch, start,
+                                                     end))
+                self._write(data, chunk)
+        finally:
+            for thread in pending:
+                thread.kill()
+
+    def download(self, data):
+        size = int(self.size or 0)
+        if self.workers > 1 and size > self.range_size:
+            ranges = [(start, min(start + self.range_size, size))
+                      for start in xrange(0, size, self.range_size)]
+            ranged, body = self.client.data_range(self.context,
+                                                  self.image_id,
+                                                  *ranges[0])
+            if ranged:
+                self._write(data, self._fetch(*ranges[0], body=body))
+                self._download_ranges(data, ranges[1:])
+            else:
+                LOG.debug(_('Glance does not honour range requests, '
+                            'downloading image %s in one request'),
+                          self.image_id)
+                for chunk in body:
+                    self._write(data, chunk)
+        else:
+            for chunk in self.client.call(self.context, 'data',
+                                          self.image_id):
+                self._write(data, chunk)
+
+        if self.size is not None and self.written != size:
+            raise exception.ImageUnacceptable(
+                image_id=self.image_id,
+                reason=_('downloaded %(written)d bytes, expected %(size)d') %
+                {'written': self.written, 'size': size})
+        if self.checksum and self._md5.hexdigest() != self.checksum:
+            raise exception.ImageUnacceptable(
+                image_id=self.image_id,
+                reason=_('checksum %(actual)s does not match %(expected)s') %
+                {'actual': self._md5.hexdigest(), 'expected': self.checksum})
+
+
 class GlanceImageService(object):
     """Provides storage and retrieval of disk image objects within Glance."""
 
@@ -237,16 +392,21 @@ class GlanceImageService(object):
 
         return getattr(image_meta, 'direct_url', None)
 
-    def download(self, context, image_id, data):
-        """Calls out to Glance for metadata and data and writes data."""
+    def download(self, context, image_id, data, image_meta=None):
+        """Calls out to Glance for metadata and data and writes data.
+
+        The data is checked against the checksum and size of the image.
+        Callers which already have its metadata pass it as image_meta,
+        rather than have it asked for again.
+        """
+        if image_meta is None:
+            image_meta = self.show(context, image_id)
         try:
-            image_chunks = self._client.call(context, 'data', image_id)
+            ImageDownload(self._client, context, image_id,
+                          image_meta).download(data)
         except Exception:
             _reraise_translated_image_exception(image_id)
 
-        for chunk in image_chunks:
-            data.write(chunk)
-
     def create(self, context, image_meta, data=None):
         """Store the image data and return the new image object."""
         sent_service_image_meta = self._translate_to_glance(image_meta)
@@ -27,6 +27,7 @@ we should look at maybe pushign this up to OSLO
 
 
 import contextlib
+import hashlib
 import os
 import re
 import tempfile
@@ -34,6 +35,7 @@ import tempfile
 from oslo.config import cfg
 
 from cinder import exception
+from cinder.image import cache
 from cinder.openstack.common import fileutils
 from cinder.openstack.common import log as logging
 from cinder.openstack.common import strutils
@@ -44,7 +46,13 @@ LOG = logging.getLogger(__name__)
 
 image_helper_opt = [cfg.StrOpt('image_conversion_dir',
                     default='/tmp',
-                    help='parent dir for tempdir used for image conversion'), ]
+                    help='parent dir for tempdir used for image conversion'),
+                    cfg.BoolOpt('image_stream_raw',
+                                default=True,
+                                help='Write raw images straight to the '
+                                     'volume as they are downloaded, '
+                                     'instead of through a temporary file '
+                                     'in image_conversion_dir'), ]
 
 CONF = cfg.CONF
 CONF.register_opts(image_helper_opt)
@@ -201,6 +209,99 @@ def resize_image(source, size):
     utils.execute(*cmd, run_as_root=False)
 
 
+class NotRawImage(Exception):
+    """Raised by ImageWriter when the data turns out not to be raw."""
+
+    def __init__(self, file_format):
+        super(NotRawImage, self).__init__(file_format)
+        self.file_format = file_format
+
+
+class ImageWriter(object):
+    """File-like object image services download raw images into.
+
+    The first chunk is checked for the magic numbers of the image formats
+    qemu understands, so that an image which is not raw is never written
+    out as one. When the destination is sparse, chunks of zeros are
+    skipped rather than written.
+    """
+
+    # (offset, magic, format)
+    MAGIC = [(0, 'QFI\xfb', 'qcow2'),
+             (0, 'QED\0', 'qed'),
+             (0, 'KDMV', 'vmdk'),
+             (0, 'conectix', 'vpc'),
+             (0x40, '\x7f\x10\xda\xbe', 'vdi')]
+
+    def __init__(self, dest, sparse=False):
+        self.dest = dest
+        self.sparse = sparse
+        self.size = 0
+
+    def write(self, chunk):
+        if self.size == 0:
+            for offset, magic, file_format in self.MAGIC:
+                if chunk[offset:offset + len(magic)] == magic:
+                    raise NotRawImage(file_format)
+        if self.sparse and chunk.count('\0') == len(chunk):
+            self.dest.seek(len(chunk), os.SEEK_CUR)
+        else:
+            self.dest.write(chunk)
+        self.size += len(chunk)
+
+
+def can_stream(image_meta):
+    """Whether the image can be written to a volume as it is downloaded."""
+    return (CONF.image_stream_raw and
+            image_meta.get('disk_format') == 'raw' and
+            not is_xenserver_format(image_meta))
+
+
+def fetch_stream(context, image_service, image_id, image_meta, dest,
+                 sparse=False):
+    """Download a raw image into the file-like dest.
+
+    The image service checks the download against the checksum and size
+    in image_meta. Returns the size of the image.
+
+    :raises: NotRawImage if the data is in some other format
+    """
+    writer = ImageWriter(dest, sparse=sparse)
+    image_service.download(context, image_id, writer, image_meta=image_meta)
+    return writer.size
+
+
+def _stream_to_raw(context, image_service, image_id, image_meta, dest):
+    """Write a raw image to dest as it is downloaded.
+
+    Holes are left for runs of zeros when dest is a regular file. Returns
+    False, having written nothing, if the image is not actually raw.
+    """
+    sparse = not os.path.exists(dest) or os.path.isfile(dest)
+    if not os.path.exists(dest):
+        open(dest, 'wb').close()
+    with utils.temporary_chown(dest):
+        with fileutils.file_open(dest, 'wb') as image_file:
+            try:
+                size = fetch_stream(context, image_service, image_id,
+                                    image_meta, image_file, sparse=sparse)
+            except NotRawImage as e:
+                LOG.warn(_("Image %(image_id)s is declared raw but looks "
+                           "like %(fmt)s, converting it instead") %
+                         {'image_id': image_id, 'fmt': e.file_format})
+                return False
+            if sparse:
+                image_file.truncate(size)
+
+    data = qemu_img_info(dest)
+    if data.file_format != 'raw':
+        LOG.warn(_("Image %(image_id)s is declared raw but qemu-img "
+                   "reports %(fmt)s, converting it instead") %
+                 {'image_id': image_id, 'fmt': data.file_format})
+        return False
+    return True
+
+
 def fetch(context, image_service, image_id, path, _user_id, _project_id):
     # TODO(vish): Improve context handling and add owner and auth data
     #             when it is added to glance.  Right now there is no
@@ -232,9 +333,49 @@ def fetch_verify_image(context, image_service, image_id, dest,
                          "%(backing_file)s") % locals())
 
 
+@contextlib.contextmanager
+def fetch_cached(context, image_service, image_id, image_meta):
+    """Yield the path of the image cache's raw copy of an image.
+
+    The image is fetched into the cache if it is not there already, and
+    stays there until the block is left. Yields None if there is no image
+    cache or the image cannot be cached.
+    """
+    image_cache = cache.get_image_cache()
+    if image_cache is None or cache.cache_key(image_id, image_meta) is None:
+        yield None
+        return
+
+    def fill(path):
+        _fetch_to_raw(context, image_service, image_id, image_meta, path)
+    with image_cache.fetch(image_id, image_meta, fill) as path:
+        yield path
+
+
 def fetch_to_raw(context, image_service,
                  image_id, dest,
                  user_id=None, project_id=None):
+    image_meta = image_service.show(context, image_id)
+    with fetch_cached(context, image_service, image_id,
+                      image_meta) as cached:
+        if cached is not None:
+            LOG.debug(_("Writing %s to the volume from the image cache")
+                      % image_id)
+            convert_image(cached, dest, 'raw')
+            return
+    _fetch_to_raw(context, image_service, image_id, image_meta, dest,
+                  user_id=user_id, project_id=project_id)
+
+
+def _fetch_to_raw(context, image_service, image_id, image_meta, dest,
+                  user_id=None, project_id=None):
+    if can_stream(image_meta):
+        LOG.debug(_("%s is raw, writing it to the volume as it downloads")
+                  % image_id)
+        if _stream_to_raw(context, image_service, image_id, image_meta,
+                          dest):
+            return
+
     if (CONF.image_conversion_dir and not
             os.path.exists(CONF.image_conversion_dir)):
         os.makedirs(CONF.image_conversion_dir)
@@ -246,7 +387,7 @@ def fetch_to_raw(context, image_service,
     with temporary_file() as tmp:
         fetch(context, image_service, image_id, tmp, user_id, project_id)
 
-        if is_xenserver_image(context, image_service, image_id):
+        if is_xenserver_format(image_meta):
             replace_xenserver_image_with_coalesced_vhd(tmp)
 
         data = qemu_img_info(tmp)
@@ -268,11 +409,6 @@ def fetch_to_raw(context, image_service,
 
         # NOTE(jdg): I'm using qemu-img convert to write
         # to the volume regardless if it *needs* conversion or not
-        # TODO(avishay): We can speed this up by checking if the image is raw
-        # and if so, writing directly to the device. However, we need to keep
-        # check via 'qemu-img info' that what we copied was in fact a raw
-        # image and not a different format with a backing file, which may be
-        # malicious.
         LOG.debug("%s was %s, converting to raw" % (image_id, fmt))
         convert_image(tmp, dest, 'raw')
 
@@ -284,14 +420,63 @@ def fetch_to_raw(context, image_service,
                 data.file_format)
 
 
-def upload_volume(context, image_service, image_meta, volume_path):
+class ImageReader(object):
+    """File-like object image services upload images from.
+
+    The data is checksummed as it is read, so that the upload can be
+    checked against the checksum the image service computes for it.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.size = 0
+        self._checksum = hashlib.md5()
+
+    @property
+    def checksum(self):
+        return self._checksum.hexdigest()
+
+    def read(self, length=None):
+        chunk = self.source.read(length)
+        self._checksum.update(chunk)
+        self.size += len(chunk)
+        return chunk
+
+
+def upload_stream(context, image_service, image_id, source):
+    """Upload image data from the file-like source as it is read.
+
+    :raises: ImageUnacceptable if the image service reports a different
+             checksum than that of the data read
+    """
+    reader = ImageReader(source)
+    image_meta = image_service.update(context, image_id, {}, reader)
+    checksum = (image_meta or {}).get('checksum')
+    if checksum and checksum != reader.checksum:
+        raise exception.ImageUnacceptable(
+            image_id=image_id,
+            reason=_("uploaded checksum %(actual)s does not match "
+                     "%(expected)s") % {'actual': checksum,
+                                        'expected': reader.checksum})
+    LOG.debug(_("Uploaded %(size)d bytes to image %(image_id)s") %
+              {'size': reader.size, 'image_id': image_id})
+
+
+def upload_volume(context, image_service, image_meta, volume_path,
+                  volume_format='raw'):
+    """Upload the volume at volume_path to the image.
+
+    Raw images of raw volumes are read straight from the volume; anything
+    else is converted into a temporary file first. volume_path may be
+    anything qemu-img reads from, such as an rbd: URI, for those.
+    """
     image_id = image_meta['id']
-    if (image_meta['disk_format'] == 'raw'):
+    if image_meta['disk_format'] == 'raw' and volume_format == 'raw':
         LOG.debug("%s was raw, no need to convert to %s" %
                   (image_id, image_meta['disk_format']))
         with utils.temporary_chown(volume_path):
             with fileutils.file_open(volume_path) as image_file:
-                image_service.update(context, image_id, {}, image_file)
+                upload_stream(context, image_service, image_id, image_file)
         return
 
     if (CONF.image_conversion_dir and not
@@ -313,7 +498,7 @@ def upload_volume(context, image_service, image_meta, volume_path):
                 {'f1': image_meta['disk_format'], 'f2': data.file_format})
 
         with fileutils.file_open(tmp) as image_file:
-            image_service.update(context, image_id, {}, image_file)
+            upload_stream(context, image_service, image_id, image_file)
         os.unlink(tmp)
 
 
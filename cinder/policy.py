@@ -18,10 +18,14 @@
 """Policy Engine For Cinder"""
 
 
+import functools
+
 from oslo.config import cfg
 
 from cinder import exception
+from cinder.openstack.common import log as logging
 from cinder.openstack.common import policy
+from cinder.openstack.common import timeutils
 from cinder import utils
 
 
@@ -31,20 +35,33 @@ policy_opts = [
                help=_('JSON file representing policy')),
     cfg.StrOpt('policy_default_rule',
                default='default',
-               help=_('Rule checked when requested rule is not found')), ]
+               help=_('Rule checked when requested rule is not found')),
+    cfg.IntOpt('policy_file_check_interval',
+               default=60,
+               help=_('Seconds between checks of the policy file for '
+                      'changes; 0 checks it on every policy enforcement')),
+    cfg.BoolOpt('policy_cache_results',
+                default=True,
+                help=_('Remember the result of each policy check for the '
+                       'rest of the request it was made in')), ]
 
 CONF = cfg.CONF
 CONF.register_opts(policy_opts)
 
+LOG = logging.getLogger(__name__)
+
 _POLICY_PATH = None
 _POLICY_CACHE = {}
+_RULES = None
 
 
 def reset():
     global _POLICY_PATH
     global _POLICY_CACHE
+    global _RULES
     _POLICY_PATH = None
     _POLICY_CACHE = {}
+    _RULES = None
     policy.reset()
 
 
@@ -53,8 +70,13 @@ def init():
     global _POLICY_CACHE
     if not _POLICY_PATH:
         _POLICY_PATH = utils.find_config(CONF.policy_file)
-    utils.read_cached_file(_POLICY_PATH, _POLICY_CACHE,
-                           reload_func=_set_brain)
+    checked_at = _POLICY_CACHE.get('checked_at')
+    interval = CONF.policy_file_check_interval
+    if (checked_at is None or interval <= 0 or
+            timeutils.is_older_than(checked_at, interval)):
+        utils.read_cached_file(_POLICY_PATH, _POLICY_CACHE,
+                               reload_func=_set_brain)
+        _POLICY_CACHE['checked_at'] = timeutils.utcnow()
 
 
 def _set_brain(data):
@@ -62,6 +84,135 @@ def _set_brain(data):
     policy.set_brain(policy.Brain.load_json(data, default_rule))
 
 
+def _allow(target, credentials):
+    return True
+
+
+def _deny(target, credentials):
+    return False
+
+
+class _CompiledRules(object):
+    """Checks compiled from the rules of a policy brain.
+
+    Each rule is parsed into a check callable the first time it is used,
+    instead of splitting every "kind:value" match on each check, and AND
+    lists stop at the first failing match. A rule replaced in the brain,
+    e.g. with add_rule(), is compiled again.
+    """
+
+    def __init__(self, brain):
+        self.brain = brain
+        # rule name => (match list the check was compiled from, check)
+        self._checks = {}
+
+    def _compile_match(self, match):
+        """Turn a single ``kind:value`` match into a check callable."""
+        try:
+            match_kind, match_value = match.split(':', 1)
+        except Exception:
+            LOG.exception(_("Failed to understand rule %(match)r") %
+                          {'match': match})
+            # If the rule is invalid, fail closed
+            return _deny
+
+        if match_kind == 'rule':
+            # looked up when the check runs, so that replaced rules are
+            # seen
+            return lambda target, credentials: self.rule_check(
+                match_value)(target, credentials)
+        if hasattr(self.brain, '_check_%s' % match_kind):
+            # inheritance-based rule, left to the brain
+            return functools.partial(self.brain._check, match)
+        checks = self.brain._checks
+        func = checks.get(match_kind, checks.get(None))
+        if not func:
+            LOG.error(_("No handler for matches of kind %s") % match_kind)
+            # Fail closed
+            return _deny
+        return functools.partial(func, self.brain, match_kind, match_value)
+
+    def compile(self, match_list):
+        """Turn a match list into a check taking (target, credentials)."""
+        if not match_list:
+            return _allow
+        or_checks = []
+        for and_list in match_list:
+            if isinstance(and_list, basestring):
+                and_list = (and_list,)
+            or_checks.append([self._compile_match(item)
+                              for item in and_list])
+
+        def check(target, credentials):
+            for and_checks in or_checks:
+                for and_check in and_checks:
+                    if not and_check(target, credentials):
+                        break
+                else:
+                    return True
+            return False
+
+        return check
+
+    def rule_check(self, name):
+        """Return the check of the named rule.
+
+        Missing rules fall back to the default rule, and fail closed if
+        there is none.
+        """
+        match_list = self.brain.rules.get(name)
+        try:
+            compiled_from, check = self._checks[name]
+        except KeyError:
+            pass
+        else:
+            if compiled_from is match_list:
+                return check
+
+        default_rule = self.brain.default_rule
+        if match_list is not None:
+            check = self.compile(match_list)
+        elif default_rule and name != default_rule:
+            check = self.compile(('rule:%s' % default_rule,))
+        else:
+            check = _deny
+        self._checks[name] = (match_list, check)
+        return check
+
+
+def _get_rules():
+    """Return the compiled rules of the current brain, None if unset."""
+    global _RULES
+    brain = policy._BRAIN
+    if brain is None:
+        return None
+    if _RULES is None or _RULES.brain is not brain:
+        _RULES = _CompiledRules(brain)
+    return _RULES
+
+
+def _freeze(value):
+    """Return a hashable copy of a target or credentials dict."""
+    if isinstance(value, dict):
+        return frozenset((k, _freeze(v)) for k, v in value.iteritems())
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _get_results(context, rules):
+    """Return the policy results remembered for this context.
+
+    The results are dropped when the brain has been replaced since they
+    were recorded, e.g. because the policy file was reloaded.
+    """
+    results = getattr(context, 'policy_results', None)
+    if results is None or results[0] is not rules:
+        results = (rules, {})
+        context.policy_results = results
+    return results[1]
+
+
 def enforce(context, action, target):
     """Verifies that the action is valid on the target in this context.
 
@@ -81,11 +232,30 @@ def enforce(context, action, target):
     """
     init()
 
-    match_list = ('rule:%s' % action,)
     credentials = context.to_dict()
+    rules = _get_rules()
+    if rules is None:
+        match_list = ('rule:%s' % action,)
+        policy.enforce(match_list, target, credentials,
+                       exception.PolicyNotAuthorized, action=action)
+        return
 
-    policy.enforce(match_list, target, credentials,
-                   exception.PolicyNotAuthorized, action=action)
+    if not CONF.policy_cache_results:
+        result = rules.rule_check(action)(target, credentials)
+    else:
+        try:
+            key = (action, _freeze(target), _freeze(credentials))
+            hash(key)
+        except TypeError:
+            key = None
+        results = _get_results(context, rules)
+        result = results.get(key) if key else None
+        if result is None:
+            result = rules.rule_check(action)(target, credentials)
+            if key:
+                results[key] = result
+    if not result:
+        raise exception.PolicyNotAuthorized(action=action)
 
 
 def check_is_admin(roles):
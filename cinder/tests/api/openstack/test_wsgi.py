@@ -120,6 +120,19 @@ class JSONDictSerializerTest(test.TestCase):
         result = result.replace('\n', '').replace(' ', '')
         self.assertEqual(result, expected_json)
 
+    def test_serialize_iter_small_list(self):
+        serializer = wsgi.JSONDictSerializer()
+        self.assertEqual(serializer.serialize_iter({'servers': [1, 2]}),
+                         None)
+
+    def test_serialize_iter_large_list(self):
+        input_dict = {'servers': [{'id': i} for i in range(250)],
+                      'servers_links': {'rel': 'next'}}
+        serializer = wsgi.JSONDictSerializer()
+        chunks = list(serializer.serialize_iter(input_dict))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(''.join(chunks), serializer.serialize(input_dict))
+
 
 class TextDeserializerTest(test.TestCase):
     def test_dispatch_default(self):
@@ -828,6 +841,18 @@ class ResponseObjectTest(test.TestCase):
             self.assertEqual(response.status_int, 202)
             self.assertEqual(response.body, mtype)
 
+    def test_serialize_streams_chunks(self):
+        class JSONSerializer(object):
+            def serialize_iter(self, obj):
+                return iter(['js', 'on'])
+
+        robj = wsgi.ResponseObject({}, json=JSONSerializer)
+        request = wsgi.Request.blank('/tests/123')
+        response = robj.serialize(request, 'application/json')
+
+        self.assertEqual(response.content_length, None)
+        self.assertEqual(response.body, 'json')
+
 
 class ValidBodyTest(test.TestCase):
 
@@ -0,0 +1,145 @@
+# Copyright (c) 2013 OpenStack, LLC.
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Tests for the rate limit bucket stores.
+"""
+
+from cinder.api import ratelimit
+from cinder.openstack.common import timeutils
+from cinder import test
+
+
+def _consume(bucket):
+    """Count requests in the water level and return the previous one."""
+    if bucket is None:
+        bucket = (0, None, None, 0)
+    return (bucket[0] + 1, 1.0, None, 0), bucket[0]
+
+
+class BucketStoreTestMixin(object):
+
+    def test_get_missing_bucket(self):
+        self.assertEqual(None, self.store.get('user1', 0))
+
+    def test_update(self):
+        self.assertEqual(0, self.store.update('user1', 0, _consume))
+        self.assertEqual(1, self.store.update('user1', 0, _consume))
+        self.assertEqual((2, 1.0, None, 0), self.store.get('user1', 0))
+
+    def test_buckets_are_separate(self):
+        self.store.update('user1', 0, _consume)
+        self.store.update('user1', 1, _consume)
+        self.store.update(u'user\xe9', 0, _consume)
+        self.store.update(None, 0, _consume)
+
+        self.assertEqual(1, self.store.get('user1', 0)[0])
+        self.assertEqual(1, self.store.get('user1', 1)[0])
+        self.assertEqual(1, self.store.get(u'user\xe9', 0)[0])
+        self.assertEqual(1, self.store.get(None, 0)[0])
+
+
+class LocalBucketStoreTest(BucketStoreTestMixin, test.TestCase):
+
+    def setUp(self):
+        super(LocalBucketStoreTest, self).setUp()
+        self.store = ratelimit.LocalBucketStore(10)
+
+    def test_forgets_least_recently_seen_user(self):
+        self.store.max_users = 2
+        self.store.update('user1', 0, _consume)
+        self.store.update('user2', 0, _consume)
+        self.store.update('user1', 0, _consume)
+        self.store.update('user3', 0, _consume)
+
+        self.assertEqual(None, self.store.get('user2', 0))
+        self.assertEqual(2, self.store.get('user1', 0)[0])
+        self.assertEqual(1, self.store.get('user3', 0)[0])
+
+
+class SharedMemoryBucketStoreTest(BucketStoreTestMixin, test.TestCase):
+
+    def setUp(self):
+        super(SharedMemoryBucketStoreTest, self).setUp()
+        self.store = ratelimit.SharedMemoryBucketStore(4)
+
+    def test_reuses_idlest_slot_when_full(self):
+        self.store.slots = ratelimit.SharedMemoryBucketStore.PROBES
+        for index in range(self.store.slots):
+            self.store.update('user1', index,
+                              lambda b: ((1, 10.0 + index, None, 0), None))
+        self.store.update('user1', 0, lambda b: ((1, 1.0, None, 0), None))
+
+        self.store.update('user2', 0, _consume)
+
+        self.assertEqual(None, self.store.get('user1', 0))
+        self.assertEqual(1, self.store.get('user2', 0)[0])
+        self.assertEqual(1, self.store.get('user1', 1)[0])
+
+
+class MemcacheBucketStoreTest(BucketStoreTestMixin, test.TestCase):
+
+    def setUp(self):
+        super(MemcacheBucketStoreTest, self).setUp()
+        self.store = ratelimit.MemcacheBucketStore(None)
+
+    def test_buckets_expire(self):
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        self.store.update('user1', 0, _consume)
+
+        timeutils.advance_time_seconds(self.store.EXPIRES + 1)
+
+        self.assertEqual(None, self.store.get('user1', 0))
+
+    def test_update_retries_after_concurrent_update(self):
+        client = self.store._client
+        real_cas = client.cas
+        calls = []
+
+        def racing_cas(key, value, time=0):
+            calls.append(key)
+            if len(calls) == 1:
+                real_cas(key, (5, 1.0, None, 0), time=time)
+                return False
+            return real_cas(key, value, time=time)
+
+        self.stubs.Set(client, 'cas', racing_cas)
+        self.store.update('user1', 0, _consume)
+
+        self.assertEqual(5, self.store.update('user1', 0, _consume))
+        self.assertEqual(6, self.store.get('user1', 0)[0])
+
+
+class GetBucketStoreTest(test.TestCase):
+
+    def test_local(self):
+        self.assertTrue(isinstance(ratelimit.get_bucket_store(),
+                                   ratelimit.LocalBucketStore))
+
+    def test_shared_memory(self):
+        self.flags(ratelimit_backend='shared_memory')
+        self.assertTrue(isinstance(ratelimit.get_bucket_store(),
+                                   ratelimit.SharedMemoryBucketStore))
+
+    def test_memcached(self):
+        self.flags(ratelimit_backend='memcached')
+        self.assertTrue(isinstance(ratelimit.get_bucket_store(),
+                                   ratelimit.MemcacheBucketStore))
+
+    def test_unknown(self):
+        self.flags(ratelimit_backend='foo')
+        self.assertRaises(ValueError, ratelimit.get_bucket_store)
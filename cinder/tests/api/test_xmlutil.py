@@ -627,6 +627,40 @@ class TemplateTest(test.TestCase):
                          str(obj['test']['image']['id']))
         self.assertEqual(result[idx].text, obj['test']['image']['name'])
 
+    def test_compiled_tree_shared_by_copies(self):
+        root = xmlutil.TemplateElement('test', selector='test')
+        xmlutil.SubTemplateElement(root, 'value', selector='values')
+        master = xmlutil.MasterTemplate(root, 1)
+        obj = {'test': {'values': [1, 2]}}
+
+        master.serialize(obj)
+        compiled = master._get_compiled(master._siblings())
+        self.assertTrue(master.copy()._get_compiled([root]) is compiled)
+
+        xmlutil.SubTemplateElement(root, 'name', selector='name')
+        self.assertFalse(master._get_compiled([root]) is compiled)
+
+    def test_make_tree_matches__serialize(self):
+        obj = {'test': {'name': 'foobar',
+                        'values': [1, 2, 3],
+                        'image': {'name': 'image_foobar', 'id': 42}}}
+        root = xmlutil.TemplateElement('test', selector='test',
+                                       name='name')
+        value = xmlutil.SubTemplateElement(root, 'value', selector='values')
+        value.text = xmlutil.Selector()
+        master = xmlutil.MasterTemplate(root, 1)
+        root_slave = xmlutil.TemplateElement('test', selector='test')
+        image = xmlutil.SubTemplateElement(root_slave, 'image',
+                                           selector='image', id='id')
+        image.text = xmlutil.Selector('name')
+        master.attach(xmlutil.SlaveTemplate(root_slave, 1))
+
+        expected = master._serialize(None, obj, master._siblings(),
+                                     master._nsmap())
+        result = master.make_tree(obj)
+
+        self.assertEqual(etree.tostring(result), etree.tostring(expected))
+
 
 class MasterTemplateBuilder(xmlutil.TemplateBuilder):
     def construct(self):
@@ -552,6 +552,17 @@ class LimiterTest(BaseLimitTestSuite):
         self.assertEqual(expected, results)
 
 
+class SharedMemoryLimiterTest(LimiterTest):
+    """
+    Tests for the `limits.Limiter` class with buckets in shared memory.
+    """
+
+    def setUp(self):
+        """Run before each test."""
+        self.flags(ratelimit_backend='shared_memory')
+        super(SharedMemoryLimiterTest, self).setUp()
+
+
 class WsgiLimiterTest(BaseLimitTestSuite):
     """
     Tests for `limits.WsgiLimiter` class.
@@ -21,6 +21,7 @@ import mox
 from cinder.brick.local_dev import lvm as brick
 from cinder.openstack.common import log as logging
 from cinder.openstack.common import processutils
+from cinder.openstack.common import timeutils
 from cinder import test
 from cinder.volume import configuration as conf
 
@@ -58,6 +59,16 @@ class BrickLvmTestCase(test.TestCase):
         data = "\n"
         if 'vgs, --noheadings, -o, name' == cmd_string:
             data = "  fake-volumes\n"
+        elif 'vgs, --noheadings, --unit=g, --separator, :, -o, '\
+                'vg_name,vg_size,vg_free,lv_count,vg_uuid,lv_name,lv_size,'\
+                'lv_attr, fake-volumes' == cmd_string:
+            data = "  fake-volumes:10.00g:8.00g:2:"\
+                   "kVxztV-dKpG-Rz7E-xtKY-jeju-QsYU-SLG6Z1:"\
+                   "fake-1:1.00g:owi-a-\n"
+            data += "  fake-volumes:10.00g:8.00g:2:"\
+                    "kVxztV-dKpG-Rz7E-xtKY-jeju-QsYU-SLG6Z1:"\
+                    "fake-2:1.00g:-wi-a-\n"
+            return (data, "")
         if 'vgs, --version' in cmd_string:
             data = "  LVM version:     2.02.95(2) (2012-03-06)\n"
         elif 'vgs, --noheadings, -o uuid, fake-volumes' in cmd_string:
@@ -126,3 +137,55 @@ class BrickLvmTestCase(test.TestCase):
 
         self.stubs.Set(processutils, 'execute', self.fake_old_lvm_version)
         self.assertFalse(self.vg.supports_thin_provisioning())
+
+    def _count_commands(self):
+        cmds = []
+
+        def counting_execute(*cmd, **kwargs):
+            cmds.append(cmd)
+            return self.fake_execute(*cmd, **kwargs)
+        self.vg._execute = counting_execute
+        return cmds
+
+    def test_metadata_is_cached(self):
+        cmds = self._count_commands()
+
+        self.assertEqual(self.vg.get_volume('fake-2')['size'], '1.00g')
+        self.assertEqual(len(self.vg.get_volumes()), 2)
+        self.assertEqual(self.vg.update_volume_group_info()['available'],
+                         '8.00g')
+        self.assertTrue(self.vg.lv_has_snapshot('fake-1'))
+        self.assertFalse(self.vg.lv_has_snapshot('fake-2'))
+
+        self.assertEqual(len(cmds), 1)
+
+    def test_metadata_expires(self):
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        cmds = self._count_commands()
+
+        self.vg.get_volume('fake-1')
+        timeutils.advance_time_seconds(self.vg.cache_ttl + 1)
+        self.vg.get_volume('fake-1')
+
+        self.assertEqual(len(cmds), 2)
+
+    def test_changes_invalidate_metadata(self):
+        cmds = self._count_commands()
+
+        self.vg.get_volume('fake-1')
+        self.vg.delete('fake-1')
+        self.vg.get_volume('fake-1')
+        self.vg.extend_volume('fake-2', '2')
+        self.vg.get_volume('fake-2')
+
+        self.assertEqual(len(cmds), 5)
+        self.assertEqual(cmds[3][:3], ('lvextend', '-L', '2g'))
+
+    def test_empty_volume_group(self):
+        self.vg._execute = lambda *cmd, **kwargs: (
+            "  fake-volumes:10.00g:10.00g:0:"
+            "kVxztV-dKpG-Rz7E-xtKY-jeju-QsYU-SLG6Z1:::\n", "")
+
+        self.assertEqual(self.vg.get_volumes(), [])
+        self.assertEqual(self.vg.update_volume_group_info()['lv_count'], '0')
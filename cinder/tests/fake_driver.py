@@ -12,6 +12,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from oslo.config import cfg
+
 from cinder.openstack.common import log as logging
 from cinder.volume import driver
 from cinder.volume.drivers import lvm
@@ -19,6 +21,8 @@ from cinder.volume.drivers import lvm
 
 LOG = logging.getLogger(__name__)
 
+CONF = cfg.CONF
+
 
 class FakeISCSIDriver(lvm.LVMISCSIDriver):
     """Logs calls instead of executing."""
@@ -43,6 +47,9 @@ class FakeISCSIDriver(lvm.LVMISCSIDriver):
     def fake_execute(cmd, *_args, **_kwargs):
         """Execute that simply logs the command."""
         LOG.debug(_("FAKE ISCSI: %s"), cmd)
+        if (cmd, _args) == ('vgs', ('--noheadings', '-o', 'name')):
+            # the VG exists, without any LV
+            return ('  %s\n' % CONF.volume_group, None)
         return (None, None)
 
 
@@ -151,8 +151,9 @@ class _FakeImageService(object):
         """Return list of detailed image information."""
         return copy.deepcopy(self.images.values())
 
-    def download(self, context, image_id, data):
-        self.show(context, image_id)
+    def download(self, context, image_id, data, image_meta=None):
+        if image_meta is None:
+            self.show(context, image_id)
         data.write(self._imagedata.get(image_id, ''))
 
     def show(self, context, image_id):
@@ -0,0 +1,115 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2013 OpenStack, LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the image cache."""
+
+import os
+import shutil
+import tempfile
+
+from cinder.image import cache
+from cinder import test
+
+
+class ImageCacheTestCase(test.TestCase):
+
+    def setUp(self):
+        super(ImageCacheTestCase, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.flags(lock_path=self.tempdir)
+        self.cache_dir = os.path.join(self.tempdir, 'cache')
+        self.cache = cache.ImageCache(self.cache_dir, 1024 * 1024, 2)
+        self.fills = []
+
+    def _fill(self, path):
+        self.fills.append(path)
+        with open(path, 'wb') as f:
+            f.write('x' * 4096)
+
+    def _fetch(self, image_id, mtime=None):
+        with self.cache.fetch(image_id, {'checksum': 'sum'},
+                              self._fill) as path:
+            pass
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def test_cache_key(self):
+        self.assertEqual('image-sum', cache.cache_key('image',
+                                                      {'checksum': 'sum'}))
+        self.assertEqual(None, cache.cache_key('image', {'checksum': None}))
+
+    def test_miss_then_hit(self):
+        path = self._fetch('image1')
+        self.assertEqual(path, self._fetch('image1'))
+
+        self.assertEqual(os.path.join(self.cache_dir, 'image1-sum'), path)
+        self.assertEqual([path + cache.ImageCache.PARTIAL_SUFFIX], self.fills)
+        with open(path) as f:
+            self.assertEqual('x' * 4096, f.read())
+
+    def test_failed_fill_leaves_nothing(self):
+        def fill(path):
+            raise test.TestingException()
+
+        def fetch():
+            with self.cache.fetch('image1', {'checksum': 'sum'}, fill):
+                pass
+
+        self.assertRaises(test.TestingException, fetch)
+        self.assertEqual([], os.listdir(self.cache_dir))
+
+    def test_evicts_least_recently_used(self):
+        self._fetch('image1', mtime=100)
+        self._fetch('image2', mtime=200)
+        self._fetch('image1', mtime=300)
+        self._fetch('image3')
+
+        self.assertEqual(['image1-sum', 'image3-sum'],
+                         sorted(os.listdir(self.cache_dir)))
+
+    def test_image_in_use_not_evicted(self):
+        self._fetch('image1', mtime=100)
+        with self.cache.fetch('image2', {'checksum': 'sum'},
+                              self._fill) as path:
+            os.utime(path, (200, 200))
+            self._fetch('image3')
+            self._fetch('image4')
+
+            self.assertEqual(['image2-sum', 'image4-sum'],
+                             sorted(os.listdir(self.cache_dir)))
+
+    def test_evicts_by_size(self):
+        self.cache.max_size = 8192
+        self.cache.max_count = 10
+        self._fetch('image1', mtime=100)
+        self._fetch('image2', mtime=200)
+        self._fetch('image3')
+
+        self.assertEqual(['image2-sum', 'image3-sum'],
+                         sorted(os.listdir(self.cache_dir)))
+
+    def test_get_image_cache(self):
+        self.assertEqual(None, cache.get_image_cache())
+
+        self.flags(image_cache_dir=self.cache_dir, image_cache_max_size=2,
+                   image_cache_max_count=3)
+        image_cache = cache.get_image_cache()
+
+        self.assertEqual(self.cache_dir, image_cache.path)
+        self.assertEqual(2 * 1024 ** 3, image_cache.max_size)
+        self.assertEqual(3, image_cache.max_count)
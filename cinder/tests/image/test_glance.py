@@ -17,6 +17,8 @@
 
 
 import datetime
+import hashlib
+import StringIO
 
 import glanceclient.exc
 from glanceclient.v2.client import Client as glanceclient_v2
@@ -39,6 +41,42 @@ class NullWriter(object):
         pass
 
 
+class FakeResponse(object):
+    def __init__(self, status):
+        self.status = status
+
+
+class RangeGlanceStubClient(glance_stubs.StubGlanceClient):
+    """A client serving the data of image 1, honouring ranges if asked to.
+
+    The first `short` ranges requested are returned one byte short.
+    """
+
+    def __init__(self, data, ranged=True, short=0, checksum=None):
+        super(RangeGlanceStubClient, self).__init__(
+            [{'id': '1', 'size': len(data),
+              'checksum': checksum or hashlib.md5(data).hexdigest()}])
+        self.image_data = data
+        self.ranged = ranged
+        self.short = short
+        self.requests = []
+
+    def data(self, image_id):
+        self.get(image_id)
+        return [self.image_data]
+
+    def raw_request(self, method, url, headers):
+        self.requests.append(headers['Range'])
+        if not self.ranged:
+            return FakeResponse(200), [self.image_data]
+        start, end = map(int, headers['Range'][len('bytes='):].split('-'))
+        chunk = self.image_data[start:end + 1]
+        if self.short:
+            self.short -= 1
+            chunk = chunk[:-1]
+        return FakeResponse(206), [chunk]
+
+
 class TestGlanceSerializer(test.TestCase):
     def test_serialize(self):
         metadata = {'name': 'image1',
@@ -470,6 +508,79 @@ class TestGlanceImageService(test.TestCase):
         self.flags(glance_num_retries=1)
         service.download(self.context, image_id, writer)
 
+    def _download(self, client):
+        service = self._create_image_service(client)
+        writer = StringIO.StringIO()
+        service.download(self.context, '1', writer)
+        return writer.getvalue()
+
+    def test_download_ranges(self):
+        self.flags(glance_download_workers=2, glance_download_range_size=1)
+        data = ''.join(chr(i % 251) for i in range(5 * 1024 * 512))
+        client = RangeGlanceStubClient(data)
+
+        self.assertEqual(data, self._download(client))
+        self.assertEqual(['bytes=0-1048575',
+                          'bytes=1048576-2097151',
+                          'bytes=2097152-2621439'], client.requests)
+
+    def test_download_retries_failed_range(self):
+        self.flags(glance_download_workers=2, glance_download_range_size=1,
+                   glance_num_retries=1)
+        data = 'x' * 3 * 1024 * 1024
+        client = RangeGlanceStubClient(data, short=1)
+
+        self.assertEqual(data, self._download(client))
+        self.assertEqual(['bytes=0-1048575',
+                          'bytes=0-1048575',
+                          'bytes=1048576-2097151',
+                          'bytes=2097152-3145727'], client.requests)
+
+    def test_download_gives_up_on_failed_range(self):
+        self.flags(glance_download_workers=2, glance_download_range_size=1,
+                   glance_num_retries=0)
+        client = RangeGlanceStubClient('x' * 3 * 1024 * 1024, short=1)
+
+        self.assertRaises(exception.GlanceConnectionFailed, self._download,
+                          client)
+
+    def test_download_ranges_not_honoured(self):
+        self.flags(glance_download_workers=2, glance_download_range_size=1)
+        data = 'x' * 3 * 1024 * 1024
+        client = RangeGlanceStubClient(data, ranged=False)
+
+        self.assertEqual(data, self._download(client))
+        self.assertEqual(['bytes=0-1048575'], client.requests)
+
+    def test_download_single_request(self):
+        self.flags(glance_download_workers=1)
+        client = RangeGlanceStubClient('x' * 100)
+
+        self.assertEqual('x' * 100, self._download(client))
+        self.assertEqual([], client.requests)
+
+    def test_download_checksum_mismatch(self):
+        client = RangeGlanceStubClient('x' * 100, checksum='foo')
+
+        self.assertRaises(exception.ImageUnacceptable, self._download,
+                          client)
+
+    def test_download_given_image_meta(self):
+        client = RangeGlanceStubClient('x' * 100)
+        service = self._create_image_service(client)
+        self.stubs.Set(service, 'show', None)
+        writer = StringIO.StringIO()
+
+        self.assertRaises(exception.ImageUnacceptable, service.download,
+                          self.context, '1', writer,
+                          image_meta={'size': 100, 'checksum': 'foo'})
+        checksum = hashlib.md5('x' * 100).hexdigest()
+        writer = StringIO.StringIO()
+        service.download(self.context, '1', writer,
+                         image_meta={'size': 100, 'checksum': checksum})
+
+        self.assertEqual('x' * 100, writer.getvalue())
+
     def test_client_forbidden_converts_to_imagenotauthed(self):
         class MyGlanceStubClient(glance_stubs.StubGlanceClient):
             """A client that raises a Forbidden exception."""
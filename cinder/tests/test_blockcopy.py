@@ -0,0 +1,200 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2013 OpenStack, LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the in-process volume data copy."""
+
+import io
+import os
+import shutil
+import tempfile
+
+from eventlet import greenthread
+
+from cinder import test
+from cinder import units
+from cinder.volume import blockcopy
+from cinder.volume import utils as volume_utils
+
+
+BLOCK = 64 * units.KiB
+
+
+class BlockCopyTestCase(test.TestCase):
+
+    def setUp(self):
+        super(BlockCopyTestCase, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.src = os.path.join(self.tempdir, 'src')
+        self.dest = os.path.join(self.tempdir, 'dest')
+        self.data = ''.join(chr(i % 251) for i in range(BLOCK)) * 3
+        self.data += '\0' * BLOCK + 'x' * 100
+        with open(self.src, 'wb') as f:
+            f.write(self.data)
+        open(self.dest, 'wb').close()
+
+    def _dest_data(self):
+        with open(self.dest, 'rb') as f:
+            return f.read()
+
+    def test_copy(self):
+        for workers in (1, 2, 3, 8):
+            copied = blockcopy.copy(self.src, self.dest, len(self.data),
+                                    BLOCK, workers=workers)
+
+            self.assertEqual(len(self.data), copied)
+            self.assertEqual(self.data, self._dest_data())
+
+    def test_copy_stops_at_end_of_source(self):
+        copied = blockcopy.copy(self.src, self.dest, 10 * BLOCK, BLOCK,
+                                workers=3)
+
+        self.assertEqual(len(self.data), copied)
+        self.assertEqual(self.data, self._dest_data())
+
+    def test_copy_part(self):
+        blockcopy.copy(self.src, self.dest, BLOCK + 10, BLOCK)
+
+        self.assertEqual(self.data[:BLOCK + 10], self._dest_data())
+
+    def test_zero_blocks_are_not_written(self):
+        writes = []
+        real_write = blockcopy.BlockCopier._write
+
+        def fake_write(copier, fd, offset, buf, length):
+            writes.append(offset)
+            return real_write(copier, fd, offset, buf, length)
+        self.stubs.Set(blockcopy.BlockCopier, '_write', fake_write)
+
+        blockcopy.copy(self.src, self.dest, len(self.data), BLOCK,
+                       sparse=True)
+
+        self.assertEqual([0, BLOCK, 2 * BLOCK, 4 * BLOCK], sorted(writes))
+        self.assertEqual(self.data, self._dest_data())
+
+    def test_zero_blocks_written_by_default(self):
+        with open(self.dest, 'wb') as f:
+            f.write('y' * len(self.data) * 2)
+
+        blockcopy.copy(self.src, self.dest, len(self.data), BLOCK)
+
+        self.assertEqual(self.data + 'y' * len(self.data),
+                         self._dest_data())
+
+    def test_missing_dest_created_as_root(self):
+        cmds = []
+
+        def fake_execute(*cmd, **kwargs):
+            cmds.append((cmd, kwargs))
+            open(self.dest, 'wb').close()
+        os.unlink(self.dest)
+
+        blockcopy.copy(self.src, self.dest, len(self.data), BLOCK,
+                       execute=fake_execute)
+
+        self.assertEqual([(('truncate', '-s', 0, self.dest),
+                           {'run_as_root': True})], cmds)
+        self.assertEqual(self.data, self._dest_data())
+
+    def test_short_reads_continued(self):
+        class ShortFileIO(io.FileIO):
+            def readinto(self, b):
+                # reads half a block at most
+                data = self.read(BLOCK // 2)
+                b[:len(data)] = data
+                return len(data)
+
+        class FakeIO(object):
+            FileIO = ShortFileIO
+        self.stubs.Set(blockcopy, 'io', FakeIO)
+
+        copied = blockcopy.copy(self.src, self.dest, len(self.data), BLOCK)
+
+        self.assertEqual(len(self.data), copied)
+        self.assertEqual(self.data, self._dest_data())
+
+    def test_zero_source(self):
+        blockcopy.copy(blockcopy.ZERO_SOURCE, self.dest, 2 * BLOCK, BLOCK)
+
+        self.assertEqual('\0' * 2 * BLOCK, self._dest_data())
+
+    def test_zero_source_not_sparse(self):
+        writes = []
+        real_write = blockcopy.BlockCopier._write
+
+        def fake_write(copier, fd, offset, buf, length):
+            writes.append(offset)
+            return real_write(copier, fd, offset, buf, length)
+        self.stubs.Set(blockcopy.BlockCopier, '_write', fake_write)
+
+        blockcopy.copy(blockcopy.ZERO_SOURCE, self.dest, 2 * BLOCK, BLOCK,
+                       sparse=False)
+
+        self.assertEqual([0, BLOCK], sorted(writes))
+        self.assertEqual('\0' * 2 * BLOCK, self._dest_data())
+
+    def test_progress(self):
+        calls = []
+
+        blockcopy.copy(self.src, self.dest, len(self.data), BLOCK,
+                       progress=lambda *args: calls.append(args))
+
+        self.assertEqual([(BLOCK, len(self.data)),
+                          (2 * BLOCK, len(self.data)),
+                          (3 * BLOCK, len(self.data)),
+                          (4 * BLOCK, len(self.data)),
+                          (len(self.data), len(self.data))], calls)
+
+    def test_progress_aborts_copy(self):
+        class Abort(Exception):
+            pass
+
+        def progress(copied, size):
+            raise Abort()
+
+        self.assertRaises(Abort, blockcopy.copy, self.src, self.dest,
+                          len(self.data), BLOCK, progress=progress,
+                          workers=2)
+
+    def test_rate_limit(self):
+        sleeps = []
+        self.stubs.Set(greenthread, 'sleep', sleeps.append)
+
+        blockcopy.copy(self.src, self.dest, 2 * BLOCK, BLOCK,
+                       rate=BLOCK, workers=1)
+
+        self.assertEqual(2, len(sleeps))
+        self.assertTrue(0.9 < sleeps[0] <= 1.0)
+        self.assertTrue(1.9 < sleeps[1] <= 2.0)
+
+    def test_copy_volume(self):
+        with open(self.src, 'wb') as f:
+            f.write('z' * 2 * units.MiB)
+
+        volume_utils.copy_volume(self.src, self.dest, 1)
+
+        self.assertEqual('z' * units.MiB, self._dest_data())
+
+    def test_copy_volume_reflink(self):
+        self.flags(use_lightweight_copy_for_clone_volume=True)
+        cmds = []
+
+        def fake_execute(*cmd, **kwargs):
+            cmds.append(cmd)
+        volume_utils.copy_volume(self.src, self.dest, 1,
+                                 execute=fake_execute)
+
+        self.assertEqual([('cp', '--reflink', self.src, self.dest)], cmds)
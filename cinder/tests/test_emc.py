@@ -151,6 +151,10 @@ class SE_ConcreteJob(dict):
     pass
 
 
+class SE_StorageHardwareID(dict):
+    pass
+
+
 class FakeEcomConnection():
 
     def InvokeMethod(self, MethodName, Service, ElementName=None, InPool=None,
@@ -198,6 +202,10 @@ class FakeEcomConnection():
             myjob['status'] = 'failure'
 
         job = {'Job': myjob}
+        if rc == 0L and MethodName == 'CreateOrModifyElementFromStoragePool':
+            for vol in self._enum_storagevolumes():
+                if vol['ElementName'] == ElementName:
+                    job['TheElement'] = vol.path
         return rc, job
 
     def EnumerateInstanceNames(self, name):
@@ -228,12 +236,16 @@ class FakeEcomConnection():
             result = self._default_enum()
         return result
 
-    def EnumerateInstances(self, name):
+    def EnumerateInstances(self, name, PropertyList=None):
         result = None
         if name == 'EMC_VirtualProvisioningPool':
             result = self._enum_pool_details()
         elif name == 'EMC_UnifiedStoragePool':
             result = self._enum_pool_details()
+        elif name == 'EMC_StorageVolume':
+            result = self._enum_storagevolumes()
+        elif name == 'SE_StorageHardwareID':
+            result = self._enum_hdwids()
         else:
             result = self._default_enum()
         return result
@@ -244,7 +256,7 @@ class FakeEcomConnection():
         except KeyError:
             name = objectpath.classname
         result = None
-        if name == 'Clar_StorageVolume':
+        if name in ('Clar_StorageVolume', 'Symm_StorageVolume'):
             result = self._getinstance_storagevolume(objectpath)
         elif name == 'CIM_ProtocolControllerForUnit':
             result = self._getinstance_unit(objectpath)
@@ -278,10 +290,13 @@ class FakeEcomConnection():
         return result
 
     def ReferenceNames(self, objectpath,
-                       ResultClass='CIM_ProtocolControllerForUnit'):
+                       ResultClass='CIM_ProtocolControllerForUnit',
+                       Role=None):
         result = None
         if ResultClass == 'CIM_ProtocolControllerForUnit':
             result = self._ref_unitnames()
+        elif ResultClass == 'SE_StorageSynchronized_SV_SV':
+            result = self._ref_syncsvsvs(objectpath, Role)
         else:
             result = self._default_ref(objectpath)
         return result
@@ -308,6 +323,10 @@ class FakeEcomConnection():
 
         return units
 
+    def _ref_syncsvsvs(self, objectpath, role):
+        return [sync for sync in self._enum_syncsvsvs()
+                if sync[role]['DeviceID'] == objectpath['DeviceID']]
+
     def _default_ref(self, objectpath):
         return objectpath
 
@@ -526,6 +545,8 @@ class FakeEcomConnection():
         failed_delete_vol.path = {'DeviceID': failed_delete_vol['DeviceID']}
         vols.append(failed_delete_vol)
 
+        for vol in vols:
+            vol.path['CreationClassName'] = vol['CreationClassName']
         return vols
 
     def _enum_syncsvsvs(self):
@@ -580,6 +601,14 @@ class FakeEcomConnection():
         ctrls.append(ctrl)
         return ctrls
 
+    def _enum_hdwids(self):
+        hdwids = []
+        hdwid = SE_StorageHardwareID()
+        hdwid['StorageID'] = initiator1
+        hdwid.path = {'InstanceID': initiator1}
+        hdwids.append(hdwid)
+        return hdwids
+
     def _enum_processors(self):
         ctrls = []
         ctrl = {}
@@ -665,6 +694,29 @@ class EMCSMISISCSIDriverTestCase(test.TestCase):
     def test_get_volume_stats(self):
         self.driver.get_volume_stats(True)
 
+    def test_get_volume_stats_shared(self):
+        self.flags(lock_path=self.tempdir,
+                   array_stats_dir=os.path.join(self.tempdir, 'stats'),
+                   array_stats_cache_interval=60)
+        enumerations = []
+        real_enumerate = FakeEcomConnection.EnumerateInstances
+
+        def fake_enumerate(conn, name, PropertyList=None):
+            enumerations.append(name)
+            return real_enumerate(conn, name, PropertyList=PropertyList)
+        self.stubs.Set(FakeEcomConnection, 'EnumerateInstances',
+                       fake_enumerate)
+        other_driver = EMCSMISISCSIDriver(
+            configuration=self.driver.configuration)
+
+        stats = self.driver.get_volume_stats(True)
+        other_stats = other_driver.get_volume_stats(True)
+
+        self.assertEqual(12345678, stats['total_capacity_gb'])
+        self.assertEqual(123456, other_stats['free_capacity_gb'])
+        self.assertEqual(['EMC_UnifiedStoragePool',
+                          'EMC_VirtualProvisioningPool'], enumerations)
+
     def test_create_destroy(self):
         self.driver.create_volume(test_volume)
         self.driver.delete_volume(test_volume)
@@ -756,6 +808,71 @@ class EMCSMISISCSIDriverTestCase(test.TestCase):
                           self.driver.delete_volume,
                           failed_delete_vol)
 
+    def _count_volume_enumerations(self):
+        calls = []
+        real_enumerate = FakeEcomConnection.EnumerateInstances
+
+        def fake_enumerate(conn, name, PropertyList=None):
+            if name == 'EMC_StorageVolume':
+                calls.append(PropertyList)
+            return real_enumerate(conn, name, PropertyList)
+        self.stubs.Set(FakeEcomConnection, 'EnumerateInstances',
+                       fake_enumerate)
+        return calls
+
+    def test_find_lun_uses_index(self):
+        calls = self._count_volume_enumerations()
+        volume = {'name': test_volume['name']}
+        self.driver.create_volume(test_volume)
+
+        export = self.driver.create_export(None, volume)
+
+        self.assertEqual(test_volume['id'], export['provider_location'])
+        self.assertEqual(test_volume['id'], volume['provider_location'])
+        self.assertEqual([], calls)
+
+    def test_find_lun_refreshes_index_on_miss(self):
+        calls = self._count_volume_enumerations()
+        common = self.driver.common
+        common._index_lun(test_volume['name'],
+                          {'CreationClassName': 'Clar_StorageVolume',
+                           'DeviceID': 'gone'})
+
+        instance = common._find_lun({'name': test_volume['name']})
+        common._find_lun({'name': test_snapshot['name']})
+
+        self.assertEqual(test_volume['id'], instance['DeviceID'])
+        self.assertEqual([['ElementName', 'DeviceID']], calls)
+        self.assertFalse('gone' in common._lun_paths)
+
+    def test_map_unmap_follows_associations(self):
+        enumerations = []
+        real_enumerate = FakeEcomConnection.EnumerateInstanceNames
+
+        def fake_enumerate(conn, name):
+            enumerations.append(name)
+            return real_enumerate(conn, name)
+        self.stubs.Set(FakeEcomConnection, 'EnumerateInstanceNames',
+                       fake_enumerate)
+        connector = {'initiator': initiator1}
+        common = self.driver.common
+
+        ctrl = common._find_lunmasking_scsi_protocol_controller(
+            storage_system, connector)
+        device_number = common._find_avail_device_number(ctrl)
+
+        self.assertEqual(lunmaskctrl_id, ctrl['DeviceID'])
+        self.assertEqual('000001', device_number)
+        self.assertEqual([], enumerations)
+
+    def test_delete_volume_forgets_lun(self):
+        self.driver.create_volume(test_volume)
+        self.driver.delete_volume(test_volume)
+
+        self.assertFalse(test_volume['name'] in
+                         self.driver.common._lun_device_ids)
+        self.assertFalse(test_volume['id'] in self.driver.common._lun_paths)
+
     def _cleanup(self):
         bExists = os.path.exists(self.config_file_path)
         if bExists:
@@ -68,6 +68,9 @@ class GlusterFsDriverTestCase(test.TestCase):
             self.TEST_MNT_POINT_BASE
         self._configuration.glusterfs_disk_util = 'df'
         self._configuration.glusterfs_sparsed_volumes = True
+        self._configuration.remotefs_allocated_reconcile_interval = 600
+        self._configuration.remotefs_capacity_cache_ttl = 5
+        self._configuration.remotefs_share_selection_policy = None
 
         self.stubs = stubout.StubOutForTesting()
         self._driver =\
@@ -249,7 +252,7 @@ class GlusterFsDriverTestCase(test.TestCase):
 
         mox.StubOutWithMock(drv, '_get_mount_point_for_share')
         drv._get_mount_point_for_share(self.TEST_EXPORT1).\
-            AndReturn(self.TEST_MNT_POINT)
+            MultipleTimes().AndReturn(self.TEST_MNT_POINT)
 
         mox.StubOutWithMock(drv, '_execute')
         drv._execute('df', '--portability', '--block-size', '1',
@@ -257,7 +260,7 @@ class GlusterFsDriverTestCase(test.TestCase):
                      run_as_root=True).\
             AndReturn((df_output, None))
         drv._execute('du', '-sb', '--apparent-size',
-                     '--exclude', '*snapshot*',
+                     '--exclude', '.snapshot',
                      self.TEST_MNT_POINT,
                      run_as_root=True).AndReturn((du_output, None))
 
@@ -545,6 +548,7 @@ class GlusterFsDriverTestCase(test.TestCase):
         volume = DumbVolume()
         volume['name'] = 'volume-123'
         volume['provider_location'] = self.TEST_EXPORT1
+        volume['size'] = self.TEST_SIZE_IN_GB
 
         mox.StubOutWithMock(drv, 'local_path')
         drv.local_path(volume).AndReturn(self.TEST_LOCAL_PATH)
@@ -568,6 +572,7 @@ class GlusterFsDriverTestCase(test.TestCase):
         volume = DumbVolume()
         volume['name'] = 'volume-123'
         volume['provider_location'] = self.TEST_EXPORT1
+        volume['size'] = self.TEST_SIZE_IN_GB
 
         mox.StubOutWithMock(drv, '_ensure_share_mounted')
         drv._ensure_share_mounted(self.TEST_EXPORT1)
@@ -17,9 +17,14 @@
 """Unit tests for image utils."""
 
 import contextlib
+import hashlib
 import mox
+import os
+import shutil
+import tempfile
 import textwrap
 
+from cinder import exception
 from cinder.image import image_utils
 from cinder import test
 from cinder import utils
@@ -48,6 +53,188 @@ class TestUtils(test.TestCase):
         mox.VerifyAll()
 
 
+class FakeImageService(object):
+    def __init__(self, data, disk_format='raw', checksum=None):
+        self.data = data
+        self.meta = {'disk_format': disk_format,
+                     'container_format': 'bare',
+                     'size': len(data),
+                     'checksum': checksum or hashlib.md5(data).hexdigest()}
+
+    def show(self, context, image_id):
+        return self.meta
+
+    def update(self, context, image_id, image_meta, data):
+        chunks = []
+        chunk = data.read(4096)
+        while chunk:
+            chunks.append(chunk)
+            chunk = data.read(4096)
+        self.data = ''.join(chunks)
+        return {'checksum': hashlib.md5(self.data).hexdigest()}
+
+    def download(self, context, image_id, data, image_meta=None):
+        self.downloaded_meta = image_meta
+        if self.meta['checksum'] != hashlib.md5(self.data).hexdigest():
+            raise exception.ImageUnacceptable(image_id=image_id,
+                                              reason='checksum')
+        for i in range(0, len(self.data), 4096):
+            data.write(self.data[i:i + 4096])
+
+
+class TestFetchToRaw(test.TestCase):
+    def setUp(self):
+        super(TestFetchToRaw, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.dest = os.path.join(self.tempdir, 'volume')
+        self.stubs.Set(image_utils, 'qemu_img_info',
+                       lambda path: image_utils.QemuImgInfo(
+                           'file format: raw'))
+
+    def _dest_data(self):
+        with open(self.dest, 'rb') as f:
+            return f.read()
+
+    def test_raw_image_is_streamed(self):
+        data = 'a' * 4096 + '\0' * 8192 + 'b' * 100 + '\0' * 4096
+        self.stubs.Set(image_utils, 'fetch', None)
+
+        image_service = FakeImageService(data)
+
+        image_utils.fetch_to_raw(None, image_service, 'image', self.dest)
+
+        self.assertEqual(data, self._dest_data())
+        self.assertEqual(image_service.meta, image_service.downloaded_meta)
+
+    def test_checksum_mismatch(self):
+        self.assertRaises(exception.ImageUnacceptable,
+                          image_utils.fetch_to_raw, None,
+                          FakeImageService('a' * 100, checksum='foo'),
+                          'image', self.dest)
+
+    def test_disguised_image_is_converted(self):
+        data = 'QFI\xfb' + '\0' * 100
+        converted = []
+        self.stubs.Set(image_utils, 'convert_image',
+                       lambda src, dest, fmt: converted.append(dest))
+        self.flags(image_conversion_dir=self.tempdir)
+
+        image_utils.fetch_to_raw(None, FakeImageService(data), 'image',
+                                 self.dest)
+
+        self.assertEqual([self.dest], converted)
+        self.assertEqual('', self._dest_data())
+
+    def test_image_cache(self):
+        cache_dir = os.path.join(self.tempdir, 'cache')
+        self.flags(image_cache_dir=cache_dir, lock_path=self.tempdir)
+        image_service = FakeImageService('a' * 100)
+        downloads = []
+        real_download = image_service.download
+
+        def download(context, image_id, data, image_meta=None):
+            downloads.append(image_id)
+            real_download(context, image_id, data, image_meta=image_meta)
+        self.stubs.Set(image_service, 'download', download)
+        converted = []
+        self.stubs.Set(image_utils, 'convert_image',
+                       lambda src, dest, fmt: converted.append((src, dest)))
+
+        image_utils.fetch_to_raw(None, image_service, 'image', self.dest)
+        image_utils.fetch_to_raw(None, image_service, 'image', 'dest2')
+
+        cached = os.path.join(cache_dir,
+                              'image-%s' % image_service.meta['checksum'])
+        self.assertEqual(['image'], downloads)
+        self.assertEqual([(cached, self.dest), (cached, 'dest2')], converted)
+        with open(cached) as f:
+            self.assertEqual('a' * 100, f.read())
+
+    def test_streaming_disabled(self):
+        self.flags(image_stream_raw=False,
+                   image_conversion_dir=self.tempdir)
+        converted = []
+        self.stubs.Set(image_utils, 'convert_image',
+                       lambda src, dest, fmt: converted.append(dest))
+
+        image_utils.fetch_to_raw(None, FakeImageService('a' * 100), 'image',
+                                 self.dest)
+
+        self.assertEqual([self.dest], converted)
+
+
+class TestUploadVolume(test.TestCase):
+    def setUp(self):
+        super(TestUploadVolume, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.volume = os.path.join(self.tempdir, 'volume')
+        self.data = 'a' * 10000
+        with open(self.volume, 'wb') as f:
+            f.write(self.data)
+        self.image_service = FakeImageService('')
+
+    def test_raw_volume_is_streamed(self):
+        self.stubs.Set(image_utils, 'convert_image', None)
+
+        image_utils.upload_volume(None, self.image_service,
+                                  {'id': 'image', 'disk_format': 'raw'},
+                                  self.volume)
+
+        self.assertEqual(self.data, self.image_service.data)
+
+    def test_checksum_mismatch(self):
+        self.stubs.Set(self.image_service, 'update',
+                       lambda c, i, m, data: {'checksum': 'foo'})
+
+        self.assertRaises(exception.ImageUnacceptable,
+                          image_utils.upload_volume, None,
+                          self.image_service,
+                          {'id': 'image', 'disk_format': 'raw'}, self.volume)
+
+    def test_other_formats_are_converted(self):
+        self.flags(image_conversion_dir=self.tempdir)
+        converted = []
+
+        def fake_convert_image(source, dest, fmt):
+            converted.append((source, fmt))
+            with open(dest, 'wb') as f:
+                f.write('converted')
+        self.stubs.Set(image_utils, 'convert_image', fake_convert_image)
+        self.stubs.Set(image_utils, 'qemu_img_info',
+                       lambda path: image_utils.QemuImgInfo(
+                           'file format: qcow2'))
+
+        image_utils.upload_volume(None, self.image_service,
+                                  {'id': 'image', 'disk_format': 'qcow2'},
+                                  'rbd:pool/volume')
+
+        self.assertEqual([('rbd:pool/volume', 'qcow2')], converted)
+        self.assertEqual('converted', self.image_service.data)
+        self.assertEqual(['volume'], os.listdir(self.tempdir))
+
+    def test_qcow2_volume_is_converted_to_raw(self):
+        self.flags(image_conversion_dir=self.tempdir)
+        converted = []
+
+        def fake_convert_image(source, dest, fmt):
+            converted.append((source, fmt))
+            with open(dest, 'wb') as f:
+                f.write('converted')
+        self.stubs.Set(image_utils, 'convert_image', fake_convert_image)
+        self.stubs.Set(image_utils, 'qemu_img_info',
+                       lambda path: image_utils.QemuImgInfo(
+                           'file format: raw'))
+
+        image_utils.upload_volume(None, self.image_service,
+                                  {'id': 'image', 'disk_format': 'raw'},
+                                  self.volume, 'qcow2')
+
+        self.assertEqual([(self.volume, 'raw')], converted)
+        self.assertEqual('converted', self.image_service.data)
+
+
 class TestExtractTo(test.TestCase):
     def test_extract_to_calls_tar(self):
         mox = self.mox
@@ -20,6 +20,7 @@ import string
 import tempfile
 
 from cinder.brick.iscsi import iscsi
+from cinder.openstack.common import timeutils
 from cinder import test
 from cinder.volume import utils as volume_utils
 
@@ -102,9 +103,16 @@ class TgtAdmTestCase(test.TestCase, TargetAdminTestCase):
         self.flags(volumes_dir=self.persist_tempdir)
         self.script_template = "\n".join([
             'tgt-admin --update iqn.2011-09.org.foo.bar:blaa',
+            'tgtadm --lld iscsi --op show --mode target',
             'tgt-admin --force '
             '--delete iqn.2010-10.org.openstack:volume-blaa'])
 
+    def fake_execute(self, *cmd, **kwargs):
+        self.cmds.append(string.join(cmd))
+        if cmd[0] == 'tgtadm':
+            return 'Target 1: iqn.2010-10.org.openstack:blaa\n', None
+        return "", None
+
     def tearDown(self):
         try:
             shutil.rmtree(self.persist_tempdir)
@@ -112,6 +120,99 @@ class TgtAdmTestCase(test.TestCase, TargetAdminTestCase):
             pass
         super(TgtAdmTestCase, self).tearDown()
 
+    def test_get_targets(self):
+        out = "\n".join([
+            'Target 1: iqn.2010-10.org.openstack:volume-a',
+            '    System information:',
+            '        Driver: iscsi',
+            'Target 12: iqn.2010-10.org.openstack:volume-b',
+            '    System information:'])
+        tgtadm = iscsi.get_target_admin()
+        tgtadm.set_execute(lambda *args, **kwargs: (out, ''))
+
+        self.assertEqual(tgtadm.get_targets(),
+                         {'iqn.2010-10.org.openstack:volume-a': '1',
+                          'iqn.2010-10.org.openstack:volume-b': '12'})
+
+    def _counting_tgtadm(self, out):
+        calls = []
+
+        def fake_execute(*args, **kwargs):
+            calls.append(args)
+            return out, ''
+
+        tgtadm = iscsi.get_target_admin()
+        tgtadm.set_execute(fake_execute)
+        return tgtadm, calls
+
+    def test_get_target_uses_index(self):
+        tgtadm, calls = self._counting_tgtadm(
+            'Target 1: iqn.2010-10.org.openstack:volume-a')
+        get_target = iscsi.TargetAdmin._get_target
+
+        self.assertEqual('1', get_target(tgtadm,
+                                         'iqn.2010-10.org.openstack:volume-a'))
+        self.assertEqual('1', get_target(tgtadm,
+                                         'iqn.2010-10.org.openstack:volume-a'))
+        self.assertEqual(1, len(calls))
+
+    def test_get_target_reloads_stale_index(self):
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        self.flags(iscsi_target_reconcile_interval=60)
+        tgtadm, calls = self._counting_tgtadm(
+            'Target 1: iqn.2010-10.org.openstack:volume-a')
+        get_target = iscsi.TargetAdmin._get_target
+
+        get_target(tgtadm, 'iqn.2010-10.org.openstack:volume-a')
+        timeutils.advance_time_seconds(61)
+        get_target(tgtadm, 'iqn.2010-10.org.openstack:volume-a')
+
+        self.assertEqual(2, len(calls))
+
+    def test_get_target_reloads_on_miss(self):
+        tgtadm, calls = self._counting_tgtadm(
+            'Target 1: iqn.2010-10.org.openstack:volume-a')
+        get_target = iscsi.TargetAdmin._get_target
+
+        self.assertEqual(None, get_target(tgtadm,
+                                          'iqn.2010-10.org.openstack:foo'))
+        self.assertEqual(1, len(calls))
+        self.assertEqual(None, get_target(tgtadm,
+                                          'iqn.2010-10.org.openstack:foo'))
+        self.assertEqual(2, len(calls))
+
+    def test_create_queries_new_target_only(self):
+        tgtadm, calls = self._counting_tgtadm("\n".join([
+            'Target 1: iqn.2010-10.org.openstack:volume-a',
+            '    System information:',
+            'Target 2: iqn.2010-10.org.openstack:volume-blaa',
+            '    System information:']))
+        tgtadm._load_targets()
+        del calls[:]
+
+        self.assertEqual('2', tgtadm.create_iscsi_target(
+            'iqn.2010-10.org.openstack:volume-blaa', self.tid, self.lun,
+            self.path))
+
+        self.assertEqual([('tgt-admin', '--update',
+                           'iqn.2010-10.org.openstack:volume-blaa'),
+                          ('tgtadm', '--lld', 'iscsi', '--op', 'show',
+                           '--mode', 'target')], calls)
+        self.assertEqual('2', iscsi.TargetAdmin._get_target(
+            tgtadm, 'iqn.2010-10.org.openstack:volume-blaa'))
+        self.assertEqual(2, len(calls))
+
+    def test_remove_forgets_target(self):
+        tgtadm, calls = self._counting_tgtadm('')
+        tgtadm._load_targets()
+        tgtadm._remember_target('iqn.2010-10.org.openstack:volume-blaa', '1')
+
+        tgtadm.remove_iscsi_target(self.tid, self.lun, self.vol_id)
+
+        self.assertFalse('iqn.2010-10.org.openstack:volume-blaa' in
+                         tgtadm._targets)
+
 
 class IetAdmTestCase(test.TestCase, TargetAdminTestCase):
 
@@ -123,7 +224,6 @@ class IetAdmTestCase(test.TestCase, TargetAdminTestCase):
             'ietadm --op new --tid=%(tid)s --params Name=%(target_name)s',
             'ietadm --op new --tid=%(tid)s --lun=%(lun)s '
             '--params Path=%(path)s,Type=fileio',
-            'ietadm --op show --tid=%(tid)s',
             'ietadm --op delete --tid=%(tid)s --lun=%(lun)s',
             'ietadm --op delete --tid=%(tid)s'])
 
@@ -139,7 +239,6 @@ class IetAdmBlockIOTestCase(test.TestCase, TargetAdminTestCase):
             'ietadm --op new --tid=%(tid)s --params Name=%(target_name)s',
             'ietadm --op new --tid=%(tid)s --lun=%(lun)s '
             '--params Path=%(path)s,Type=blockio',
-            'ietadm --op show --tid=%(tid)s',
             'ietadm --op delete --tid=%(tid)s --lun=%(lun)s',
             'ietadm --op delete --tid=%(tid)s'])
 
@@ -155,7 +254,6 @@ class IetAdmFileIOTestCase(test.TestCase, TargetAdminTestCase):
             'ietadm --op new --tid=%(tid)s --params Name=%(target_name)s',
             'ietadm --op new --tid=%(tid)s --lun=%(lun)s '
             '--params Path=%(path)s,Type=fileio',
-            'ietadm --op show --tid=%(tid)s',
             'ietadm --op delete --tid=%(tid)s --lun=%(lun)s',
             'ietadm --op delete --tid=%(tid)s'])
 
@@ -172,7 +270,6 @@ class IetAdmAutoIOTestCase(test.TestCase, TargetAdminTestCase):
             'ietadm --op new --tid=%(tid)s --params Name=%(target_name)s',
             'ietadm --op new --tid=%(tid)s --lun=%(lun)s '
             '--params Path=%(path)s,Type=blockio',
-            'ietadm --op show --tid=%(tid)s',
             'ietadm --op delete --tid=%(tid)s --lun=%(lun)s',
             'ietadm --op delete --tid=%(tid)s'])
 
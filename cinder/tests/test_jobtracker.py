@@ -0,0 +1,99 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2013 OpenStack, LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the tracker of jobs running on storage arrays."""
+
+from cinder import exception
+from cinder import test
+from cinder.volume import jobtracker
+
+
+class FakeJob(object):
+    """Done after a number of polls."""
+
+    def __init__(self, polls, result='done'):
+        self.polls = polls
+        self.result = result
+        self.times = []
+
+    def __call__(self):
+        self.times.append(jobtracker.time.time())
+        if len(self.times) < self.polls:
+            return jobtracker.RUNNING
+        return self.result
+
+
+class JobTrackerTestCase(test.TestCase):
+
+    def setUp(self):
+        super(JobTrackerTestCase, self).setUp()
+        self.tracker = jobtracker.JobTracker(initial_interval=0.01,
+                                             max_interval=0.04, backoff=2)
+
+    def test_wait(self):
+        poll = FakeJob(5)
+
+        self.assertEqual('done', self.tracker.wait(poll))
+
+        self.assertEqual(5, len(poll.times))
+        intervals = [b - a for a, b in zip(poll.times, poll.times[1:])]
+        for interval, expected in zip(intervals, [0.01, 0.02, 0.04, 0.04]):
+            self.assertTrue(expected <= interval < expected + 0.5)
+
+    def test_jobs_share_one_poller(self):
+        polls = [FakeJob(3, result=i) for i in range(3)]
+
+        jobs = [self.tracker.track(poll) for poll in polls]
+        poller = self.tracker._poller
+
+        self.assertEqual([0, 1, 2], [job.wait() for job in jobs])
+        self.assertNotEqual(None, poller)
+        self.assertEqual(None, self.tracker._poller)
+
+    def test_failure(self):
+        def poll():
+            raise test.TestingException()
+
+        self.assertRaises(test.TestingException, self.tracker.wait, poll)
+
+    def test_timeout(self):
+        poll = FakeJob(100)
+
+        self.assertRaises(exception.VolumeJobTimeout, self.tracker.wait,
+                          poll, name='job', timeout=0.05)
+        self.assertTrue(len(poll.times) < 100)
+
+    def test_callback(self):
+        done = []
+
+        def callback(job):
+            done.append(job.wait())
+            raise test.TestingException()
+
+        job = self.tracker.track(FakeJob(2), callback=callback)
+
+        self.assertEqual('done', job.wait())
+        self.assertTrue(job.ready())
+        self.assertEqual(['done'], done)
+
+    def test_intervals_from_configuration(self):
+        self.flags(job_poll_initial_interval=0.01)
+        tracker = jobtracker.JobTracker()
+
+        job = tracker.track(FakeJob(1))
+
+        self.assertEqual(0.01, job.interval)
+        job.wait()
@@ -20,7 +20,9 @@ Tests for NetApp volume driver
 """
 
 import BaseHTTPServer
+import errno
 import httplib
+import socket
 import StringIO
 
 from lxml import etree
@@ -30,7 +32,9 @@ from cinder.exception import VolumeBackendAPIException
 from cinder.openstack.common import log as logging
 from cinder import test
 from cinder.volume import configuration as conf
+from cinder.volume.drivers.netapp import api
 from cinder.volume.drivers.netapp import common
+from cinder.volume.drivers.netapp import iscsi
 from cinder.volume.drivers.netapp.options import netapp_7mode_opts
 from cinder.volume.drivers.netapp.options import netapp_basicauth_opts
 from cinder.volume.drivers.netapp.options import netapp_cluster_opts
@@ -457,6 +461,9 @@ class FakeDirectCmodeHTTPConnection(object):
     def getresponsebody(self):
         return self.sock.result
 
+    def close(self):
+        pass
+
 
 class NetAppDirectCmodeISCSIDriverTestCase(test.TestCase):
     """Test case for NetAppISCSIDriver"""
@@ -591,6 +598,49 @@ class NetAppDirectCmodeISCSIDriverTestCase(test.TestCase):
     def test_vol_stats(self):
         self.driver.get_volume_stats(refresh=True)
 
+    def test_igroups_and_lun_maps_are_cached(self):
+        lookups = []
+        real_get_igroups = self.driver._get_igroup_by_initiator
+        real_find_mapped = self.driver._find_mapped_lun_igroup
+
+        def get_igroup_by_initiator(initiator):
+            lookups.append('igroups')
+            return real_get_igroups(initiator)
+
+        def find_mapped_lun_igroup(path, initiator, os=None):
+            lookups.append('map')
+            return real_find_mapped(path, initiator, os)
+        self.stubs.Set(self.driver, '_get_igroup_by_initiator',
+                       get_igroup_by_initiator)
+        self.stubs.Set(self.driver, '_find_mapped_lun_igroup',
+                       find_mapped_lun_igroup)
+        self.driver.create_volume(self.volume)
+
+        self.driver.initialize_connection(self.volume, self.connector)
+        self.driver.terminate_connection(self.volume, self.connector)
+        self.driver.initialize_connection(self.volume, self.connector)
+
+        self.assertEqual(['igroups'], lookups)
+        self.assertEqual(1, len(self.driver._lun_map_cache))
+        self.driver.delete_volume(self.volume)
+        self.assertEqual({}, self.driver._lun_map_cache)
+
+    def test_reconcile_drops_gone_luns(self):
+        self.driver.check_for_setup_error()
+        listed = sorted(self.driver.lun_table)
+        self.driver._add_lun_to_table(
+            iscsi.NetAppLun('handle', 'gone', 1, {}))
+        self.driver._igroup_cache['initiator'] = []
+
+        self.driver.get_volume_stats(refresh=True)
+        self.assertTrue('gone' in self.driver.lun_table)
+
+        self.flags(netapp_cache_reconcile_interval=0)
+        self.driver.get_volume_stats(refresh=True)
+
+        self.assertEqual(listed, sorted(self.driver.lun_table))
+        self.assertEqual({}, self.driver._igroup_cache)
+
 
 class NetAppDriverNegativeTestCase(test.TestCase):
     """Test case for NetAppDriver"""
@@ -632,6 +682,129 @@ class NetAppDriverNegativeTestCase(test.TestCase):
             common.netapp_unified_plugin_registry.pop('test_family')
 
 
+class FakeKeepAliveResponse(object):
+    """A keep-alive response to an ONTAPI request."""
+
+    def __init__(self, status):
+        self.status = status
+        self.reason = 'reason'
+        self.will_close = False
+
+    def read(self):
+        return ("<netapp xmlns='http://www.netapp.com/filer/admin'>"
+                "<results status='passed'/></netapp>")
+
+
+class FakeKeepAliveConnection(object):
+    """A fake httplib.HTTPConnection which records what is sent over it."""
+
+    def __init__(self, host, timeout=None):
+        self.host = host
+        self.requests = []
+        self.closed = False
+        self.status = 200
+        # raised by the next getresponse, once the request is sent
+        self.error = None
+
+    def request(self, method, path, data=None, headers=None):
+        if self.closed:
+            raise socket.error(errno.EPIPE, 'Broken pipe')
+        self.requests.append((method, path, headers))
+
+    def getresponse(self):
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+        return FakeKeepAliveResponse(self.status)
+
+    def close(self):
+        self.closed = True
+
+
+class NaServerTestCase(test.TestCase):
+    """Test case for the ONTAPI transport."""
+
+    def setUp(self):
+        super(NaServerTestCase, self).setUp()
+        self.connections = []
+
+        def connect(host, timeout=None):
+            connection = FakeKeepAliveConnection(host, timeout)
+            self.connections.append(connection)
+            return connection
+        self.stubs.Set(httplib, 'HTTPConnection', connect)
+        self.server = api.NaServer('filer', username='admin',
+                                   password='pass')
+
+    def test_connection_is_kept_alive(self):
+        self.server.invoke_successfully(api.NaElement('lun-list-info'))
+        self.server.invoke_successfully(api.NaElement('lun-list-info'))
+
+        self.assertEqual(1, len(self.connections))
+        self.assertEqual('filer:80', self.connections[0].host)
+        method, path, headers = self.connections[0].requests[1]
+        self.assertEqual('POST', method)
+        self.assertEqual('/' + api.NaServer.URL_FILER, path)
+        self.assertEqual('Basic YWRtaW46cGFzcw==', headers['Authorization'])
+
+    def test_connection_closed_by_server_is_replaced(self):
+        self.server.invoke_successfully(api.NaElement('lun-list-info'))
+        self.connections[0].closed = True
+
+        self.server.invoke_successfully(api.NaElement('lun-list-info'))
+
+        self.assertEqual(2, len(self.connections))
+        self.assertEqual(1, len(self.connections[1].requests))
+
+    def test_connection_closed_without_response_is_replaced(self):
+        self.server.invoke_successfully(api.NaElement('lun-list-info'))
+        self.connections[0].error = httplib.BadStatusLine('')
+
+        self.server.invoke_successfully(api.NaElement('lun-list-info'))
+
+        self.assertEqual(2, len(self.connections))
+        self.assertEqual(1, len(self.connections[1].requests))
+
+    def test_request_sent_is_not_retried(self):
+        for error in [socket.timeout('timed out'),
+                      httplib.BadStatusLine('HTTP/1.1 2'),
+                      socket.error(errno.ECONNRESET, 'Connection reset')]:
+            self.server.invoke_successfully(api.NaElement('lun-list-info'))
+            connection = self.connections[-1]
+            connection.error = error
+
+            self.assertRaises(api.NaApiError,
+                              self.server.invoke_successfully,
+                              api.NaElement('lun-list-info'))
+            self.assertTrue(connection.closed)
+
+        self.assertEqual(3, len(self.connections))
+
+    def test_changed_settings_reconnect(self):
+        self.server.invoke_successfully(api.NaElement('lun-list-info'))
+        self.server.set_port(8080)
+        self.server.invoke_successfully(api.NaElement('lun-list-info'))
+
+        self.assertEqual(['filer:80', 'filer:8080'],
+                         [c.host for c in self.connections])
+        self.assertTrue(self.connections[0].closed)
+
+    def test_api_stats(self):
+        self.server.invoke_successfully(api.NaElement('lun-list-info'))
+        self.connections[0].status = 500
+        self.assertRaises(api.NaApiError, self.server.invoke_successfully,
+                          api.NaElement('lun-list-info'))
+        self.connections[0].status = 200
+        self.server.invoke_successfully(api.NaElement('igroup-list-info'))
+
+        stats = self.server.get_api_stats()
+        self.assertEqual(['igroup-list-info', 'lun-list-info'],
+                         sorted(stats))
+        self.assertEqual(2, stats['lun-list-info']['calls'])
+        self.assertEqual(1, stats['lun-list-info']['failures'])
+        self.assertEqual(0, stats['igroup-list-info']['failures'])
+
+
 class FakeDirect7MODEServerHandler(FakeHTTPRequestHandler):
     """HTTP handler that fakes enough stuff to allow the driver to run"""
 
@@ -1026,6 +1199,9 @@ class FakeDirect7modeHTTPConnection(object):
     def getresponsebody(self):
         return self.sock.result
 
+    def close(self):
+        pass
+
 
 class NetAppDirect7modeISCSIDriverTestCase_NV(
         NetAppDirectCmodeISCSIDriverTestCase):
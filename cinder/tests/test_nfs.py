@@ -19,6 +19,8 @@
 import __builtin__
 import errno
 import os
+import shutil
+import tempfile
 
 from oslo.config import cfg
 
@@ -30,6 +32,7 @@ from mox import stubout
 from cinder import context
 from cinder import exception
 from cinder.exception import ProcessExecutionError
+from cinder.openstack.common import timeutils
 from cinder import test
 from cinder import units
 
@@ -55,7 +58,8 @@ class RemoteFsDriverTestCase(test.TestCase):
 
     def setUp(self):
         super(RemoteFsDriverTestCase, self).setUp()
-        self._driver = nfs.RemoteFsDriver()
+        self._driver = nfs.RemoteFsDriver(
+            configuration=conf.Configuration(None))
         self._mox = mox_lib.Mox()
         self.addCleanup(self._mox.UnsetStubs)
 
@@ -76,14 +80,63 @@ class RemoteFsDriverTestCase(test.TestCase):
         (mox, drv) = self._mox, self._driver
 
         mox.StubOutWithMock(drv, '_execute')
-        drv._execute('dd', 'if=/dev/zero', 'of=/path', 'bs=1M', 'count=1024',
-                     run_as_root=True)
+        drv._execute('truncate', '-s', '1G', '/path', run_as_root=True)
+        drv._execute('fallocate', '-l', '1', '/path', run_as_root=True)
+        drv._execute('fallocate', '-l', '1G', '/path', run_as_root=True)
 
         mox.ReplayAll()
 
         drv._create_regular_file('/path', 1)
 
         mox.VerifyAll()
+        self.assertEqual({}, drv.preallocation_progress)
+
+    def test_create_regular_file_writes_zeros_without_fallocate(self):
+        (mox, drv) = self._mox, self._driver
+        copies = []
+
+        def fake_copy(src, dest, size, blocksize, **kwargs):
+            copies.append((src, dest, size, kwargs['sparse']))
+            kwargs['progress'](size, size)
+        self.stubs.Set(nfs.blockcopy, 'copy', fake_copy)
+        mox.StubOutWithMock(drv, '_execute')
+        drv._execute('truncate', '-s', '1G', '/share/path1', run_as_root=True)
+        drv._execute('fallocate', '-l', '1', '/share/path1',
+                     run_as_root=True).AndRaise(ProcessExecutionError)
+        drv._execute('truncate', '-s', '1G', '/share/path2', run_as_root=True)
+
+        mox.ReplayAll()
+
+        drv._create_regular_file('/share/path1', 1)
+        drv._create_regular_file('/share/path2', 1)
+
+        mox.VerifyAll()
+        self.assertEqual([('/dev/zero', '/share/path1', units.GiB, False),
+                          ('/dev/zero', '/share/path2', units.GiB, False)],
+                         copies)
+
+    def test_create_regular_file_in_background(self):
+        self.flags(remotefs_preallocation='fallocate',
+                   remotefs_preallocation_background=True)
+        (mox, drv) = self._mox, self._driver
+        spawned = []
+        self.stubs.Set(nfs.greenthread, 'spawn_n',
+                       lambda *args: spawned.append(args))
+
+        mox.StubOutWithMock(drv, '_execute')
+        drv._execute('truncate', '-s', '1G', '/path', run_as_root=True)
+        drv._execute('fallocate', '-l', '1G', '/path', run_as_root=True).\
+            AndRaise(ProcessExecutionError)
+
+        mox.ReplayAll()
+
+        drv._create_regular_file('/path', 1)
+        self.assertEqual(1, len(spawned))
+        # a failure in the background leaves the volume sparse
+        spawned[0][0](*spawned[0][1:])
+
+        mox.VerifyAll()
+        self.assertEqual({}, drv.preallocation_progress)
 
     def test_set_rw_permissions_for_all(self):
         (mox, drv) = self._mox, self._driver
@@ -105,6 +158,181 @@ class RemoteFsDriverTestCase(test.TestCase):
                          drv._get_hash_str(self.TEST_EXPORT))
 
 
+class ShareSelectionPolicyTestCase(test.TestCase):
+    """Test case for the remotefs share selection policies."""
+
+    CANDIDATES = [('share1', (10 * units.GiB, 2 * units.GiB, 5 * units.GiB)),
+                  ('share2', (10 * units.GiB, 6 * units.GiB, 3 * units.GiB)),
+                  ('share3', (10 * units.GiB, 4 * units.GiB, 1 * units.GiB))]
+
+    def test_least_allocated(self):
+        policy = nfs.LeastAllocatedPolicy()
+        self.assertEqual('share3', policy.select(self.CANDIDATES))
+
+    def test_most_free(self):
+        policy = nfs.MostFreePolicy()
+        self.assertEqual('share2', policy.select(self.CANDIDATES))
+
+    def test_weighted_random(self):
+        policy = nfs.WeightedRandomPolicy()
+        self.stubs.Set(nfs.random, 'uniform', lambda a, b: 7 * units.GiB)
+        self.assertEqual('share2', policy.select(self.CANDIDATES))
+
+    def test_weighted_random_without_free_space(self):
+        policy = nfs.WeightedRandomPolicy()
+        candidates = [('share1', (10 * units.GiB, 0, 10 * units.GiB))]
+        self.assertEqual('share1', policy.select(candidates))
+
+    def test_round_robin(self):
+        policy = nfs.RoundRobinPolicy()
+        selected = [policy.select(self.CANDIDATES) for i in range(4)]
+        self.assertEqual(['share1', 'share2', 'share3', 'share1'], selected)
+
+    def test_round_robin_skips_full_shares(self):
+        policy = nfs.RoundRobinPolicy()
+        self.assertEqual('share1', policy.select(self.CANDIDATES))
+        self.assertEqual('share3', policy.select([self.CANDIDATES[0],
+                                                  self.CANDIDATES[2]]))
+
+
+class RemoteFsCloneTestCase(test.TestCase):
+    """Test case for the remotefs clones and snapshots."""
+
+    SHARE = 'nfs-host1:/export'
+
+    def setUp(self):
+        super(RemoteFsCloneTestCase, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.flags(nfs_mount_point_base=self.tempdir)
+        self._driver = nfs.NfsDriver(configuration=conf.Configuration(None))
+        self._driver.shares = {}
+        self._driver._execute = self._execute
+        self.stubs.Set(self._driver, '_ensure_share_mounted',
+                       lambda share: None)
+        self.resized = []
+        self.stubs.Set(image_utils, 'resize_image',
+                       lambda path, size: self.resized.append((path, size)))
+        self.share_dir = self._driver._get_mount_point_for_share(self.SHARE)
+        os.makedirs(self.share_dir)
+        self.reflinks = True
+        self.cmds = []
+        self.volume = self._volume('volume-1')
+        with open(self._path('volume-1'), 'wb') as f:
+            f.write('v' * 4096)
+        self.snapshot = {'name': 'snapshot-1', 'volume': self.volume,
+                         'volume_size': 1}
+
+    def _execute(self, *cmd, **kwargs):
+        self.cmds.append(cmd[:2])
+        if cmd[0] == 'cp':
+            if not self.reflinks:
+                raise ProcessExecutionError()
+            shutil.copyfile(cmd[2], cmd[3])
+        elif cmd[:2] == ('qemu-img', 'create'):
+            with open(cmd[-2], 'wb') as f:
+                f.write('QFI\xfb')
+        elif cmd[0] == 'tee':
+            with open(cmd[1], 'wb') as f:
+                f.write(kwargs['process_input'])
+        elif cmd[0] == 'truncate':
+            with open(cmd[3], 'ab') as f:
+                f.truncate(int(cmd[2]))
+        elif cmd[0] == 'rm':
+            for path in cmd[2:]:
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    def _volume(self, name, size=1):
+        return {'name': name, 'size': size, 'provider_location': self.SHARE}
+
+    def _path(self, name):
+        return os.path.join(self.share_dir, name)
+
+    def _read(self, name):
+        with open(self._path(name), 'rb') as f:
+            return f.read()
+
+    def test_reflink(self):
+        drv = self._driver
+
+        drv.create_snapshot(self.snapshot)
+        drv.create_volume_from_snapshot(self._volume('volume-2'),
+                                        self.snapshot)
+        drv.create_cloned_volume(self._volume('volume-3'), self.volume)
+
+        for name in ('snapshot-1', 'volume-2', 'volume-3'):
+            self.assertEqual('v' * 4096, self._read(name))
+        self.assertEqual(3, self.cmds.count(('cp', '--reflink=always')))
+        self.assertEqual([], self.resized)
+        self.assertFalse(os.path.exists(self._path('volume-2.info')))
+
+    def test_qcow2_overlay_of_snapshot(self):
+        drv = self._driver
+        self.reflinks = False
+        volume = self._volume('volume-2', size=2)
+
+        drv.create_snapshot(self.snapshot)
+        drv.create_volume_from_snapshot(volume, self.snapshot)
+
+        self.assertEqual('v' * 4096, self._read('snapshot-1'))
+        self.assertEqual('QFI\xfb', self._read('volume-2'))
+        self.assertEqual({'format': 'qcow2', 'backing_file': 'snapshot-1'},
+                         drv._read_info(self._path('volume-2')))
+        self.assertEqual([(self._path('volume-2'), 2)], self.resized)
+        # reflinks are probed only once
+        self.assertEqual(1, self.cmds.count(('cp', '--reflink=always')))
+        self.assertEqual(
+            'qcow2', drv.initialize_connection(volume, {})['data']['format'])
+        self.assertRaises(exception.SnapshotIsBusy, drv.delete_snapshot,
+                          self.snapshot)
+
+        drv.delete_volume(volume)
+        drv.delete_snapshot(self.snapshot)
+
+        self.assertEqual(['volume-1'], os.listdir(self.share_dir))
+
+    def test_snapshots_allocate_space(self):
+        drv = self._driver
+        drv._allocated[self.SHARE] = units.GiB
+
+        drv.create_snapshot(self.snapshot)
+        self.assertEqual(2 * units.GiB, drv._allocated[self.SHARE])
+
+        drv.delete_snapshot(self.snapshot)
+        self.assertEqual(units.GiB, drv._allocated[self.SHARE])
+
+    def test_clone_of_volume_is_copied(self):
+        drv = self._driver
+        self.reflinks = False
+
+        drv.create_cloned_volume(self._volume('volume-2'), self.volume)
+
+        self.assertEqual('v' * 4096, self._read('volume-2'))
+        self.assertFalse(('qemu-img', 'create') in self.cmds)
+
+    def test_unknown_clone_method(self):
+        self.flags(remotefs_clone_methods=['foo'])
+        self.assertRaises(exception.VolumeBackendAPIException,
+                          self._driver.create_snapshot, self.snapshot)
+
+    def test_copy_qcow2_volume_to_image(self):
+        drv = self._driver
+        self.reflinks = False
+        volume = self._volume('volume-2')
+        uploads = []
+        self.stubs.Set(image_utils, 'upload_volume',
+                       lambda *args: uploads.append(args[3:]))
+        drv.create_snapshot(self.snapshot)
+        drv.create_volume_from_snapshot(volume, self.snapshot)
+
+        drv.copy_volume_to_image(None, self.volume, None, None)
+        drv.copy_volume_to_image(None, volume, None, None)
+
+        self.assertEqual([(self._path('volume-1'), 'raw'),
+                          (self._path('volume-2'), 'qcow2')], uploads)
+
+
 class NfsDriverTestCase(test.TestCase):
     """Test case for NFS driver."""
 
@@ -132,6 +360,9 @@ class NfsDriverTestCase(test.TestCase):
         self.configuration.nfs_sparsed_volumes = True
         self.configuration.nfs_used_ratio = 0.95
         self.configuration.nfs_oversub_ratio = 1.0
+        self.configuration.remotefs_allocated_reconcile_interval = 600
+        self.configuration.remotefs_capacity_cache_ttl = 5
+        self.configuration.remotefs_share_selection_policy = None
         self._driver = nfs.NfsDriver(configuration=self.configuration)
         self._driver.shares = {}
         self.addCleanup(self.stubs.UnsetAll)
@@ -305,7 +536,7 @@ class NfsDriverTestCase(test.TestCase):
 
         mox.StubOutWithMock(drv, '_get_mount_point_for_share')
         drv._get_mount_point_for_share(self.TEST_NFS_EXPORT1).\
-            AndReturn(self.TEST_MNT_POINT)
+            MultipleTimes().AndReturn(self.TEST_MNT_POINT)
 
         mox.StubOutWithMock(drv, '_execute')
         drv._execute('stat', '-f', '-c', '%S %b %a',
@@ -313,7 +544,7 @@ class NfsDriverTestCase(test.TestCase):
                      run_as_root=True).AndReturn((stat_output, None))
 
         drv._execute('du', '-sb', '--apparent-size',
-                     '--exclude', '*snapshot*',
+                     '--exclude', '.snapshot',
                      self.TEST_MNT_POINT,
                      run_as_root=True).AndReturn((du_output, None))
 
@@ -338,7 +569,7 @@ class NfsDriverTestCase(test.TestCase):
 
         mox.StubOutWithMock(drv, '_get_mount_point_for_share')
         drv._get_mount_point_for_share(self.TEST_NFS_EXPORT_SPACES).\
-            AndReturn(self.TEST_MNT_POINT_SPACES)
+            MultipleTimes().AndReturn(self.TEST_MNT_POINT_SPACES)
 
         mox.StubOutWithMock(drv, '_execute')
         drv._execute('stat', '-f', '-c', '%S %b %a',
@@ -346,7 +577,7 @@ class NfsDriverTestCase(test.TestCase):
                      run_as_root=True).AndReturn((stat_output, None))
 
         drv._execute('du', '-sb', '--apparent-size',
-                     '--exclude', '*snapshot*',
+                     '--exclude', '.snapshot',
                      self.TEST_MNT_POINT_SPACES,
                      run_as_root=True).AndReturn((du_output, None))
 
@@ -357,6 +588,74 @@ class NfsDriverTestCase(test.TestCase):
 
         mox.VerifyAll()
 
+    def _stub_capacity_commands(self, *du_used):
+        """Expect one capacity check per item, running du unless None."""
+        mox = self._mox
+        drv = self._driver
+
+        mox.StubOutWithMock(drv, '_get_mount_point_for_share')
+        drv._get_mount_point_for_share(self.TEST_NFS_EXPORT1).\
+            MultipleTimes().AndReturn(self.TEST_MNT_POINT)
+
+        mox.StubOutWithMock(drv, '_execute')
+        for used in du_used:
+            drv._execute('stat', '-f', '-c', '%S %b %a',
+                         self.TEST_MNT_POINT,
+                         run_as_root=True).\
+                AndReturn(('1 2620544 2129984', None))
+            if used is not None:
+                drv._execute('du', '-sb', '--apparent-size',
+                             '--exclude', '.snapshot',
+                             self.TEST_MNT_POINT,
+                             run_as_root=True).AndReturn(('%d /mnt' % used,
+                                                          None))
+
+    def test_get_capacity_info_uses_tracked_allocation(self):
+        """du should only run once per reconcile interval."""
+        mox = self._mox
+        drv = self._driver
+
+        self._stub_capacity_commands(490560, None, None)
+
+        mox.ReplayAll()
+
+        drv._get_capacity_info(self.TEST_NFS_EXPORT1)
+        drv._update_allocated_space(self.TEST_NFS_EXPORT1, 1)
+        self.assertEquals(490560 + units.GiB,
+                          drv._get_capacity_info(self.TEST_NFS_EXPORT1)[2])
+        drv._update_allocated_space(self.TEST_NFS_EXPORT1, -1)
+        self.assertEquals(490560,
+                          drv._get_capacity_info(self.TEST_NFS_EXPORT1)[2])
+
+        mox.VerifyAll()
+
+    def test_get_capacity_info_reconciles_after_interval(self):
+        """Tracked allocation should be replaced by du after interval."""
+        mox = self._mox
+        drv = self._driver
+
+        self._stub_capacity_commands(490560, 490560)
+
+        mox.ReplayAll()
+
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        drv._get_capacity_info(self.TEST_NFS_EXPORT1)
+        drv._update_allocated_space(self.TEST_NFS_EXPORT1, 1)
+        timeutils.advance_time_seconds(601)
+        self.assertEquals(490560,
+                          drv._get_capacity_info(self.TEST_NFS_EXPORT1)[2])
+
+        mox.VerifyAll()
+
+    def test_update_allocated_space_ignores_unknown_share(self):
+        """Shares never walked should not get partial accounting."""
+        drv = self._driver
+
+        drv._update_allocated_space(self.TEST_NFS_EXPORT1, 1)
+
+        self.assertFalse(self.TEST_NFS_EXPORT1 in drv._allocated)
+
     def test_load_shares_config(self):
         mox = self._mox
         drv = self._driver
@@ -532,6 +831,79 @@ class NfsDriverTestCase(test.TestCase):
 
         mox.VerifyAll()
 
+    def test_find_share_reuses_probed_capacity(self):
+        """_find_share should not probe shares again within the cache ttl."""
+        mox = self._mox
+        drv = self._driver
+
+        drv._mounted_shares = [self.TEST_NFS_EXPORT1, self.TEST_NFS_EXPORT2]
+
+        mox.StubOutWithMock(drv, '_get_capacity_info')
+        drv._get_capacity_info(self.TEST_NFS_EXPORT1).\
+            AndReturn((5 * units.GiB, 2 * units.GiB,
+                       2 * units.GiB))
+        drv._get_capacity_info(self.TEST_NFS_EXPORT2).\
+            AndReturn((10 * units.GiB, 3 * units.GiB,
+                       1 * units.GiB))
+
+        mox.ReplayAll()
+
+        drv._find_share(self.TEST_SIZE_IN_GB)
+        self.assertEqual(self.TEST_NFS_EXPORT2,
+                         drv._find_share(self.TEST_SIZE_IN_GB))
+
+        mox.VerifyAll()
+
+    def test_find_share_probes_share_again_after_create(self):
+        """Creating a volume should drop the share's cached capacity."""
+        mox = self._mox
+        drv = self._driver
+
+        drv._mounted_shares = [self.TEST_NFS_EXPORT1, self.TEST_NFS_EXPORT2]
+
+        mox.StubOutWithMock(drv, '_get_capacity_info')
+        drv._get_capacity_info(self.TEST_NFS_EXPORT1).\
+            AndReturn((5 * units.GiB, 2 * units.GiB,
+                       2 * units.GiB))
+        drv._get_capacity_info(self.TEST_NFS_EXPORT2).\
+            AndReturn((10 * units.GiB, 3 * units.GiB,
+                       1 * units.GiB))
+        drv._get_capacity_info(self.TEST_NFS_EXPORT2).\
+            AndReturn((10 * units.GiB, 2 * units.GiB,
+                       3 * units.GiB))
+
+        mox.ReplayAll()
+
+        drv._find_share(self.TEST_SIZE_IN_GB)
+        drv._update_allocated_space(self.TEST_NFS_EXPORT2, 2)
+        self.assertEqual(self.TEST_NFS_EXPORT1,
+                         drv._find_share(self.TEST_SIZE_IN_GB))
+
+        mox.VerifyAll()
+
+    def test_find_share_with_configured_policy(self):
+        """_find_share should use remotefs_share_selection_policy."""
+        mox = self._mox
+        drv = self._driver
+        self.configuration.remotefs_share_selection_policy = 'most_free'
+
+        drv._mounted_shares = [self.TEST_NFS_EXPORT1, self.TEST_NFS_EXPORT2]
+
+        mox.StubOutWithMock(drv, '_get_capacity_info')
+        drv._get_capacity_info(self.TEST_NFS_EXPORT1).\
+            AndReturn((10 * units.GiB, 4 * units.GiB,
+                       2 * units.GiB))
+        drv._get_capacity_info(self.TEST_NFS_EXPORT2).\
+            AndReturn((10 * units.GiB, 3 * units.GiB,
+                       1 * units.GiB))
+
+        mox.ReplayAll()
+
+        self.assertEqual(self.TEST_NFS_EXPORT1,
+                         drv._find_share(self.TEST_SIZE_IN_GB))
+
+        mox.VerifyAll()
+
     def test_find_share_should_throw_error_if_there_is_no_enough_place(self):
         """_find_share should throw error if there is no share to host vol."""
         mox = self._mox
@@ -638,10 +1010,14 @@ class NfsDriverTestCase(test.TestCase):
 
         mox.ReplayAll()
 
+        drv._allocated[self.TEST_NFS_EXPORT1] = 0
+
         volume = DumbVolume()
         volume['size'] = self.TEST_SIZE_IN_GB
         result = drv.create_volume(volume)
         self.assertEqual(self.TEST_NFS_EXPORT1, result['provider_location'])
+        self.assertEqual(self.TEST_SIZE_IN_GB * units.GiB,
+                         drv._allocated[self.TEST_NFS_EXPORT1])
 
         mox.VerifyAll()
 
@@ -655,6 +1031,8 @@ class NfsDriverTestCase(test.TestCase):
         volume = DumbVolume()
         volume['name'] = 'volume-123'
         volume['provider_location'] = self.TEST_NFS_EXPORT1
+        volume['size'] = self.TEST_SIZE_IN_GB
+        drv._allocated[self.TEST_NFS_EXPORT1] = 3 * units.GiB
 
         mox.StubOutWithMock(drv, 'local_path')
         drv.local_path(volume).AndReturn(self.TEST_LOCAL_PATH)
@@ -667,6 +1045,7 @@ class NfsDriverTestCase(test.TestCase):
         drv.delete_volume(volume)
 
         mox.VerifyAll()
+        self.assertEqual(2 * units.GiB, drv._allocated[self.TEST_NFS_EXPORT1])
 
     def test_delete_should_ensure_share_mounted(self):
         """delete_volume should ensure that corresponding share is mounted."""
@@ -678,6 +1057,7 @@ class NfsDriverTestCase(test.TestCase):
         volume = DumbVolume()
         volume['name'] = 'volume-123'
         volume['provider_location'] = self.TEST_NFS_EXPORT1
+        volume['size'] = self.TEST_SIZE_IN_GB
 
         mox.StubOutWithMock(drv, '_ensure_share_mounted')
         drv._ensure_share_mounted(self.TEST_NFS_EXPORT1)
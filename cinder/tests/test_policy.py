@@ -27,6 +27,7 @@ from cinder import context
 from cinder import exception
 import cinder.openstack.common.policy
 from cinder.openstack.common import policy as common_policy
+from cinder.openstack.common import timeutils
 from cinder import policy
 from cinder import test
 from cinder import utils
@@ -64,6 +65,27 @@ class PolicyFileTestCase(test.TestCase):
             self.assertRaises(exception.PolicyNotAuthorized, policy.enforce,
                               self.context, action, self.target)
 
+    def test_policy_file_checked_after_interval(self):
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        with utils.tempdir() as tmpdir:
+            tmpfilename = os.path.join(tmpdir, 'policy')
+            self.flags(policy_file=tmpfilename,
+                       policy_file_check_interval=60)
+
+            action = "example:test"
+            with open(tmpfilename, "w") as policyfile:
+                policyfile.write("""{"example:test": []}""")
+            policy.enforce(self.context, action, self.target)
+            with open(tmpfilename, "w") as policyfile:
+                policyfile.write("""{"example:test": ["false:false"]}""")
+            os.utime(tmpfilename, (1, 1))
+
+            policy.enforce(self.context, action, self.target)
+            timeutils.advance_time_seconds(61)
+            self.assertRaises(exception.PolicyNotAuthorized, policy.enforce,
+                              self.context, action, self.target)
+
 
 class PolicyTestCase(test.TestCase):
     def setUp(self):
@@ -84,7 +106,8 @@ class PolicyTestCase(test.TestCase):
             "example:uppercase_admin": [["role:ADMIN"], ["role:sysadmin"]],
         }
         # NOTE(vish): then overload underlying brain
-        common_policy.set_brain(common_policy.Brain(rules))
+        self.brain = common_policy.Brain(rules)
+        common_policy.set_brain(self.brain)
         self.context = context.RequestContext('fake', 'fake', roles=['member'])
         self.target = {}
 
@@ -154,6 +177,51 @@ class PolicyTestCase(test.TestCase):
         policy.enforce(admin_context, lowercase_action, self.target)
         policy.enforce(admin_context, uppercase_action, self.target)
 
+    def _count_http_checks(self):
+        calls = []
+
+        def fakeurlopen(url, post_data):
+            calls.append(url)
+            return StringIO.StringIO("True")
+        self.stubs.Set(urllib2, 'urlopen', fakeurlopen)
+        return calls
+
+    def test_results_remembered_per_context(self):
+        calls = self._count_http_checks()
+        action = "example:get_http"
+        policy.enforce(self.context, action, self.target)
+        policy.enforce(self.context, action, self.target)
+        self.assertEqual(len(calls), 1)
+
+        other_context = context.RequestContext('fake', 'fake',
+                                               roles=['member'])
+        policy.enforce(other_context, action, self.target)
+        self.assertEqual(len(calls), 2)
+
+    def test_results_forgotten_when_credentials_change(self):
+        target = {'project_id': 'fake'}
+        action = "example:my_file"
+        policy.enforce(self.context, action, target)
+        self.context.project_id = 'another'
+        self.assertRaises(exception.PolicyNotAuthorized, policy.enforce,
+                          self.context, action, target)
+
+    def test_results_not_remembered_when_disabled(self):
+        self.flags(policy_cache_results=False)
+        calls = self._count_http_checks()
+        action = "example:get_http"
+        policy.enforce(self.context, action, self.target)
+        policy.enforce(self.context, action, self.target)
+        self.assertEqual(len(calls), 2)
+
+    def test_added_rule_replaces_compiled_rule(self):
+        action = "example:allowed"
+        policy.enforce(self.context, action, self.target)
+        self.brain.add_rule(action, [["false:false"]])
+        self.context.policy_results = None
+        self.assertRaises(exception.PolicyNotAuthorized, policy.enforce,
+                          self.context, action, self.target)
+
 
 class DefaultPolicyTestCase(test.TestCase):
 
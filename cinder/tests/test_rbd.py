@@ -16,9 +16,11 @@
 #    under the License.
 
 
+import collections
 import contextlib
 import mox
 import os
+import shutil
 import tempfile
 
 from cinder import db
@@ -66,6 +68,9 @@ CEPH_MON_DUMP = """dumped monmap epoch 1
 
 
 class FakeImageService:
+    def show(self, context, image_id):
+        return {'disk_format': 'qcow2', 'container_format': 'bare'}
+
     def download(self, context, image_id, path):
         pass
 
@@ -92,6 +97,7 @@ class RBDTestCase(test.TestCase):
         self.configuration.rbd_ceph_conf = None
         self.configuration.rbd_secret_uuid = None
         self.configuration.rbd_user = None
+        self.configuration.image_golden_volumes = 0
         self.configuration.append_config_values(mox.IgnoreArg())
 
         self.rados = self.mox.CreateMockAnything()
@@ -279,6 +285,101 @@ class RBDTestCase(test.TestCase):
         self.configuration.volume_tmp_dir = '/var/run/cinder/tmp'
         self._copy_image()
 
+    def test_copy_image_golden(self):
+        self.configuration.image_golden_volumes = 1
+        lock_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, lock_path)
+        self.flags(lock_path=lock_path)
+        self.rbd.RBD_FEATURE_LAYERING = 1
+        calls = []
+        self.stubs.Set(self.driver, '_list_golden_images',
+                       lambda: collections.OrderedDict(
+                           [('cinder-image-old', True)]))
+        self.stubs.Set(self.driver, '_create_image',
+                       lambda name, size: calls.append(('create', name)))
+        self.stubs.Set(self.driver, '_write_image',
+                       lambda c, vol, s, i, m: calls.append(('write',
+                                                             vol['name'])))
+        self.stubs.Set(self.driver, '_remove_golden_image',
+                       lambda name: calls.append(('remove', name)) or True)
+        self.stubs.Set(self.driver, 'delete_volume',
+                       lambda vol: calls.append(('delete', vol['name'])))
+        self.stubs.Set(self.driver, '_clone',
+                       lambda vol, pool, image, snap: calls.append(
+                           ('clone', image, snap, vol['name'])))
+        self.stubs.Set(self.driver, '_resize',
+                       lambda vol: calls.append(('resize', vol['name'])))
+        proxy = self.mox.CreateMockAnything()
+        self.mox.StubOutWithMock(driver, 'RBDVolumeProxy')
+        driver.RBDVolumeProxy(self.driver, 'cinder-image-foo-sum').AndReturn(
+            proxy)
+        proxy.__enter__().AndReturn(proxy)
+        proxy.create_snap('golden')
+        proxy.protect_snap('golden')
+        proxy.__exit__(None, None, None)
+        self.mox.ReplayAll()
+
+        image_service = FakeImageService()
+        self.stubs.Set(image_service, 'show',
+                       lambda context, image_id: {'checksum': 'sum'})
+        for name in ('volume-1', 'volume-2'):
+            self.driver.copy_image_to_volume(None, {'name': name, 'size': 1},
+                                             image_service, 'foo')
+
+        golden = 'cinder-image-foo-sum'
+        self.assertEqual([('create', golden),
+                          ('write', golden),
+                          ('remove', 'cinder-image-old'),
+                          ('delete', 'volume-1'),
+                          ('clone', golden, 'golden', 'volume-1'),
+                          ('resize', 'volume-1'),
+                          ('delete', 'volume-2'),
+                          ('clone', golden, 'golden', 'volume-2'),
+                          ('resize', 'volume-2')], calls)
+
+    def test_copy_volume_to_raw_image(self):
+        self.mox.StubOutWithMock(driver, 'RBDVolumeProxy')
+        proxy = self.mox.CreateMockAnything()
+        driver.RBDVolumeProxy(self.driver, 'volume-1',
+                              read_only=True).AndReturn(proxy)
+        proxy.__enter__().AndReturn(proxy)
+        proxy.__exit__(None, None, None)
+
+        class FakeRBDImage(object):
+            def size(self):
+                return 6
+
+            def read(self, offset, length):
+                return 'abcdef'[offset:offset + length]
+        proxy.volume = FakeRBDImage()
+        self.mox.ReplayAll()
+        uploaded = []
+
+        class UploadImageService(FakeImageService):
+            def update(self, context, image_id, image_meta, data):
+                uploaded.append(image_id)
+                for length in (4, 4, 4):
+                    uploaded.append(data.read(length))
+
+        self.driver.copy_volume_to_image(None, {'name': 'volume-1'},
+                                         UploadImageService(),
+                                         {'id': 'image', 'disk_format': 'raw'})
+
+        self.assertEqual(['image', 'abcd', 'ef', ''], uploaded)
+
+    def test_copy_volume_to_qcow2_image(self):
+        self.configuration.rbd_user = 'cinder'
+        self.configuration.rbd_ceph_conf = '/etc/ceph/ceph.conf'
+        self.mox.StubOutWithMock(image_utils, 'upload_volume')
+        image_meta = {'id': 'image', 'disk_format': 'qcow2'}
+        image_utils.upload_volume(None, 'image_service', image_meta,
+                                  'rbd:rbd/volume-1:id=cinder'
+                                  ':conf=/etc/ceph/ceph.conf')
+        self.mox.ReplayAll()
+
+        self.driver.copy_volume_to_image(None, {'name': 'volume-1'},
+                                         'image_service', image_meta)
+
     def test_update_volume_stats(self):
         self.stubs.Set(self.driver.configuration, 'safe_get', lambda x: 'RBD')
         mock_client = self.mox.CreateMockAnything()
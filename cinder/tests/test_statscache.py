@@ -0,0 +1,93 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2013 OpenStack, LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the cache of the pool data of storage arrays."""
+
+import json
+import os
+import shutil
+import tempfile
+
+from cinder import test
+from cinder.volume import statscache
+
+
+class ArrayStatsCacheTestCase(test.TestCase):
+
+    def setUp(self):
+        super(ArrayStatsCacheTestCase, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.flags(lock_path=self.tempdir)
+        self.cache_dir = os.path.join(self.tempdir, 'stats')
+        self.collects = []
+
+    def _collect(self):
+        self.collects.append(None)
+        return {'pool0': [100, len(self.collects)]}
+
+    def _get(self, interval=60, key='array-10.0.0.1'):
+        cache = statscache.ArrayStatsCache(self.cache_dir, interval)
+        return cache.get(key, self._collect)
+
+    def test_shared_between_backends(self):
+        self.assertEqual({'pool0': [100, 1]}, self._get())
+        self.assertEqual({'pool0': [100, 1]}, self._get())
+
+        self.assertEqual(1, len(self.collects))
+        self.assertEqual(['array-10.0.0.1'], os.listdir(self.cache_dir))
+
+    def test_keys_collected_separately(self):
+        self._get(key='array-10.0.0.1')
+        self._get(key='array-10.0.0.2')
+
+        self.assertEqual(2, len(self.collects))
+
+    def test_stale_data_collected_again(self):
+        self._get()
+        path = os.path.join(self.cache_dir, 'array-10.0.0.1')
+        with open(path) as f:
+            entry = json.load(f)
+        entry['collected_at'] -= 61
+        with open(path, 'w') as f:
+            json.dump(entry, f)
+
+        self.assertEqual({'pool0': [100, 2]}, self._get())
+
+    def test_not_shared(self):
+        self._get(interval=0)
+        self._get(interval=0)
+
+        self.assertEqual(2, len(self.collects))
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_failed_collect_leaves_nothing(self):
+        def collect():
+            raise test.TestingException()
+
+        cache = statscache.ArrayStatsCache(self.cache_dir, 60)
+
+        self.assertRaises(test.TestingException, cache.get, 'array',
+                          collect)
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_get_array_stats_cache(self):
+        self.flags(array_stats_dir=self.cache_dir,
+                   array_stats_cache_interval=30)
+        cache = statscache.get_array_stats_cache()
+
+        self.assertEqual(self.cache_dir, cache.path)
+        self.assertEqual(30, cache.interval)
@@ -39,6 +39,7 @@ from cinder import units
 from cinder import utils
 from cinder.volume import configuration as conf
 from cinder.volume.drivers import storwize_svc
+from cinder.volume import jobtracker
 from cinder.volume import volume_types
 
 
@@ -864,6 +865,9 @@ port_speed!N/A
                      'iscsi_chap_secret'])
 
         for k, host in self._hosts_list.iteritems():
+            if (('filtervalue' in kwargs) and
+                    (kwargs['filtervalue'] != 'name=' + host['host_name'])):
+                continue
             method = 'none'
             secret = ''
             if 'chapsecret' in host:
@@ -944,9 +948,9 @@ port_speed!N/A
         index = 1
         no_hdr = 0
         delimeter = ''
-        host_name = kwargs['obj']
+        host_name = kwargs.get('obj', '')
 
-        if host_name not in self._hosts_list:
+        if host_name and host_name not in self._hosts_list:
             return self._errors['CMMVC5754E']
 
         rows = []
@@ -1443,11 +1447,20 @@ class StorwizeSVCDriverTestCase(test.TestCase):
         snap1 = self._generate_vol_info(vol1['name'], vol1['id'])
 
         # Test timeout and volume cleanup
+        timeouts = []
+
+        def fake_wait(tracker, poll, name=None, timeout=None):
+            timeouts.append(timeout)
+            raise exception.VolumeJobTimeout(name=name, timeout=timeout)
+        orig = jobtracker.JobTracker.wait
+        self.stubs.Set(jobtracker.JobTracker, 'wait', fake_wait)
         self._set_flag('storwize_svc_flashcopy_timeout', 1)
         self.assertRaises(exception.InvalidSnapshot,
                           self.driver.create_snapshot, snap1)
+        self.assertEqual([1], timeouts)
         self._assert_vol_exists(snap1['name'], False)
         self._reset_flags()
+        self.stubs.Set(jobtracker.JobTracker, 'wait', orig)
 
         # Test prestartfcmap, startfcmap, and rmfcmap failing
         orig = self.driver._call_prepare_fc_map
@@ -1745,6 +1758,10 @@ class StorwizeSVCDriverTestCase(test.TestCase):
             # Check bad output from lsfabric for the 2nd volume
             if protocol == 'FC' and self.USESIM:
                 for error in ['remove_field', 'header_mismatch']:
+                    # Forget the ports of the host so that it is looked up
+                    # on the storage again
+                    self.driver._host_ports.clear()
+                    self.driver._port_hosts.clear()
                     self.sim.error_injection('lsfabric', error)
                     self.assertRaises(exception.VolumeBackendAPIException,
                                       self.driver.initialize_connection,
@@ -1867,6 +1884,61 @@ class StorwizeSVCDriverTestCase(test.TestCase):
             self.driver.terminate_connection(volume, conn2)
             self.driver.terminate_connection(volume, self._connector)
 
+    def test_storwize_svc_host_inventory(self):
+        # The commands run against real storage are not ours to count
+        if not self.USESIM:
+            return
+
+        volume1 = self._generate_vol_info(None, None)
+        self.driver.create_volume(volume1)
+        volume2 = self._generate_vol_info(None, None)
+        self.driver.create_volume(volume2)
+        self.driver.initialize_connection(volume1, self._connector)
+
+        cmds = []
+        real_run_ssh = self.driver._run_ssh
+
+        def fake_run_ssh(cmd, check_exit_code=True):
+            cmds.append(cmd.split()[1])
+            return real_run_ssh(cmd, check_exit_code)
+        self.stubs.Set(self.driver, '_run_ssh', fake_run_ssh)
+
+        # The host and its CHAP secret come from the inventory, the SCSI
+        # ids in use are listed afresh
+        self.driver.initialize_connection(volume2, self._connector)
+        self.assertEqual(['lsvdisk', 'lshostvdiskmap', 'mkvdiskhostmap'],
+                         cmds)
+
+        # A host defined by someone else is found after a refresh
+        del cmds[:]
+        conn = {'initiator': 'test:init:%s' % random.randint(10000, 99999),
+                'ip': '11.11.11.11',
+                'host': 'host-inventory'}
+        self.sim._add_host_to_list(conn)
+        self.assertEqual('host-inventory',
+                         self.driver._get_host_from_connector(conn))
+        self.assertEqual(['lshost', 'lsiscsiauth', 'lshost'], cmds)
+        self.assertEqual('host-inventory',
+                         self.driver._get_host_from_connector(conn))
+        self.assertEqual(3, len(cmds))
+
+        # A CHAP secret set by another node is listed again before a new
+        # one is generated
+        del cmds[:]
+        self.sim._hosts_list['host-inventory']['chapsecret'] = 'other'
+        self.assertEqual('other', self.driver._get_chap_secret_for_host(
+            'host-inventory'))
+        self.assertEqual(['lsiscsiauth'], cmds)
+        self.assertEqual('other', self.driver._get_chap_secret_for_host(
+            'host-inventory'))
+        self.assertEqual(1, len(cmds))
+
+        self.driver._delete_host('host-inventory')
+        self.assertEqual(None, self.driver._get_host_from_connector(conn))
+        for volume in [volume1, volume2]:
+            self.driver.terminate_connection(volume, self._connector)
+            self.driver.delete_volume(volume)
+
     def test_storwize_svc_delete_volume_snapshots(self):
         # Create a volume with two snapshots
         master = self._generate_vol_info(None, None)
@@ -380,6 +380,20 @@ class GenericUtilsTestCase(test.TestCase):
                 self.assertEqual(fake_execute.uid, 2)
             self.assertEqual(fake_execute.uid, os.getuid())
 
+    def test_temporary_chown_with_executor(self):
+        cmds = []
+
+        def fake_execute(*args, **kwargs):
+            cmds.append(args)
+
+        with tempfile.NamedTemporaryFile() as f:
+            with utils.temporary_chown(f.name, owner_uid=2,
+                                       executor=fake_execute):
+                pass
+
+        self.assertEqual([('chown', 2, f.name),
+                          ('chown', os.getuid(), f.name)], cmds)
+
     def test_service_is_up(self):
         fts_func = datetime.datetime.fromtimestamp
         fake_now = 1000
@@ -662,10 +676,25 @@ class FakeSSHClient(object):
     def close(self):
         pass
 
+    def invoke_shell(self):
+        return FakeChannel()
+
     def __call__(self, *args, **kwargs):
         pass
 
 
+class FakeChannel(object):
+
+    def __init__(self):
+        self.closed = False
+
+    def resize_pty(self, width, height):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
 class FakeSock(object):
     def settimeout(self, timeout):
         pass
@@ -726,3 +755,125 @@ class SSHPoolTestCase(test.TestCase):
             third_id = ssh.id
 
         self.assertNotEqual(first_id, third_id)
+
+    def test_idle_ssh_connections_replaced(self):
+        self.stubs.Set(paramiko, 'SSHClient', FakeSSHClient)
+        sshpool = utils.SSHPool("127.0.0.1", 22, 10, "test", password="test",
+                                max_idle_time=60, min_size=1, max_size=1)
+        with sshpool.item() as ssh:
+            first_id = ssh.id
+        with sshpool.item() as ssh:
+            second_id = ssh.id
+        # Make the connection look idle for longer than allowed
+        ssh.last_used -= 61
+        with sshpool.item() as ssh:
+            third_id = ssh.id
+
+        self.assertEqual(first_id, second_id)
+        self.assertNotEqual(first_id, third_id)
+        self.assertEqual(1, sshpool.current_size)
+
+    def test_ssh_connection_failover(self):
+        connects = []
+
+        class FailingSSHClient(FakeSSHClient):
+            def connect(self, ip, *args, **kwargs):
+                connects.append(ip)
+                if ip == '10.0.0.1':
+                    raise paramiko.SSHException()
+
+        self.stubs.Set(paramiko, 'SSHClient', FailingSSHClient)
+        sshpool = utils.SSHPool('10.0.0.1', 22, 10, 'test', password='test',
+                                failover_ips=['10.0.0.2'], max_size=2)
+        with sshpool.item() as ssh:
+            self.assertEqual('10.0.0.2', ssh.server_ip)
+        self.assertEqual('10.0.0.2', sshpool.ip)
+        sshpool.remove(ssh)
+        with sshpool.item() as ssh:
+            pass
+
+        self.assertEqual(['10.0.0.1', '10.0.0.2', '10.0.0.2'], connects)
+
+        sshpool.failover(ssh)
+        self.assertEqual('10.0.0.1', sshpool.ip)
+
+    def test_ssh_connection_failures(self):
+        class FailingSSHClient(FakeSSHClient):
+            def connect(self, *args, **kwargs):
+                raise paramiko.SSHException()
+
+        self.stubs.Set(paramiko, 'SSHClient', FailingSSHClient)
+        sshpool = utils.SSHPool('10.0.0.1', 22, 10, 'test', password='test',
+                                failover_ips=['10.0.0.2'], max_size=1)
+
+        self.assertRaises(paramiko.SSHException, sshpool.get)
+        self.assertEqual(0, sshpool.current_size)
+
+    def test_ssh_shell_reused(self):
+        self.stubs.Set(paramiko, 'SSHClient', FakeSSHClient)
+        sshpool = utils.SSHPool("127.0.0.1", 22, 10, "test", password="test",
+                                max_size=1)
+        with sshpool.item() as ssh:
+            shell = sshpool.shell(ssh)
+        with sshpool.item() as ssh:
+            self.assertEqual(shell, sshpool.shell(ssh))
+
+        sshpool.remove(ssh)
+        self.assertTrue(shell.closed)
+        self.assertEqual(0, sshpool.current_size)
+
+    def test_ssh_command_timing(self):
+        self.stubs.Set(paramiko, 'SSHClient', FakeSSHClient)
+        sshpool = utils.SSHPool("127.0.0.1", 22, 10, "test", password="test")
+
+        for i in range(2):
+            with sshpool.timed('showvv -state vol'):
+                pass
+        try:
+            with sshpool.timed('showhost'):
+                raise test.TestingException()
+        except test.TestingException:
+            pass
+
+        self.assertEqual(2, sshpool.command_stats['showvv']['count'])
+        self.assertEqual(1, sshpool.command_stats['showhost']['count'])
+        self.assertTrue(sshpool.command_stats['showvv']['max_time'] <=
+                        sshpool.command_stats['showvv']['total_time'])
+
+
+class RateLimiterTestCase(test.TestCase):
+
+    def setUp(self):
+        super(RateLimiterTestCase, self).setUp()
+        self.now = 1000.0
+        self.sleeps = []
+
+        def sleep(seconds):
+            self.sleeps.append(seconds)
+            self.now += seconds
+        self.stubs.Set(utils.time, 'time', lambda: self.now)
+        self.stubs.Set(utils.greenthread, 'sleep', sleep)
+
+    def test_paces_to_rate(self):
+        limiter = utils.RateLimiter(100)
+
+        limiter.consume(100)
+        limiter.consume(50)
+
+        self.assertEqual([1.0, 0.5], self.sleeps)
+
+    def test_idle_time_not_made_up_for(self):
+        limiter = utils.RateLimiter(100)
+        limiter.consume(100)
+
+        self.now += 60
+        limiter.consume(100)
+
+        self.assertEqual([1.0, 1.0], self.sleeps)
+
+    def test_unlimited(self):
+        limiter = utils.RateLimiter(0)
+
+        limiter.consume(100)
+
+        self.assertEqual([], self.sleeps)
@@ -26,6 +26,7 @@ import re
 import shutil
 import tempfile
 
+from eventlet import greenthread
 import mox
 from oslo.config import cfg
 
@@ -43,6 +44,7 @@ from cinder import quota
 from cinder import test
 from cinder.tests import conf_fixture
 from cinder.tests.image import fake as fake_image
+from cinder import units
 from cinder.volume import configuration as conf
 from cinder.volume import driver
 from cinder.volume.drivers import lvm
@@ -70,6 +72,10 @@ class VolumeTestCase(test.TestCase):
         self.volume = importutils.import_object(CONF.volume_manager)
         self.context = context.get_admin_context()
         self.stubs.Set(iscsi.TgtAdm, '_get_target', self.fake_get_target)
+        self.stubs.Set(iscsi.TgtAdm, '_query_target', self.fake_get_target)
+        # the fake driver creates no LVs for copy_volume to copy between
+        self.stubs.Set(volutils, 'copy_volume',
+                       lambda *args, **kwargs: None)
         fake_image.stub_out_image_service(self.stubs)
         test_notifier.NOTIFICATIONS = []
 
@@ -112,6 +118,23 @@ class VolumeTestCase(test.TestCase):
         self.assertEquals(volume['status'], "error")
         self.volume.delete_volume(self.context, volume_id)
 
+    def test_init_host_resumes_deletes_in_background(self):
+        volume = self._create_volume(status='deleting')
+        spawned = []
+        deleted = []
+        self.stubs.Set(greenthread, 'spawn_n',
+                       lambda func, *args: spawned.append((func, args)))
+        self.stubs.Set(self.volume, 'delete_volume',
+                       lambda ctxt, volume_id: deleted.append(volume_id))
+
+        self.volume.init_host()
+        self.assertEqual(deleted, [])
+        self.assertEqual(len(spawned), 1)
+
+        func, args = spawned[0]
+        func(*args)
+        self.assertEqual(deleted, [volume['id']])
+
     def test_create_delete_volume(self):
         """Test volume can be created and deleted."""
         # Need to stub out reserve, commit, and rollback
@@ -1169,6 +1192,13 @@ class VolumeTestCase(test.TestCase):
         self.assertEqual(volumes[1].id, u'3')
         self.assertEqual(volumes[2].id, u'4')
 
+        volumes = db.volume_get_active_by_window(
+            self.context,
+            datetime.datetime(1, 3, 1, 1, 1, 1),
+            datetime.datetime(1, 4, 1, 1, 1, 1),
+            marker='2', limit=5)
+        self.assertEqual([volume.id for volume in volumes], [u'3', u'4'])
+
     def test_snapshot_get_active_by_window(self):
         # Find all all snapshots valid within a timeframe window.
         vol = db.volume_create(self.context, {'id': 1})
@@ -1248,6 +1278,14 @@ class VolumeTestCase(test.TestCase):
         self.assertEqual(snapshots[0].id, u'2')
         self.assertEqual(snapshots[1].id, u'3')
         self.assertEqual(snapshots[2].id, u'4')
+        self.assertEqual(snapshots[2].volume.id, u'1')
+
+        snapshots = db.snapshot_get_active_by_window(
+            self.context,
+            datetime.datetime(1, 3, 1, 1, 1, 1),
+            datetime.datetime(1, 4, 1, 1, 1, 1),
+            marker='2', limit=1)
+        self.assertEqual([snapshot.id for snapshot in snapshots], [u'3'])
 
     def test_extend_volume(self):
         """Test volume can be extended at API level."""
@@ -1481,6 +1519,7 @@ class DriverTestCase(test.TestCase):
         self.context = context.get_admin_context()
         self.output = ""
         self.stubs.Set(iscsi.TgtAdm, '_get_target', self.fake_get_target)
+        self.stubs.Set(iscsi.TgtAdm, '_query_target', self.fake_get_target)
 
         def _fake_execute(_command, *_args, **_kwargs):
             """Fake _execute."""
@@ -1514,18 +1553,24 @@ class VolumeDriverTestCase(DriverTestCase):
 
     def test_delete_busy_volume(self):
         """Test deleting a busy volume."""
-        self.stubs.Set(self.volume.driver, '_volume_not_present',
-                       lambda x: False)
+        self.flags(lvm_metadata_cache_ttl=0)
         self.stubs.Set(self.volume.driver, '_delete_volume',
                        lambda x: False)
-        # Want DriverTestCase._fake_execute to return 'o' so that
+
+        def _fake_execute(*cmd, **kwargs):
+            if cmd == ('vgs', '--noheadings', '-o', 'name'):
+                return '  cinder-volumes\n', None
+            return ('  cinder-volumes:2.00g:1.00g:1:uuid:test1:1.00g:%s\n' %
+                    self.output), None
+        self.volume.driver.set_execute(_fake_execute)
+        # Want the attributes of the LV to start with 'o' so that
         # volume.driver.delete_volume() raises the VolumeIsBusy exception.
         self.output = 'o'
         self.assertRaises(exception.VolumeIsBusy,
                           self.volume.driver.delete_volume,
                           {'name': 'test1', 'size': 1024})
-        # when DriverTestCase._fake_execute returns something other than
-        # 'o' volume.driver.delete_volume() does not raise an exception.
+        # when they start with something other than 'o'
+        # volume.driver.delete_volume() does not raise an exception.
         self.output = 'x'
         self.volume.driver.delete_volume({'name': 'test1', 'size': 1024})
 
@@ -1558,6 +1603,303 @@ class LVMVolumeDriverTestCase(DriverTestCase):
         volume = dict(fake_volume)
         self.assertEquals(None, lvm_driver.clear_volume(volume))
 
+    def _wipe_driver(self, output='', lvs=None):
+        """Return an LVM driver and the commands it runs.
+
+        lvs maps the names of the LVs in the VG to their attributes.
+        """
+        configuration = conf.Configuration(fake_opt, 'fake_group')
+        configuration.volume_group = 'cinder-volumes'
+        configuration.volume_clear = 'zero'
+        configuration.volume_clear_size = 0
+        configuration.volume_clear_defer = True
+        configuration.volume_clear_workers = 1
+        configuration.volume_clear_rate = 0
+        configuration.volume_clear_ionice = None
+        lvm_driver = lvm.LVMVolumeDriver(configuration=configuration)
+        cmds = []
+
+        lvs = lvs or {}
+
+        def fake_execute(*cmd, **kwargs):
+            cmds.append(' '.join(str(arg) for arg in cmd))
+            if cmd == ('vgs', '--noheadings', '-o', 'name'):
+                return '  cinder-volumes\n', None
+            if cmd[0] == 'vgs' and '--separator' in cmd:
+                return ''.join('  cinder-volumes:10.00g:5.00g:%d:uuid:%s:'
+                               '1.00g:%s\n' % (len(lvs), name, attr)
+                               for name, attr in lvs.items()), None
+            return output, None
+        lvm_driver.set_execute(fake_execute)
+        return lvm_driver, cmds
+
+    def test_lv_lookups_cached(self):
+        lvm_driver, cmds = self._wipe_driver(
+            lvs={'volume-1': 'owi-a-', 'volume-2': 'Vwi-a-tz--'})
+
+        self.assertFalse(lvm_driver._volume_not_present('volume-1'))
+        self.assertTrue(lvm_driver._volume_not_present('volume-3'))
+        self.assertTrue(lvm_driver._is_thin('volume-2'))
+        self.assertEqual(2, len(cmds))
+
+        lvm_driver.create_volume({'name': 'volume-3', 'size': 1})
+        self.assertTrue(lvm_driver._is_thin('volume-2'))
+        self.assertEqual(4, len(cmds))
+        self.assertTrue(cmds[-1].startswith('vgs --noheadings --unit=g'))
+
+    def test_delete_rereads_lvs(self):
+        lvm_driver, cmds = self._wipe_driver(lvs={'volume-1': 'owi-a-'})
+        self.assertFalse(lvm_driver._volume_not_present('volume-1'))
+        del cmds[:]
+
+        self.assertRaises(exception.VolumeIsBusy, lvm_driver.delete_volume,
+                          {'name': 'volume-1', 'size': 1})
+        self.assertEqual(1, len(cmds))
+        self.assertTrue(cmds[0].startswith('vgs --noheadings --unit=g'))
+
+    def _fake_wipes(self):
+        wipes = []
+
+        def fake_copy_volume(src, dest, size_in_m, sync=False,
+                             execute=None, limiter=None):
+            wipes.append((src, dest, size_in_m, limiter))
+        self.stubs.Set(volutils, 'copy_volume', fake_copy_volume)
+        return wipes
+
+    def test_delete_volume_defers_clear(self):
+        lvm_driver, cmds = self._wipe_driver(lvs={'volume-1': '-wi-a-'})
+        self.stubs.Set(os.path, 'exists', lambda x: True)
+        wipes = self._fake_wipes()
+
+        lvm_driver.delete_volume({'name': 'volume-1', 'size': 2})
+
+        self.assertEqual('lvrename cinder-volumes volume-1 '
+                         'cinder-wipe-volume-1', cmds[-1])
+        self.assertEqual([], wipes)
+        lvm_driver._wipe_pool.waitall()
+        self.assertEqual(
+            [('/dev/zero',
+              '/dev/mapper/cinder--volumes-cinder--wipe--volume--1', 2048)],
+            [wipe[:3] for wipe in wipes])
+        self.assertEqual('lvremove -f cinder-volumes/cinder-wipe-volume-1',
+                         cmds[-1])
+
+    def test_delete_volume_without_defer(self):
+        lvm_driver, cmds = self._wipe_driver(lvs={'volume-1': '-wi-a-'})
+        lvm_driver.configuration.volume_clear_defer = False
+        self.stubs.Set(os.path, 'exists', lambda x: True)
+        self.stubs.Set(volutils, 'copy_volume',
+                       lambda x, y, z, sync=False, execute='foo': True)
+
+        lvm_driver.delete_volume({'name': 'volume-1', 'size': 2, 'id': 1})
+
+        self.assertEqual('lvremove -f cinder-volumes/volume-1', cmds[-1])
+        self.assertEqual(None, lvm_driver._wipe_pool)
+
+    def test_wipes_share_rate(self):
+        lvm_driver, cmds = self._wipe_driver()
+        lvm_driver.configuration.volume_clear_rate = 1024
+        wipes = self._fake_wipes()
+
+        lvm_driver._wipe_volume('cinder-wipe-volume-1', 1536)
+        lvm_driver._wipe_volume('cinder-wipe-volume-2', 512)
+
+        self.assertEqual([1536, 512], [wipe[2] for wipe in wipes])
+        self.assertTrue(wipes[0][3] is wipes[1][3])
+        self.assertEqual(1024 * units.MiB, wipes[0][3].rate)
+        self.assertEqual([], cmds)
+
+    def test_shred_wipe_ioniced(self):
+        lvm_driver, cmds = self._wipe_driver()
+        lvm_driver.configuration.volume_clear = 'shred'
+        lvm_driver.configuration.volume_clear_ionice = '-c2 -n7'
+
+        lvm_driver._wipe_volume('cinder-wipe-volume-1', 1536)
+
+        self.assertEqual(['ionice -c2 -n7 shred -n3 /dev/mapper/'
+                          'cinder--volumes-cinder--wipe--volume--1'], cmds)
+
+    def test_ionice_options_normalized(self):
+        lvm_driver, cmds = self._wipe_driver()
+
+        lvm_driver.configuration.volume_clear_ionice = ' -c 3 '
+        self.assertEqual(['ionice', '-c3'], lvm_driver._ionice_args())
+        lvm_driver.configuration.volume_clear_ionice = '-c 2 -n 7'
+        self.assertEqual(['ionice', '-c2', '-n7'], lvm_driver._ionice_args())
+        lvm_driver.configuration.volume_clear_ionice = '-c2 -t'
+        self.assertRaises(exception.VolumeBackendAPIException,
+                          lvm_driver._ionice_args)
+
+    def test_clone_thin_volume_takes_snapshot(self):
+        lvm_driver, cmds = self._wipe_driver(lvs={'volume-1': 'Vwi-a-tz--'})
+
+        lvm_driver.create_cloned_volume({'id': '2', 'name': 'volume-2',
+                                         'size': 2},
+                                        {'id': '1', 'size': 1})
+
+        self.assertEqual(['lvcreate -s -n volume-2 cinder-volumes/volume-1',
+                          'lvextend -L 2G cinder-volumes/volume-2'],
+                         cmds[-2:])
+
+    def test_clone_thick_volume_copies(self):
+        lvm_driver, cmds = self._wipe_driver(lvs={'volume-1': '-wi-a----'})
+        copies = []
+        logged = []
+        seen = []
+
+        def fake_copy_volume(src, dest, size_in_m, execute, progress=None):
+            copies.append((src, dest, size_in_m))
+            progress(5, 100)
+            progress(50, 100)
+            progress(55, 100)
+            seen.append(dict(lvm_driver.clone_progress))
+
+        def fake_info(msg, *args):
+            if args:
+                logged.append(args[0]['percent'])
+        self.stubs.Set(volutils, 'copy_volume', fake_copy_volume)
+        self.stubs.Set(lvm.LOG, 'info', fake_info)
+
+        lvm_driver.create_cloned_volume({'id': '2', 'name': 'volume-2',
+                                         'size': 1},
+                                        {'id': '1', 'size': 1})
+
+        self.assertEqual([('/dev/mapper/cinder--volumes-clone--snap--2',
+                           '/dev/mapper/cinder--volumes-volume--2', 1024)],
+                         copies)
+        self.assertEqual([50], logged)
+        self.assertEqual([{'2': 55}], seen)
+        self.assertEqual({}, lvm_driver.clone_progress)
+        self.assertTrue('lvcreate -L 1G --name clone-snap-2 --snapshot '
+                        'cinder-volumes/volume-1' in cmds)
+
+    def test_create_volume_from_thin_snapshot(self):
+        lvm_driver, cmds = self._wipe_driver(
+            lvs={'_snapshot-1': 'Vwi-a-tz--'})
+
+        lvm_driver.create_volume_from_snapshot(
+            {'id': '2', 'name': 'volume-2', 'size': 1},
+            {'name': 'snapshot-1', 'volume_size': 1})
+
+        self.assertEqual(['lvcreate -s -n volume-2 '
+                          'cinder-volumes/_snapshot-1'], cmds[-1:])
+
+    def test_copy_image_to_volume_clones_golden_volume(self):
+        lvm_driver, cmds = self._wipe_driver(
+            lvs={'cinder-image-image-sum': 'Vwi-a-tz--'})
+        lvm_driver.configuration.image_golden_volumes = 1
+        lvm_driver._golden_volumes['cinder-image-old-sum'] = 1
+        self.flags(lock_path=CONF.volumes_dir)
+        fetched = []
+        self.stubs.Set(image_utils, 'fetch_to_raw',
+                       lambda c, s, image_id, dest: fetched.append(dest))
+        image_service = fake_image.FakeImageService()
+        self.stubs.Set(image_service, 'show',
+                       lambda context, image_id: {'checksum': 'sum'})
+
+        lvm_driver.copy_image_to_volume(None, {'id': '1', 'name': 'volume-1',
+                                               'size': 1},
+                                        image_service, 'image')
+        del cmds[:]
+        lvm_driver.copy_image_to_volume(None, {'id': '2', 'name': 'volume-2',
+                                               'size': 2},
+                                        image_service, 'image')
+
+        self.assertEqual(
+            ['/dev/mapper/cinder--volumes-cinder--image--image--sum'],
+            fetched)
+        self.assertEqual(['cinder-image-image-sum'],
+                         list(lvm_driver._golden_volumes))
+        self.assertEqual(['vgs --noheadings --unit=g --separator : -o '
+                          'vg_name,vg_size,vg_free,lv_count,vg_uuid,'
+                          'lv_name,lv_size,lv_attr cinder-volumes',
+                          'lvremove -f cinder-volumes/volume-2',
+                          'lvcreate -s -n volume-2 '
+                          'cinder-volumes/cinder-image-image-sum',
+                          'lvextend -L 2G cinder-volumes/volume-2'], cmds)
+
+    def test_golden_volume_in_use_not_evicted(self):
+        lvm_driver, cmds = self._wipe_driver(
+            lvs={'cinder-image-image-sum': 'Vwi-a-tz--'})
+        lvm_driver.configuration.image_golden_volumes = 1
+        lvm_driver._golden_volumes['cinder-image-old-sum'] = 1
+        lvm_driver._golden_users['cinder-image-old-sum'] = 1
+        self.flags(lock_path=CONF.volumes_dir)
+        self.stubs.Set(image_utils, 'fetch_to_raw',
+                       lambda c, s, image_id, dest: None)
+        image_service = fake_image.FakeImageService()
+        self.stubs.Set(image_service, 'show',
+                       lambda context, image_id: {'checksum': 'sum'})
+
+        lvm_driver.copy_image_to_volume(None, {'id': '1', 'name': 'volume-1',
+                                               'size': 1},
+                                        image_service, 'image')
+
+        self.assertEqual(['cinder-image-old-sum', 'cinder-image-image-sum'],
+                         list(lvm_driver._golden_volumes))
+        self.assertEqual({'cinder-image-old-sum': 1},
+                         dict(lvm_driver._golden_users))
+
+        del lvm_driver._golden_users['cinder-image-old-sum']
+        lvm_driver.copy_image_to_volume(None, {'id': '2', 'name': 'volume-2',
+                                               'size': 1},
+                                        image_service, 'image')
+
+        self.assertEqual(['cinder-image-image-sum'],
+                         list(lvm_driver._golden_volumes))
+
+    def test_golden_volume_evicted_without_wipe(self):
+        lvm_driver, cmds = self._wipe_driver(
+            lvs={'cinder-image-old-sum': '-wi-a----'})
+        lvm_driver.configuration.volume_clear_defer = False
+        lvm_driver.configuration.image_golden_volumes = 1
+        lvm_driver._golden_volumes['cinder-image-old-sum'] = 1
+        lvm_driver._golden_volumes['cinder-image-new-sum'] = 1
+        self.flags(lock_path=CONF.volumes_dir)
+        self.stubs.Set(os.path, 'exists', lambda path: True)
+        wipes = self._fake_wipes()
+
+        lvm_driver._evict_golden_volumes()
+
+        self.assertEqual(['cinder-image-new-sum'],
+                         list(lvm_driver._golden_volumes))
+        self.assertEqual([], wipes)
+        self.assertEqual('lvremove -f cinder-volumes/cinder-image-old-sum',
+                         cmds[-1])
+
+    def test_unknown_clone_strategy(self):
+        lvm_driver, cmds = self._wipe_driver()
+        lvm_driver.configuration.lvm_clone_strategy = 'foo'
+
+        self.assertRaises(exception.VolumeBackendAPIException,
+                          lvm_driver.create_cloned_volume,
+                          {'id': '2', 'name': 'volume-2', 'size': 1},
+                          {'id': '1', 'size': 1})
+
+    def test_do_setup_resumes_wipes(self):
+        lvm_driver, cmds = self._wipe_driver(
+            '  volume-1 1024.00\n  cinder-wipe-volume-2 2048.00\n')
+        queued = []
+        self.stubs.Set(lvm_driver, '_queue_wipe',
+                       lambda name, size: queued.append((name, size)))
+
+        lvm_driver.do_setup(self.context)
+
+        self.assertEqual([('cinder-wipe-volume-2', 2048)], queued)
+
+    def test_do_setup_without_vg(self):
+        lvm_driver, cmds = self._wipe_driver()
+
+        def fake_execute(*cmd, **kwargs):
+            raise exception.ProcessExecutionError(
+                cmd=' '.join(cmd),
+                stderr='Volume group "cinder-volumes" not found')
+        lvm_driver.set_execute(fake_execute)
+
+        lvm_driver.do_setup(self.context)
+
+        self.assertEqual({}, lvm_driver._golden_volumes)
+
 
 class ISCSITestCase(DriverTestCase):
     """Test Case for ISCSIDriver"""
@@ -1605,20 +1947,62 @@ class ISCSITestCase(DriverTestCase):
         self.assertEquals(result["target_iqn"], "iqn:iqn")
         self.assertEquals(result["target_lun"], 0)
 
+    def test_ensure_exports_skips_existing_targets(self):
+        prefix = CONF.iscsi_target_prefix
+        volumes = [{'name': 'volume-a', 'provider_location': None},
+                   {'name': 'volume-b', 'provider_location': None},
+                   {'name': 'volume-c', 'provider_location': None},
+                   {'name': 'volume-d',
+                    'provider_location': '0.0.0.0:0,1 %svolume-old 0' %
+                                         prefix}]
+        for name in ('volume-a', 'volume-b', 'volume-d'):
+            open(os.path.join(CONF.volumes_dir, name), 'w').close()
+        targets = dict((prefix + name, '1')
+                       for name in ('volume-a', 'volume-c', 'volume-d'))
+        self.volume.driver.tgtadm = iscsi.TgtAdm()
+        self.stubs.Set(self.volume.driver.tgtadm, 'get_targets',
+                       lambda: targets)
+        ensured = []
+        self.stubs.Set(self.volume.driver, 'ensure_export',
+                       lambda ctxt, volume: ensured.append(volume['name']))
+
+        self.volume.driver.ensure_exports(self.context, volumes)
+
+        self.assertEqual(sorted(ensured), ['volume-b', 'volume-c',
+                                           'volume-d'])
+
     def test_get_volume_stats(self):
+        commands = []
+
         def _emulate_vgs_execute(_command, *_args, **_kwargs):
-            out = "  test1-volumes  5,52  0,52"
-            out += " test2-volumes  5.52  0.52"
+            commands.append(_command)
+            if _args == ('--noheadings', '-o', 'name'):
+                return '  %s\n' % CONF.volume_group, None
+            out = '  %s:5,52g:0,52g:1:uuid:test1:5,00g:-wi-a-\n' % (
+                CONF.volume_group)
             return out, None
 
+        self.volume.driver.vg = None
         self.volume.driver.set_execute(_emulate_vgs_execute)
 
         self.volume.driver._update_volume_status()
+        self.volume.driver._volume_not_present('test1')
 
         stats = self.volume.driver._stats
 
         self.assertEquals(stats['total_capacity_gb'], float('5.52'))
         self.assertEquals(stats['free_capacity_gb'], float('0.52'))
+        self.assertEqual({}, stats['clone_progress'])
+        self.assertEqual(2, len(commands))
+
+    def test_get_volume_stats_clone_progress(self):
+        self.volume.driver.set_execute(lambda *cmd, **kwargs: ('', None))
+        self.volume.driver.clone_progress['2'] = 40
+
+        stats = self.volume.driver.get_volume_stats(refresh=True)
+
+        self.assertEqual({'2': 40}, stats['clone_progress'])
+        self.volume.driver.clone_progress.clear()
 
     def test_validate_connector(self):
         iscsi_driver = driver.ISCSIDriver()
@@ -22,6 +22,7 @@ from oslo.config import cfg
 
 from cinder import context
 from cinder import db
+from cinder import exception
 from cinder.openstack.common import importutils
 from cinder.openstack.common import log as logging
 from cinder.openstack.common.notifier import api as notifier_api
@@ -120,6 +121,43 @@ class UsageInfoTestCase(test.TestCase):
                           self.HOSTIP)
 
 
+class ActiveByWindowBatchesTestCase(test.TestCase):
+
+    def setUp(self):
+        super(ActiveByWindowBatchesTestCase, self).setUp()
+        self.rows = [{'id': '%08x-0000' % (i * 0x10000000)}
+                     for i in range(16)]
+        self.calls = []
+
+    def _get_active_by_window(self, context, begin, end, marker=None,
+                              limit=None):
+        self.calls.append(marker)
+        rows = [row for row in self.rows
+                if marker is None or row['id'] > marker]
+        return rows[:limit]
+
+    def _batches(self, batch_size, shard=0, shards=1):
+        return list(volume_utils.get_active_by_window_batches(
+            self._get_active_by_window, None, None, None, batch_size,
+            shard, shards))
+
+    def test_batches(self):
+        batches = self._batches(6)
+        self.assertEqual([len(rows) for rows in batches], [6, 6, 4])
+        self.assertEqual(self.calls, [None, self.rows[5]['id'],
+                                      self.rows[11]['id']])
+
+    def test_shards_cover_all_rows_once(self):
+        ids = []
+        for shard in range(3):
+            for rows in self._batches(2, shard, 3):
+                ids.extend(row['id'] for row in rows)
+        self.assertEqual(ids, [row['id'] for row in self.rows])
+
+    def test_shard_out_of_range(self):
+        self.assertRaises(exception.InvalidInput, self._batches, 2, 3, 3)
+
+
 class LVMVolumeDriverTestCase(test.TestCase):
     def test_convert_blocksize_option(self):
         # Test valid volume_dd_blocksize
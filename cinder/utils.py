@@ -175,81 +175,169 @@ def create_channel(client, width, height):
 
 
 class SSHPool(pools.Pool):
-    """A simple eventlet pool to hold ssh connections."""
+    """A simple eventlet pool to hold ssh connections.
+
+    Connections are made to ip, or to the first of failover_ips that can be
+    reached when it cannot be; the pool sticks to the address that worked.
+    Connections that are no longer active, or have been idle for more than
+    max_idle_time seconds, are replaced when taken from the pool. The time
+    commands take is recorded per command name in command_stats.
+    """
 
     def __init__(self, ip, port, conn_timeout, login, password=None,
-                 privatekey=None, *args, **kwargs):
+                 privatekey=None, failover_ips=None, max_idle_time=None,
+                 *args, **kwargs):
         self.ip = ip
+        self.ips = [ip] + [i for i in (failover_ips or []) if i and i != ip]
         self.port = port
         self.login = login
         self.password = password
         self.conn_timeout = conn_timeout if conn_timeout else None
         self.privatekey = privatekey
+        self.max_idle_time = max_idle_time if max_idle_time else None
+        self.command_stats = {}
         super(SSHPool, self).__init__(*args, **kwargs)
 
+    def _keep_alive(self, ssh):
+        # Paramiko by default sets the socket timeout to 0.1 seconds,
+        # ignoring what we set thru the sshclient. This doesn't help for
+        # keeping long lived connections. Hence we have to bypass it, by
+        # overriding it after the transport is initialized. We are setting
+        # the sockettimeout to None and setting a keepalive packet so that,
+        # the server will keep the connection open. All that does is send
+        # a keepalive packet every ssh_conn_timeout seconds.
+        transport = ssh.get_transport()
+        transport.sock.settimeout(None)
+        transport.set_keepalive(self.conn_timeout)
+
+    def _connect(self, ip):
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        if self.password:
+            ssh.connect(ip,
+                        port=self.port,
+                        username=self.login,
+                        password=self.password,
+                        timeout=self.conn_timeout)
+        elif self.privatekey:
+            pkfile = os.path.expanduser(self.privatekey)
+            privatekey = paramiko.RSAKey.from_private_key_file(pkfile)
+            ssh.connect(ip,
+                        port=self.port,
+                        username=self.login,
+                        pkey=privatekey,
+                        timeout=self.conn_timeout)
+        else:
+            msg = _("Specify a password or private_key")
+            raise exception.CinderException(msg)
+
+        if self.conn_timeout:
+            self._keep_alive(ssh)
+        ssh.server_ip = ip
+        ssh.shell = None
+        ssh.last_used = time.time()
+        return ssh
+
     def create(self):
-        try:
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            if self.password:
-                ssh.connect(self.ip,
-                            port=self.port,
-                            username=self.login,
-                            password=self.password,
-                            timeout=self.conn_timeout)
-            elif self.privatekey:
-                pkfile = os.path.expanduser(self.privatekey)
-                privatekey = paramiko.RSAKey.from_private_key_file(pkfile)
-                ssh.connect(self.ip,
-                            port=self.port,
-                            username=self.login,
-                            pkey=privatekey,
-                            timeout=self.conn_timeout)
-            else:
-                msg = _("Specify a password or private_key")
-                raise exception.CinderException(msg)
-
-            # Paramiko by default sets the socket timeout to 0.1 seconds,
-            # ignoring what we set thru the sshclient. This doesn't help for
-            # keeping long lived connections. Hence we have to bypass it, by
-            # overriding it after the transport is initialized. We are setting
-            # the sockettimeout to None and setting a keepalive packet so that,
-            # the server will keep the connection open. All that does is send
-            # a keepalive packet every ssh_conn_timeout seconds.
-            if self.conn_timeout:
-                transport = ssh.get_transport()
-                transport.sock.settimeout(None)
-                transport.set_keepalive(self.conn_timeout)
+        start = self.ips.index(self.ip) if self.ip in self.ips else 0
+        msg = None
+        for ip in self.ips[start:] + self.ips[:start]:
+            try:
+                ssh = self._connect(ip)
+            except Exception as e:
+                msg = _("Error connecting via ssh: %s") % e
+                LOG.error(msg)
+                continue
+            if ip != self.ip:
+                LOG.warn(_("SSH connections fail over from %(old)s to "
+                           "%(new)s") % {'old': self.ip, 'new': ip})
+                self.ip = ip
             return ssh
-        except Exception as e:
-            msg = _("Error connecting via ssh: %s") % e
-            LOG.error(msg)
-            raise paramiko.SSHException(msg)
+        raise paramiko.SSHException(msg)
+
+    def _is_usable(self, ssh):
+        if not ssh.get_transport().is_active():
+            return False
+        if self.max_idle_time is None:
+            return True
+        idle = time.time() - getattr(ssh, 'last_used', time.time())
+        return idle <= self.max_idle_time
+
+    def _close(self, ssh):
+        if getattr(ssh, 'shell', None) is not None:
+            ssh.shell.close()
+            ssh.shell = None
+        ssh.close()
 
     def get(self):
         """
         Return an item from the pool, when one is available.  This may
-        cause the calling greenthread to block. Check if a connection is active
-        before returning it. For dead connections create and return a new
-        connection.
+        cause the calling greenthread to block. Check if a connection is
+        active and has not been idle for too long before returning it. For
+        such connections create and return a new connection.
         """
         conn = super(SSHPool, self).get()
         if conn:
-            if conn.get_transport().is_active():
+            if self._is_usable(conn):
                 return conn
-            else:
-                conn.close()
-        return self.create()
+            self._close(conn)
+        try:
+            return self.create()
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                # the connection we replace no longer takes up room
+                self.current_size -= 1
+
+    def put(self, ssh):
+        ssh.last_used = time.time()
+        super(SSHPool, self).put(ssh)
 
     def remove(self, ssh):
         """Close an ssh client and remove it from free_items."""
-        ssh.close()
-        ssh = None
+        self._close(ssh)
         if ssh in self.free_items:
-            self.free_items.pop(ssh)
+            self.free_items.remove(ssh)
         if self.current_size > 0:
             self.current_size -= 1
 
+    def failover(self, ssh):
+        """Move on to the next address if ssh is connected to the current.
+
+        Used when a connection stops responding without being closed.
+        """
+        if len(self.ips) > 1 and getattr(ssh, 'server_ip', None) == self.ip:
+            index = self.ips.index(self.ip)
+            self.ip = self.ips[(index + 1) % len(self.ips)]
+
+    def shell(self, ssh, width=80, height=24):
+        """Return the interactive shell of ssh, opened on first use.
+
+        The shell stays open while the connection is in the pool, so that
+        drivers talking to a CLI session can run one command after another
+        without logging in again.
+        """
+        if getattr(ssh, 'shell', None) is None or ssh.shell.closed:
+            ssh.shell = create_channel(ssh, width, height)
+        return ssh.shell
+
+    @contextlib.contextmanager
+    def timed(self, command):
+        """Record how long the command run in the block takes."""
+        name = command.split(None, 1)[0] if command.strip() else command
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            stats = self.command_stats.setdefault(
+                name, {'count': 0, 'total_time': 0.0, 'max_time': 0.0})
+            stats['count'] += 1
+            stats['total_time'] += elapsed
+            stats['max_time'] = max(stats['max_time'], elapsed)
+            LOG.debug(_('SSH command %(name)s took %(elapsed).3f seconds '
+                        'on %(ip)s'),
+                      {'name': name, 'elapsed': elapsed, 'ip': self.ip})
+
 
 def cinderdir():
     import cinder
@@ -927,23 +1015,27 @@ def read_file_as_root(file_path):
 
 
 @contextlib.contextmanager
-def temporary_chown(path, owner_uid=None):
+def temporary_chown(path, owner_uid=None, executor=None):
     """Temporarily chown a path.
 
     :params owner_uid: UID of temporary owner (defaults to current user)
+    :params executor: function running the chown commands (defaults to
+                      execute)
     """
     if owner_uid is None:
         owner_uid = os.getuid()
+    if executor is None:
+        executor = execute
 
     orig_uid = os.stat(path).st_uid
 
     if orig_uid != owner_uid:
-        execute('chown', owner_uid, path, run_as_root=True)
+        executor('chown', owner_uid, path, run_as_root=True)
     try:
         yield
     finally:
         if orig_uid != owner_uid:
-            execute('chown', orig_uid, path, run_as_root=True)
+            executor('chown', orig_uid, path, run_as_root=True)
 
 
 @contextlib.contextmanager
@@ -1016,3 +1108,29 @@ class UndoManager(object):
                 LOG.exception(msg, **kwargs)
 
             self._rollback()
+
+
+class RateLimiter(object):
+    """Paces callers to an average of rate bytes per second.
+
+    Time spent idle is not made up for, so that a limiter shared by
+    copies which come and go does not let a burst through.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._started = None
+        self._consumed = 0
+
+    def consume(self, nbytes):
+        if not self.rate:
+            return
+        now = time.time()
+        if (self._started is None or
+                self._started + self._consumed / float(self.rate) < now):
+            self._started = now
+            self._consumed = 0
+        self._consumed += nbytes
+        delay = self._started + self._consumed / float(self.rate) - now
+        if delay > 0:
+            greenthread.sleep(delay)
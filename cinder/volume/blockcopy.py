@@ -0,0 +1,246 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2013 OpenStack, LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+In-process copying of volume data.
+
+The data is moved through page aligned buffers, with O_DIRECT where the
+source and destination support it. Reads and writes run in native
+threads, so a copy does not stall the other greenthreads of the service.
+"""
+
+import contextlib
+import errno
+import io
+import mmap
+import os
+import sys
+
+from eventlet import greenpool
+from eventlet import tpool
+from oslo.config import cfg
+
+from cinder.openstack.common import log as logging
+from cinder import units
+from cinder import utils
+
+
+LOG = logging.getLogger(__name__)
+
+blockcopy_opts = [
+    cfg.IntOpt('volume_copy_workers',
+               default=2,
+               help='Number of blocks in flight while copying volume data'),
+    cfg.IntOpt('volume_copy_rate',
+               default=0,
+               help='MiB/s each copy of volume data may move. 0 => '
+                    'unlimited'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(blockcopy_opts)
+
+ZERO_SOURCE = '/dev/zero'
+
+# O_DIRECT needs buffers, offsets and lengths aligned to the block size
+# of the device; the page size covers all devices we care about.
+ALIGNMENT = mmap.PAGESIZE
+
+
+@contextlib.contextmanager
+def _accessible(path, mode, execute):
+    """Temporarily chown path to us if we cannot otherwise use it."""
+    if not os.path.exists(path) or os.access(path, mode):
+        yield
+    else:
+        with utils.temporary_chown(path, executor=execute):
+            yield
+
+
+class BlockCopier(object):
+    """Copies the first size bytes of src to dest.
+
+    Blocks are handed out to the workers round robin, and every worker has
+    its own buffer and file descriptors. dest is never truncated.
+
+    :param progress: called with (bytes copied, size) after every block;
+                     an exception raised by it aborts the copy
+    :param rate: bytes per second the whole copy may move, 0 for no limit
+    :param limiter: utils.RateLimiter to pace the copy with instead, to
+                    share one rate between several copies
+    :param sparse: whether to skip blocks of zeros rather than write them,
+                   leaving holes; dest must then read as zeros wherever it
+                   is not written, e.g. be empty or freshly created sparse
+    """
+
+    def __init__(self, src, dest, size, blocksize, workers=1, sync=False,
+                 progress=None, rate=0, sparse=False, limiter=None):
+        self.src = src
+        self.dest = dest
+        self.size = size
+        self.blocksize = blocksize
+        self.blocks = (size + blocksize - 1) // blocksize
+        self.workers = max(min(workers, self.blocks), 1)
+        self.sync = sync
+        self.progress = progress
+        self.copied = 0
+        self._limiter = limiter or utils.RateLimiter(rate)
+        self._sparse = sparse
+        self._direct = (blocksize % ALIGNMENT == 0 and
+                        size % ALIGNMENT == 0)
+        self._zeros = '\0' * blocksize
+        self._error = None
+        # blocks from here on are past the end of src
+        self._end = self.blocks
+
+    def _open(self, path, flags):
+        """Open path, with O_DIRECT if we can; returns (fd, direct)."""
+        if self._direct:
+            try:
+                return os.open(path, flags | os.O_DIRECT), True
+            except OSError as e:
+                if e.errno != errno.EINVAL:
+                    raise
+        return os.open(path, flags), False
+
+    def _is_zero(self, buf, length):
+        if length == self.blocksize:
+            return buf[:] == self._zeros
+        return buf[:length] == self._zeros[:length]
+
+    def _read(self, fd, offset, buf, length):
+        """Read length bytes at offset; fewer only at end of file."""
+        os.lseek(fd, offset, os.SEEK_SET)
+        n = min(io.FileIO(fd, 'r', closefd=False).readinto(buf) or 0, length)
+        if n in (0, length):
+            return n
+        # the rest of a short read, through a descriptor without O_DIRECT
+        # since the offset it starts at may not be aligned
+        tail_fd = os.open(self.src, os.O_RDONLY)
+        try:
+            os.lseek(tail_fd, offset + n, os.SEEK_SET)
+            while n < length:
+                data = os.read(tail_fd, length - n)
+                if not data:
+                    break
+                buf[n:n + len(data)] = data
+                n += len(data)
+        finally:
+            os.close(tail_fd)
+        return n
+
+    def _write(self, fd, offset, buf, length):
+        os.lseek(fd, offset, os.SEEK_SET)
+        f = io.FileIO(fd, 'w', closefd=False)
+        done = 0
+        while done < length:
+            done += f.write(buffer(buf, done, length - done))
+
+    def _copied(self, nbytes):
+        self.copied += nbytes
+        self._limiter.consume(nbytes)
+        if self.progress is not None:
+            self.progress(self.copied, self.size)
+
+    def _copy_blocks(self, first):
+        buf = mmap.mmap(-1, self.blocksize)
+        src_fd = None
+        dest_fd = None
+        try:
+            if self.src != ZERO_SOURCE:
+                src_fd, direct = self._open(self.src, os.O_RDONLY)
+            dest_fd, direct = self._open(self.dest, os.O_WRONLY)
+            for block in xrange(first, self.blocks, self.workers):
+                if self._error is not None or block >= self._end:
+                    break
+                offset = block * self.blocksize
+                length = min(self.blocksize, self.size - offset)
+                if src_fd is not None:
+                    n = tpool.execute(self._read, src_fd, offset, buf,
+                                      length)
+                else:
+                    n = length
+                if n and not (self._sparse and self._is_zero(buf, n)):
+                    if direct and n % ALIGNMENT:
+                        # the unaligned end of src cannot go through
+                        # O_DIRECT
+                        tail_fd = os.open(self.dest, os.O_WRONLY)
+                        try:
+                            tpool.execute(self._write, tail_fd, offset,
+                                          buf, n)
+                        finally:
+                            os.close(tail_fd)
+                    else:
+                        tpool.execute(self._write, dest_fd, offset, buf, n)
+                if n < length:
+                    self._end = min(self._end, block + 1)
+                self._copied(n)
+            if self.sync and not direct:
+                tpool.execute(os.fdatasync, dest_fd)
+        finally:
+            buf.close()
+            if src_fd is not None:
+                os.close(src_fd)
+            if dest_fd is not None:
+                os.close(dest_fd)
+
+    def _worker(self, first):
+        try:
+            self._copy_blocks(first)
+        except Exception:
+            if self._error is None:
+                self._error = sys.exc_info()
+
+    def copy(self):
+        pool = greenpool.GreenPool(self.workers)
+        for first in range(self.workers):
+            pool.spawn_n(self._worker, first)
+        pool.waitall()
+        if self._error is not None:
+            raise self._error[0], self._error[1], self._error[2]
+        if self._sparse:
+            # trailing blocks of zeros were skipped as well
+            with open(self.dest, 'r+b') as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() < self.copied:
+                    f.truncate(self.copied)
+        LOG.debug(_('Copied %(copied)d bytes from %(src)s to %(dest)s'),
+                  {'copied': self.copied, 'src': self.src,
+                   'dest': self.dest})
+
+
+def copy(src, dest, size, blocksize, sync=False, execute=utils.execute,
+         progress=None, rate=None, workers=None, sparse=False,
+         limiter=None):
+    """Copy the first size bytes of src to dest.
+
+    src may be ZERO_SOURCE to zero dest. A missing dest is created as root,
+    like the drivers create their volume files. Files and devices we are
+    not allowed to use are chowned to us for the duration of the copy.
+    """
+    if rate is None:
+        rate = CONF.volume_copy_rate * units.MiB
+    if workers is None:
+        workers = CONF.volume_copy_workers
+    copier = BlockCopier(src, dest, size, blocksize, workers=workers,
+                         sync=sync, progress=progress, rate=rate,
+                         sparse=sparse, limiter=limiter)
+    if not os.path.exists(dest):
+        execute('truncate', '-s', 0, dest, run_as_root=True)
+    with _accessible(src, os.R_OK, execute):
+        with _accessible(dest, os.W_OK, execute):
+            copier.copy()
+    return copier.copied
@@ -62,7 +62,12 @@ volume_opts = [
     cfg.BoolOpt('use_multipath_for_image_xfer',
                 default=False,
                 help='Do we attach/detach volumes in cinder using multipath '
-                     'for volume to image and image to volume transfers?'), ]
+                     'for volume to image and image to volume transfers?'),
+    cfg.IntOpt('image_golden_volumes',
+               default=0,
+               help='Number of images kept on the backend as golden '
+                    'volumes, which new volumes created from the image are '
+                    'cloned from (LVM and RBD only). 0 => none'), ]
 
 CONF = cfg.CONF
 CONF.register_opts(volume_opts)
@@ -149,6 +154,16 @@ class VolumeDriver(object):
         """Synchronously recreates an export for a volume."""
         raise NotImplementedError()
 
+    def ensure_exports(self, context, volumes):
+        """Synchronously recreates the exports for a list of volumes.
+
+        Called at startup with all the volumes which should be exported,
+        so that drivers can look at the state of their exports once
+        rather than for every volume.
+        """
+        for volume in volumes:
+            self.ensure_export(context, volume)
+
     def create_export(self, context, volume):
         """Exports the volume. Can optionally return a Dictionary of changes
         to the volume object to be persisted.
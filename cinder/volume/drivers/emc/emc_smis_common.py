@@ -23,13 +23,13 @@ It supports VNX and VMAX arrays.
 
 """
 
-import time
-
 from oslo.config import cfg
 from xml.dom.minidom import parseString
 
 from cinder import exception
 from cinder.openstack.common import log as logging
+from cinder.volume import jobtracker
+from cinder.volume import statscache
 
 LOG = logging.getLogger(__name__)
 
@@ -70,6 +70,10 @@ class EMCSMISCommon():
         self.user, self.passwd = self._get_ecom_cred()
         self.url = 'http://' + ip + ':' + port
         self.conn = self._get_ecom_connection()
+        # DeviceID => instance path, and ElementName => DeviceID, of the
+        # volumes on the array; filled on lookup misses
+        self._lun_paths = {}
+        self._lun_device_ids = {}
 
     def create_volume(self, volume):
         """Creates a EMC(VMAX/VNX) volume."""
@@ -139,6 +143,8 @@ class EMCSMISCommon():
                              'error': errordesc})
                 raise exception.VolumeBackendAPIException(data=errordesc)
 
+        self._index_new_lun(volumename, job, 'TheElement')
+
         LOG.debug(_('Leaving create_volume: %(volumename)s  '
                   'Return code: %(rc)lu')
                   % {'volumename': volumename,
@@ -225,6 +231,8 @@ class EMCSMISCommon():
                 raise exception.VolumeBackendAPIException(
                     data=exception_message)
 
+        self._index_new_lun(volumename, job, 'TargetElement')
+
         LOG.debug(_('Create Volume from Snapshot: Volume: %(volumename)s  '
                   'Snapshot: %(snapshotname)s.  Successfully clone volume '
                   'from snapshot.  Finding the clone relationship.')
@@ -349,6 +357,8 @@ class EMCSMISCommon():
                 raise exception.VolumeBackendAPIException(
                     data=exception_message)
 
+        self._index_new_lun(volumename, job, 'TargetElement')
+
         LOG.debug(_('Create Cloned Volume: Volume: %(volumename)s  '
                   'Source Volume: %(srcname)s.  Successfully cloned volume '
                   'from source volume.  Finding the clone relationship.')
@@ -460,6 +470,8 @@ class EMCSMISCommon():
                 raise exception.VolumeBackendAPIException(
                     data=exception_message)
 
+        self._forget_lun(volumename)
+
         LOG.debug(_('Leaving delete_volume: %(volumename)s  Return code: '
                   '%(rc)lu')
                   % {'volumename': volumename,
@@ -530,6 +542,8 @@ class EMCSMISCommon():
                 raise exception.VolumeBackendAPIException(
                     data=exception_message)
 
+        self._index_new_lun(snapshotname, job, 'TargetElement')
+
         LOG.debug(_('Leaving create_snapshot: Snapshot: %(snapshot)s '
                   'Volume: %(volume)s  Return code: %(rc)lu.') %
                   {'snapshot': snapshotname, 'volume': volumename, 'rc': rc})
@@ -606,6 +620,8 @@ class EMCSMISCommon():
                 raise exception.VolumeBackendAPIException(
                     data=exception_message)
 
+        self._forget_lun(snapshotname)
+
         LOG.debug(_('Leaving delete_snapshot: Volume: %(volumename)s  '
                   'Snapshot: %(snapshotname)s  Return code: %(rc)lu.')
                   % {'volumename': volumename,
@@ -858,13 +874,43 @@ class EMCSMISCommon():
         self.conn = self._get_ecom_connection()
         storage_type = self._get_storage_type()
 
-        pool, storagesystem = self._find_pool(storage_type, True)
+        key = 'emc-%s-pools' % self.url.split('//', 1)[-1]
+        capacities = statscache.get_array_stats_cache().get(
+            key, self._collect_pool_capacities)
+        if str(storage_type) not in capacities:
+            exception_message = (_("Pool %(storage_type)s is not found.")
+                                 % {'storage_type': storage_type})
+            LOG.error(exception_message)
+            raise exception.VolumeBackendAPIException(data=exception_message)
 
-        self.stats['total_capacity_gb'] = pool['TotalManagedSpace']
-        self.stats['free_capacity_gb'] = pool['RemainingManagedSpace']
+        total, free = capacities[str(storage_type)]
+        self.stats['total_capacity_gb'] = total
+        self.stats['free_capacity_gb'] = free
 
         return self.stats
 
+    def _collect_pool_capacities(self):
+        """Return {pool name: [total, free]} for the pools of the server.
+
+        Unified pools come first when names clash, as in _find_pool.
+        """
+        capacities = {}
+        for poolclass in ('EMC_UnifiedStoragePool',
+                          'EMC_VirtualProvisioningPool'):
+            pools = self.conn.EnumerateInstances(
+                poolclass,
+                PropertyList=['InstanceID', 'TotalManagedSpace',
+                              'RemainingManagedSpace'])
+            for pool in pools:
+                poolname, systemname = self._parse_pool_instance_id(
+                    pool['InstanceID'])
+                if poolname is None or systemname is None:
+                    continue
+                capacities.setdefault(str(poolname),
+                                      [int(pool['TotalManagedSpace']),
+                                       int(pool['RemainingManagedSpace'])])
+        return capacities
+
     def _get_storage_type(self, filename=None):
         """Get the storage type from the config file."""
         if filename is None:
@@ -1081,8 +1127,75 @@ class EMCSMISCommon():
                   % {'poolname': poolname, 'systemname': systemname})
         return poolname, systemname
 
+    def _index_lun(self, volumename, path):
+        """Remember the instance path of a volume for later lookups."""
+        self._lun_paths[path['DeviceID']] = path
+        self._lun_device_ids[volumename] = path['DeviceID']
+
+    def _index_new_lun(self, volumename, job, element):
+        """Index a volume just created, if the method returned its path.
+
+        Jobs that complete asynchronously may not return the path; the
+        volume is then indexed on its first lookup.
+        """
+        path = job.get(element)
+        if path is not None:
+            self._index_lun(volumename, path)
+
+    def _forget_lun(self, volumename):
+        device_id = self._lun_device_ids.pop(volumename, None)
+        if device_id is not None:
+            self._lun_paths.pop(device_id, None)
+
+    def _refresh_lun_index(self):
+        """Rebuild the volume index with a single enumeration.
+
+        Only the properties that the index is keyed on are fetched, rather
+        than every volume instance.
+        """
+        lun_paths = {}
+        lun_device_ids = {}
+        instances = self.conn.EnumerateInstances(
+            'EMC_StorageVolume', PropertyList=['ElementName', 'DeviceID'])
+        for instance in instances:
+            lun_paths[instance['DeviceID']] = instance.path
+            lun_device_ids[instance['ElementName']] = instance['DeviceID']
+        self._lun_paths = lun_paths
+        self._lun_device_ids = lun_device_ids
+
+        LOG.debug(_("Indexed %d volumes on the array.") % len(lun_paths))
+
+    def _get_indexed_lun(self, device_id, volumename):
+        """Return the instance of an indexed volume, None on a miss.
+
+        Entries of volumes that are gone or were renamed are dropped.
+        """
+        if device_id is None:
+            device_id = self._lun_device_ids.get(volumename)
+            by_name = True
+        else:
+            by_name = False
+        path = self._lun_paths.get(device_id)
+        if path is None:
+            return None
+
+        try:
+            instance = self.conn.GetInstance(path, LocalOnly=False)
+            stale = (instance['DeviceID'] != device_id or
+                     (by_name and instance['ElementName'] != volumename))
+        except Exception:
+            # removed from the array behind our back
+            stale = True
+        if stale:
+            LOG.debug(_("Volume %(volumename)s is no longer at %(path)s.")
+                      % {'volumename': volumename, 'path': str(path)})
+            self._lun_paths.pop(device_id, None)
+            if self._lun_device_ids.get(volumename) == device_id:
+                del self._lun_device_ids[volumename]
+            return None
+        return instance
+
     def _find_lun(self, volume):
-        foundinstance = None
         try:
             device_id = volume['provider_location']
         except Exception:
@@ -1090,28 +1203,17 @@ class EMCSMISCommon():
 
         volumename = volume['name']
 
-        names = self.conn.EnumerateInstanceNames('EMC_StorageVolume')
-
-        for n in names:
-            if device_id is not None:
-                if n['DeviceID'] == device_id:
-                    vol_instance = self.conn.GetInstance(n)
-                    foundinstance = vol_instance
-                    break
-                else:
-                    continue
-
-            else:
-                vol_instance = self.conn.GetInstance(n)
-                if vol_instance['ElementName'] == volumename:
-                    foundinstance = vol_instance
-                    volume['provider_location'] = foundinstance['DeviceID']
-                    break
+        foundinstance = self._get_indexed_lun(device_id, volumename)
+        if foundinstance is None:
+            self._refresh_lun_index()
+            foundinstance = self._get_indexed_lun(device_id, volumename)
 
         if foundinstance is None:
             LOG.debug(_("Volume %(volumename)s not found on the array.")
                       % {'volumename': volumename})
         else:
+            if device_id is None:
+                volume['provider_location'] = foundinstance['DeviceID']
             LOG.debug(_("Volume name: %(volumename)s  Volume instance: "
                       "%(vol_instance)s.")
                       % {'volumename': volumename,
@@ -1123,29 +1225,26 @@ class EMCSMISCommon():
                                  waitforsync=True):
         foundsyncname = None
         storage_system = None
-        percent_synced = 0
 
         LOG.debug(_("Source: %(volumename)s  Target: %(snapshotname)s.")
                   % {'volumename': volumename, 'snapshotname': snapshotname})
 
-        names = self.conn.EnumerateInstanceNames(
-            'SE_StorageSynchronized_SV_SV')
-
-        for n in names:
-            snapshot_instance = self.conn.GetInstance(n['SyncedElement'],
-                                                      LocalOnly=False)
-            if snapshotname != snapshot_instance['ElementName']:
-                continue
-
-            vol_instance = self.conn.GetInstance(n['SystemElement'],
-                                                 LocalOnly=False)
-            if vol_instance['ElementName'] == volumename:
-                foundsyncname = n
-                storage_system = vol_instance['SystemName']
-                if waitforsync:
-                    sync_instance = self.conn.GetInstance(n, LocalOnly=False)
-                    percent_synced = sync_instance['PercentSynced']
-                break
+        snapshot_instance = self._find_lun({'name': snapshotname})
+        vol_instance = self._find_lun({'name': volumename})
+
+        if snapshot_instance is not None and vol_instance is not None:
+            # Only the synchronizations the target takes part in, rather
+            # than every one on the array
+            names = self.conn.ReferenceNames(
+                snapshot_instance.path,
+                ResultClass='SE_StorageSynchronized_SV_SV',
+                Role='SyncedElement')
+
+            for n in names:
+                if n['SystemElement']['DeviceID'] == vol_instance['DeviceID']:
+                    foundsyncname = n
+                    storage_system = vol_instance['SystemName']
+                    break
 
         if foundsyncname is None:
             LOG.debug(_("Source: %(volumename)s  Target: %(snapshotname)s. "
@@ -1158,14 +1257,20 @@ class EMCSMISCommon():
                       % {'storage_system': storage_system,
                          'sync': str(foundsyncname)})
             # Wait for SE_StorageSynchronized_SV_SV to be fully synced
-            while waitforsync and percent_synced < 100:
-                time.sleep(10)
-                sync_instance = self.conn.GetInstance(foundsyncname,
-                                                      LocalOnly=False)
-                percent_synced = sync_instance['PercentSynced']
+            if waitforsync:
+                self._wait_for_sync(foundsyncname)
 
         return foundsyncname, storage_system
 
+    def _wait_for_sync(self, syncname):
+        def _poll_sync():
+            sync_instance = self.conn.GetInstance(syncname, LocalOnly=False)
+            if sync_instance['PercentSynced'] < 100:
+                return jobtracker.RUNNING
+            return sync_instance
+
+        jobtracker.get_job_tracker().wait(_poll_sync, name=str(syncname))
+
     def _find_initiator_names(self, connector):
         foundinitiatornames = []
         iscsi = 'iscsi'
@@ -1191,7 +1296,7 @@ class EMCSMISCommon():
     def _wait_for_job_complete(self, job):
         jobinstancename = job['Job']
 
-        while True:
+        def _poll_job():
             jobinstance = self.conn.GetInstance(jobinstancename,
                                                 LocalOnly=False)
             jobstate = jobinstance['JobState']
@@ -1203,10 +1308,11 @@ class EMCSMISCommon():
             # Completed, Terminated, Killed, Exception, Service,
             # Query Pending, DMTF Reserved, Vendor Reserved")]
             if jobstate in [2L, 3L, 4L, 32767L]:
-                time.sleep(10)
-            else:
-                break
+                return jobtracker.RUNNING
+            return jobinstance
 
+        jobinstance = jobtracker.get_job_tracker().wait(
+            _poll_job, name=str(jobinstancename))
         rc = jobinstance['ErrorCode']
         errordesc = jobinstance['ErrorDescription']
 
@@ -1217,37 +1323,30 @@ class EMCSMISCommon():
     def _find_lunmasking_scsi_protocol_controller(self, storage_system,
                                                   connector):
         foundCtrl = None
-        initiators = self._find_initiator_names(connector)
-        controllers = self.conn.EnumerateInstanceNames(
-            'EMC_LunMaskingSCSIProtocolController')
-        for ctrl in controllers:
-            if storage_system != ctrl['SystemName']:
-                continue
-            associators =\
-                self.conn.Associators(ctrl,
-                                      resultClass='EMC_StorageHardwareID')
-            for assoc in associators:
-                # if EMC_StorageHardwareID matches the initiator,
-                # we found the existing EMC_LunMaskingSCSIProtocolController
-                # (Storage Group for VNX)
+        # Follow the associations of the initiators' EMC_StorageHardwareID
+        # instead of asking every controller on the array for its own
+        hardwareids = self._find_storage_hardwareids(connector)
+        for hardwareid in hardwareids:
+            controllers =\
+                self.conn.AssociatorNames(
+                    hardwareid,
+                    resultClass='EMC_LunMaskingSCSIProtocolController')
+            for ctrl in controllers:
+                # the existing EMC_LunMaskingSCSIProtocolController
+                # (Storage Group for VNX) on this storage system
                 # we can use for masking a new LUN
-                hardwareid = assoc['StorageID']
-                for initiator in initiators:
-                    if hardwareid.lower() == initiator.lower():
-                        foundCtrl = ctrl
-                        break
-
-                if foundCtrl is not None:
+                if storage_system == ctrl['SystemName']:
+                    foundCtrl = ctrl
                     break
 
             if foundCtrl is not None:
                 break
 
         LOG.debug(_("LunMaskingSCSIProtocolController for storage system "
-                  "%(storage_system)s and initiator %(initiator)s is  "
+                  "%(storage_system)s and hardware IDs %(hardwareids)s is  "
                   "%(ctrl)s.")
                   % {'storage_system': storage_system,
-                     'initiator': initiators,
+                     'hardwareids': str(hardwareids),
                      'ctrl': str(foundCtrl)})
         return foundCtrl
 
@@ -1329,35 +1428,31 @@ class EMCSMISCommon():
 
         return numVolumesMapped
 
-    # Find an available device number that a host can see
-    def _find_avail_device_number(self, storage_system):
+    # Find an available device number that a host can see through the
+    # specified LunMaskingSCSIProtocolController
+    def _find_avail_device_number(self, lunmask_ctrl):
         out_device_number = '000000'
         out_num_device_number = 0
         numlist = []
-        myunitnames = []
 
-        unitnames = self.conn.EnumerateInstanceNames(
-            'CIM_ProtocolControllerForUnit')
+        # Only the units of this controller, rather than every
+        # CIM_ProtocolControllerForUnit on the array
+        unitnames = self.conn.ReferenceNames(
+            lunmask_ctrl,
+            ResultClass='CIM_ProtocolControllerForUnit')
         for unitname in unitnames:
-            controller = unitname['Antecedent']
-            if storage_system != controller['SystemName']:
-                continue
-            classname = controller['CreationClassName']
-            index = classname.find('LunMaskingSCSIProtocolController')
-            if index > -1:
-                unitinstance = self.conn.GetInstance(unitname,
-                                                     LocalOnly=False)
-                numDeviceNumber = int(unitinstance['DeviceNumber'])
-                numlist.append(numDeviceNumber)
-                myunitnames.append(unitname)
+            unitinstance = self.conn.GetInstance(unitname,
+                                                 LocalOnly=False)
+            numDeviceNumber = int(unitinstance['DeviceNumber'])
+            numlist.append(numDeviceNumber)
 
-        maxnum = max(numlist)
-        out_num_device_number = maxnum + 1
+        if numlist:
+            out_num_device_number = max(numlist) + 1
 
         out_device_number = '%06d' % out_num_device_number
 
-        LOG.debug(_("Available device number on %(storage)s: %(device)s.")
-                  % {'storage': storage_system, 'device': out_device_number})
+        LOG.debug(_("Available device number on %(ctrl)s: %(device)s.")
+                  % {'ctrl': str(lunmask_ctrl), 'device': out_device_number})
         return out_device_number
 
     # Find a device number that a host can see for a volume
@@ -1554,7 +1649,7 @@ class EMCSMISCommon():
         foundInstances = []
         wwpns = self._find_initiator_names(connector)
         hardwareids = self.conn.EnumerateInstances(
-            'SE_StorageHardwareID')
+            'SE_StorageHardwareID', PropertyList=['StorageID'])
         for hardwareid in hardwareids:
             storid = hardwareid['StorageID']
             for wwpn in wwpns:
@@ -52,6 +52,8 @@ class GlusterfsDriver(nfs.RemoteFsDriver):
     as block device on hypervisor.
     """
 
+    default_share_selection_policy = 'most_free'
+
     def __init__(self, *args, **kwargs):
         super(GlusterfsDriver, self).__init__(*args, **kwargs)
         self.configuration.append_config_values(volume_opts)
@@ -87,9 +89,6 @@ class GlusterfsDriver(nfs.RemoteFsDriver):
         """Just to override parent behavior."""
         pass
 
-    def create_cloned_volume(self, volume, src_vref):
-        raise NotImplementedError()
-
     def create_volume(self, volume):
         """Creates a volume."""
 
@@ -100,6 +99,8 @@ class GlusterfsDriver(nfs.RemoteFsDriver):
         LOG.info(_('casted to %s') % volume['provider_location'])
 
         self._do_create_volume(volume)
+        self._update_allocated_space(volume['provider_location'],
+                                     volume['size'])
 
         return {'provider_location': volume['provider_location']}
 
@@ -116,6 +117,9 @@ class GlusterfsDriver(nfs.RemoteFsDriver):
         mounted_path = self.local_path(volume)
 
         self._execute('rm', '-f', mounted_path, run_as_root=True)
+        self._delete_info(mounted_path)
+        self._update_allocated_space(volume['provider_location'],
+                                     -volume['size'])
 
     def ensure_export(self, ctx, volume):
         """Synchronously recreates an export for a logical volume."""
@@ -137,6 +141,9 @@ class GlusterfsDriver(nfs.RemoteFsDriver):
                 'name': volume['name']}
         if volume['provider_location'] in self.shares:
             data['options'] = self.shares[volume['provider_location']]
+        info = self._read_info(self.local_path(volume))
+        if 'format' in info:
+            data['format'] = info['format']
         return {
             'driver_volume_type': 'glusterfs',
             'data': data
@@ -186,26 +193,25 @@ class GlusterfsDriver(nfs.RemoteFsDriver):
 
     def _find_share(self, volume_size_for):
         """Choose GlusterFS share among available ones for given volume size.
-        Current implementation looks for greatest capacity.
+        Among the shares with enough capacity, the one chosen by
+        remotefs_share_selection_policy is used, by default the one with
+        the greatest capacity.
         :param volume_size_for: int size in GB
         """
 
         if not self._mounted_shares:
             raise exception.GlusterfsNoSharesMounted()
 
-        greatest_size = 0
-        greatest_share = None
-
-        for glusterfs_share in self._mounted_shares:
-            capacity = self._get_available_capacity(glusterfs_share)[0]
-            if capacity > greatest_size:
-                greatest_share = glusterfs_share
-                greatest_size = capacity
+        requested_size = volume_size_for * 1024 * 1024 * 1024
+        capacities = self._get_shares_capacity(self._mounted_shares)
+        candidates = [(share, capacities[share])
+                      for share in self._mounted_shares
+                      if capacities[share][1] >= requested_size]
 
-        if volume_size_for * 1024 * 1024 * 1024 > greatest_size:
+        if not candidates:
             raise exception.GlusterfsNoSuitableShareFound(
                 volume_size=volume_size_for)
-        return greatest_share
+        return self._get_share_selection_policy().select(candidates)
 
     def _get_mount_point_for_share(self, glusterfs_share):
         """Return mount point for share.
@@ -230,14 +236,18 @@ class GlusterfsDriver(nfs.RemoteFsDriver):
         if self.configuration.glusterfs_disk_util == 'df':
             available = int(out.split()[3])
         else:
-            out, _ = self._execute('du', '-sb', '--apparent-size',
-                                   '--exclude', '*snapshot*', mount_point,
-                                   run_as_root=True)
-            used = int(out.split()[0])
+            used = int(self._get_allocated_space(glusterfs_share))
             available = size - used
 
         return available, size
 
+    def _get_capacity_info(self, glusterfs_share):
+        """Return (total_size, total_available, total_allocated) in bytes.
+        :param glusterfs_share: example 172.18.194.100:/var/glusterfs
+        """
+        available, size = self._get_available_capacity(glusterfs_share)
+        return size, available, size - available
+
     def _mount_glusterfs(self, glusterfs_share, mount_path, ensure=False):
         """Mount GlusterFS share to mount path."""
         self._execute('mkdir', '-p', mount_path)
@@ -279,8 +289,9 @@ class GlusterfsDriver(nfs.RemoteFsDriver):
 
         global_capacity = 0
         global_free = 0
+        capacities = self._get_shares_capacity(self._mounted_shares)
         for nfs_share in self._mounted_shares:
-            free, capacity = self._get_available_capacity(nfs_share)
+            capacity, free, allocated = capacities[nfs_share]
             global_capacity += capacity
             global_free += free
 
@@ -18,11 +18,8 @@
 Volume driver for HUAWEI T series and Dorado storage systems.
 """
 import base64
-import os
-import paramiko
 import re
 import socket
-import threading
 import time
 
 from oslo.config import cfg
@@ -33,6 +30,7 @@ from cinder.openstack.common import excutils
 from cinder.openstack.common import log as logging
 from cinder import utils
 from cinder.volume import driver
+from cinder.volume import statscache
 
 LOG = logging.getLogger(__name__)
 
@@ -55,54 +53,17 @@ CONF.register_opts(huawei_opt)
 class SSHConn(utils.SSHPool):
     """Define a new class inherited to SSHPool.
 
-    This class rewrites method create() and defines a private method
+    This class rewrites method _keep_alive() and defines a private method
     ssh_read() which reads results of ssh commands.
     """
 
-    def __init__(self, ip, port, conn_timeout, login, password,
-                 privatekey=None, *args, **kwargs):
-
-        super(SSHConn, self).__init__(ip, port, conn_timeout, login,
-                                      password, privatekey=None,
-                                      *args, **kwargs)
-        self.lock = threading.Lock()
-
-    def create(self):
-        """Create an SSH client.
+    def _keep_alive(self, ssh):
+        """Send keepalive packets over the connection.
 
         Because seting socket timeout to be None will cause client.close()
-        blocking, here we have to rewrite method create() and use default
-        socket timeout value 0.1.
+        blocking, here we have to keep the default socket timeout value 0.1.
         """
-        try:
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            if self.password:
-                ssh.connect(self.ip,
-                            port=self.port,
-                            username=self.login,
-                            password=self.password,
-                            timeout=self.conn_timeout)
-            elif self.privatekey:
-                pkfile = os.path.expanduser(self.privatekey)
-                privatekey = paramiko.RSAKey.from_private_key_file(pkfile)
-                ssh.connect(self.ip,
-                            port=self.port,
-                            username=self.login,
-                            pkey=privatekey,
-                            timeout=self.conn_timeout)
-            else:
-                msg = _("Specify a password or private_key")
-                raise exception.CinderException(msg)
-
-            if self.conn_timeout:
-                transport = ssh.get_transport()
-                transport.set_keepalive(self.conn_timeout)
-            return ssh
-        except Exception as e:
-            msg = _("Error connecting via ssh: %s") % e
-            LOG.error(msg)
-            raise paramiko.SSHException(msg)
+        ssh.get_transport().set_keepalive(self.conn_timeout)
 
     def ssh_read(self, channel, cmd, timeout):
         """Get results of CLI commands."""
@@ -772,51 +733,23 @@ class HuaweiISCSIDriver(driver.ISCSIDriver):
         user = self.login_info['UserName']
         pwd = self.login_info['UserPassword']
         if not self.ssh_pool:
-            self.ssh_pool = SSHConn(ip0, 22, 30, user, pwd)
+            self.ssh_pool = SSHConn(ip0, 22, 30, user, pwd,
+                                    failover_ips=[ip1])
         ssh_client = None
         while True:
-            if connect_times == 1:
-                # Switch to the other controller.
-                self.ssh_pool.lock.acquire()
-                if ssh_client:
-                    if ssh_client.server_ip == self.ssh_pool.ip:
-                        if self.ssh_pool.ip == ip0:
-                            self.ssh_pool.ip = ip1
-                        else:
-                            self.ssh_pool.ip = ip0
-                    # Create a new client.
-                    if ssh_client.chan:
-                        ssh_client.chan.close()
-                        ssh_client.chan = None
-                        ssh_client.server_ip = None
-                        ssh_client.close()
-                        ssh_client = None
-                        ssh_client = self.ssh_pool.create()
-                else:
-                    self.ssh_pool.ip = ip1
-                self.ssh_pool.lock.release()
             try:
                 if not ssh_client:
                     ssh_client = self.ssh_pool.get()
-                # "server_ip" shows controller connecting with the ssh client.
-                if ('server_ip' not in ssh_client.__dict__ or
-                        not ssh_client.server_ip):
-                    self.ssh_pool.lock.acquire()
-                    ssh_client.server_ip = self.ssh_pool.ip
-                    self.ssh_pool.lock.release()
-                # An SSH client owns one "chan".
-                if ('chan' not in ssh_client.__dict__ or
-                        not ssh_client.chan):
-                    ssh_client.chan =\
-                        utils.create_channel(ssh_client, 600, 800)
-
-                while True:
-                    ssh_client.chan.send(cmd + '\n')
-                    out = self.ssh_pool.ssh_read(ssh_client.chan, cmd, 20)
-                    if out.find('(y/n)') > -1:
-                        cmd = 'y'
-                    else:
-                        break
+                # An SSH client keeps its CLI session between commands.
+                channel = self.ssh_pool.shell(ssh_client, 600, 800)
+                with self.ssh_pool.timed(cmd):
+                    while True:
+                        channel.send(cmd + '\n')
+                        out = self.ssh_pool.ssh_read(channel, cmd, 20)
+                        if out.find('(y/n)') > -1:
+                            cmd = 'y'
+                        else:
+                            break
                 self.ssh_pool.put(ssh_client)
 
                 index = out.find(user + ':/>')
@@ -828,6 +761,11 @@ class HuaweiISCSIDriver(driver.ISCSIDriver):
             except Exception as err:
                 if connect_times < 1:
                     connect_times += 1
+                    # Switch to the other controller.
+                    if ssh_client:
+                        self.ssh_pool.failover(ssh_client)
+                        self.ssh_pool.remove(ssh_client)
+                        ssh_client = None
                     continue
                 else:
                     if ssh_client:
@@ -1527,7 +1465,11 @@ class HuaweiISCSIDriver(driver.ISCSIDriver):
             lun_type = 'Thin'
         elif (self.device_type['type'] == 'Dorado5100' or not lun_type):
             lun_type = 'Thick'
-        poolinfo_dev = self._find_pool_info(lun_type)
+        # Shared with the other backends of the node using the array.
+        key = 'huawei-%s-pools-%s' % (self.login_info['ControllerIP0'],
+                                      lun_type)
+        poolinfo_dev = statscache.get_array_stats_cache().get(
+            key, lambda: self._find_pool_info(lun_type))
         pools_conf = root.findall('LUN/StoragePool')
         total_free_capacity = 0.0
         for poolinfo in poolinfo_dev:
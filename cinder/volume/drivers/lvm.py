@@ -20,17 +20,24 @@ Driver for Linux servers running LVM.
 
 """
 
+import collections
+import contextlib
 import math
 import os
 import re
 
+from eventlet import greenpool
 from oslo.config import cfg
 
 from cinder.brick.iscsi import iscsi
+from cinder.brick.local_dev import lvm as brick_lvm
 from cinder import exception
+from cinder.image import cache as image_cache
 from cinder.image import image_utils
+from cinder.openstack.common import excutils
 from cinder.openstack.common import fileutils
 from cinder.openstack.common import log as logging
+from cinder import units
 from cinder import utils
 from cinder.volume import driver
 from cinder.volume import utils as volutils
@@ -48,6 +55,26 @@ volume_opts = [
     cfg.IntOpt('volume_clear_size',
                default=0,
                help='Size in MiB to wipe at start of old volumes. 0 => all'),
+    cfg.BoolOpt('volume_clear_defer',
+                default=True,
+                help='Rename deleted volumes out of the way and wipe and '
+                     'remove them in the background, instead of wiping '
+                     'them before the delete returns'),
+    cfg.IntOpt('volume_clear_workers',
+               default=1,
+               help='Number of deleted volumes wiped at once in the '
+                    'background'),
+    cfg.IntOpt('volume_clear_rate',
+               default=0,
+               help='MiB/s shared by the background wipes of deleted '
+                    'volumes (volume_clear=zero only). 0 => unlimited'),
+    cfg.StrOpt('volume_clear_ionice',
+               default=None,
+               help='ionice class, and optionally priority, the '
+                    'background wipes of deleted volumes run with, e.g. '
+                    '"-c3" for the idle class or "-c2 -n7" (volume_clear='
+                    'shred only, zero wipes are paced with '
+                    'volume_clear_rate)'),
     cfg.StrOpt('pool_size',
                default=None,
                help='Size of thin provisioning pool '
@@ -56,20 +83,191 @@ volume_opts = [
                default=0,
                help='If set, create lvms with multiple mirrors. Note that '
                     'this requires lvm_mirrors + 2 pvs with available space'),
+    cfg.StrOpt('lvm_clone_strategy',
+               default='auto',
+               help='How volumes are cloned and created from snapshots: '
+                    'snapshot (thin snapshot, the source must be a thin '
+                    'volume), copy (full copy) or auto (snapshot for thin '
+                    'sources, copy otherwise)'),
+    cfg.IntOpt('lvm_metadata_cache_ttl',
+               default=30,
+               help='Seconds the metadata of the VG and its LVs is cached '
+                    'for, to pick up changes made outside of this service. '
+                    '0 => read it for every lookup'),
+    cfg.IntOpt('iscsi_export_workers',
+               default=8,
+               help='Number of missing iSCSI targets recreated at once at '
+                    'startup (tgtadm only)'),
 ]
 
 CONF = cfg.CONF
 CONF.register_opts(volume_opts)
 
 
+class CopyCloneStrategy(object):
+    """Clones by copying all of the source into a new volume.
+
+    Volumes are copied through a temporary snapshot, so that the source
+    stays usable while it is copied. Progress is logged every
+    PROGRESS_STEP percent, and kept in the driver's clone_progress by
+    volume id until the copy is done; the stats of the driver publish it.
+    """
+
+    # percentage steps at which progress is logged
+    PROGRESS_STEP = 10
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def _copy(self, src_path, volume, size_in_g):
+        progress = self.driver.clone_progress
+        logged = [0]
+
+        def report(copied, total):
+            percent = copied * 100 // total
+            progress[volume['id']] = percent
+            if percent >= logged[0] + self.PROGRESS_STEP:
+                logged[0] = percent - percent % self.PROGRESS_STEP
+                LOG.info(_('Cloning volume %(id)s: %(percent)d%% copied'),
+                         {'id': volume['id'], 'percent': percent})
+
+        progress[volume['id']] = 0
+        try:
+            volutils.copy_volume(src_path, self.driver.local_path(volume),
+                                 size_in_g * 1024,
+                                 execute=self.driver._execute,
+                                 progress=report)
+        finally:
+            progress.pop(volume['id'], None)
+
+    def clone_volume(self, volume, src_vref):
+        volume_name = CONF.volume_name_template % src_vref['id']
+        temp_snapshot = {'volume_name': volume_name,
+                         'size': src_vref['size'],
+                         'volume_size': src_vref['size'],
+                         'name': 'clone-snap-%s' % volume['id'],
+                         'id': 'tmp-snap-%s' % volume['id']}
+        self.driver.create_snapshot(temp_snapshot)
+        try:
+            self.driver.create_volume(volume)
+            self._copy(self.driver.local_path(temp_snapshot), volume,
+                       src_vref['size'])
+        finally:
+            self.driver.delete_snapshot(temp_snapshot)
+
+    def clone_snapshot(self, volume, snapshot):
+        self.driver.create_volume(volume)
+        self._copy(self.driver.local_path(snapshot), volume,
+                   snapshot['volume_size'])
+
+    def clone_lv(self, volume, lv_name, size_in_g):
+        """Clone a volume nothing writes to into the created volume."""
+        self._copy(self.driver.local_path({'name': lv_name}), volume,
+                   size_in_g)
+
+
+class SnapshotCloneStrategy(object):
+    """Clones a thin volume or snapshot by taking a thin snapshot of it.
+
+    Thin snapshots share the blocks of their source only until either of
+    them is written, and do not depend on it otherwise, so the clone is
+    an independent volume as soon as it is created.
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def _snapshot(self, volume, src_lv_name, src_size_in_g):
+        vg = self.driver.configuration.volume_group
+        self.driver._try_execute('lvcreate', '-s', '-n', volume['name'],
+                                 '%s/%s' % (vg, src_lv_name),
+                                 run_as_root=True)
+        if int(volume['size']) > int(src_size_in_g):
+            self.driver._try_execute('lvextend', '-L',
+                                     self.driver._sizestr(volume['size']),
+                                     '%s/%s' % (vg, volume['name']),
+                                     run_as_root=True)
+
+    def clone_volume(self, volume, src_vref):
+        self._snapshot(volume, CONF.volume_name_template % src_vref['id'],
+                       src_vref['size'])
+
+    def clone_snapshot(self, volume, snapshot):
+        self._snapshot(volume,
+                       self.driver._escape_snapshot(snapshot['name']),
+                       snapshot['volume_size'])
+
+    def clone_lv(self, volume, lv_name, size_in_g):
+        """Replace the created, still empty, volume with a snapshot."""
+        self.driver._try_execute('lvremove', '-f', '%s/%s' %
+                                 (self.driver.configuration.volume_group,
+                                  volume['name']),
+                                 run_as_root=True)
+        self._snapshot(volume, lv_name, size_in_g)
+
+
+CLONE_STRATEGIES = {
+    'copy': CopyCloneStrategy,
+    'snapshot': SnapshotCloneStrategy,
+}
+
+
 class LVMVolumeDriver(driver.VolumeDriver):
     """Executes commands relating to Volumes."""
 
     VERSION = '1.0'
 
+    # deleted volumes waiting to be wiped are renamed with this prefix
+    WIPE_PREFIX = 'cinder-wipe-'
+    # golden volumes of images are named with this prefix
+    GOLDEN_PREFIX = 'cinder-image-'
+    # commands that change the LVs of the VG, dropping its cached metadata
+    LV_CHANGE_COMMANDS = ('lvcreate', 'lvextend', 'lvremove', 'lvrename')
+    # the volume_clear_ionice values the rootwrap filters accept
+    IONICE_PATTERN = re.compile(r'^-c\s*([0-3])(?:\s+-n\s*([0-7]))?$')
+
     def __init__(self, *args, **kwargs):
         super(LVMVolumeDriver, self).__init__(*args, **kwargs)
         self.configuration.append_config_values(volume_opts)
+        # brick LVM object of the VG, created on first use
+        self.vg = None
+        self._wipes = collections.deque()
+        self._wipe_pool = None
+        # paces all the background wipes together to volume_clear_rate
+        self._wipe_limiter = None
+        # percentage copied of the clones in progress, by volume id
+        self.clone_progress = {}
+        # size in GiB of the golden volumes, least recently used first
+        self._golden_volumes = collections.OrderedDict()
+        # clones being made from each golden volume; busy golden volumes
+        # are not evicted
+        self._golden_users = collections.defaultdict(int)
+
+    def do_setup(self, context):
+        """Queue the wipes left unfinished by the last run.
+
+        The golden volumes left by the last run are picked up as well.
+        """
+        try:
+            out, err = self._execute('lvs', '--noheadings', '--units', 'm',
+                                     '--nosuffix', '-o', 'lv_name,lv_size',
+                                     self.configuration.volume_group,
+                                     run_as_root=True)
+        except exception.ProcessExecutionError:
+            # check_for_setup_error reports what is wrong with the VG
+            LOG.warning(_('Could not list the volumes of volume group %s'),
+                        self.configuration.volume_group)
+            return
+        for line in (out or '').splitlines():
+            fields = line.split()
+            if len(fields) != 2:
+                continue
+            if fields[0].startswith(self.WIPE_PREFIX):
+                LOG.info(_('Resuming wipe of deleted volume %s'), fields[0])
+                self._queue_wipe(fields[0], int(float(fields[1])))
+            elif fields[0].startswith(self.GOLDEN_PREFIX):
+                self._golden_volumes[fields[0]] = (int(float(fields[1])) //
+                                                   1024)
 
     def check_for_setup_error(self):
         """Returns an error if prerequisites aren't met"""
@@ -80,6 +278,54 @@ class LVMVolumeDriver(driver.VolumeDriver):
             exception_message = (_("volume group %s doesn't exist")
                                  % self.configuration.volume_group)
             raise exception.VolumeBackendAPIException(data=exception_message)
+        self._ionice_args()
+
+    def _ionice_args(self):
+        """Return the ionice command prefix of the background wipes.
+
+        "-c 3" is accepted as well and passed on as "-c3", the form the
+        rootwrap filters expect.
+        """
+        ionice = self.configuration.volume_clear_ionice
+        if not ionice:
+            return []
+        match = self.IONICE_PATTERN.match(ionice.strip())
+        if match is None:
+            exception_message = (_('volume_clear_ionice %s is not of the '
+                                   'form "-c<class>" or "-c<class> '
+                                   '-n<priority>"') % ionice)
+            raise exception.VolumeBackendAPIException(data=exception_message)
+        args = ['ionice', '-c%s' % match.group(1)]
+        if match.group(2) is not None:
+            args.append('-n%s' % match.group(2))
+        return args
+
+    def _execute_brick(self, *cmd, **kwargs):
+        # brick runs its commands with sudo as the root helper; use the
+        # one of our executor instead
+        kwargs.pop('root_helper', None)
+        return self._execute(*cmd, **kwargs)
+
+    def _get_vg(self):
+        """Return the brick LVM object of the VG.
+
+        Lookups of LVs go through it, so that they are served from the
+        metadata it caches rather than running lvs or lvdisplay each time.
+        """
+        if self.vg is None:
+            self.vg = brick_lvm.LVM(
+                self.configuration.volume_group,
+                executor=self._execute_brick,
+                cache_ttl=self.configuration.lvm_metadata_cache_ttl)
+        return self.vg
+
+    def _try_execute(self, *command, **kwargs):
+        try:
+            return super(LVMVolumeDriver, self)._try_execute(*command,
+                                                             **kwargs)
+        finally:
+            if self.vg is not None and command[0] in self.LV_CHANGE_COMMANDS:
+                self.vg.invalidate_cache()
 
     def _create_volume(self, volume_name, sizestr):
 
@@ -99,14 +345,16 @@ class LVMVolumeDriver(driver.VolumeDriver):
 
         self._try_execute(*cmd, run_as_root=True, no_retry_list=no_retry_list)
 
-    def _volume_not_present(self, volume_name):
-        path_name = '%s/%s' % (self.configuration.volume_group, volume_name)
-        try:
-            self._try_execute('lvdisplay', path_name, run_as_root=True)
-        except Exception as e:
-            # If the volume isn't present
-            return True
-        return False
+    def _volume_not_present(self, volume_name, fresh=False):
+        """Check for the LV in the cached metadata of the VG.
+
+        With fresh, the cache is dropped first, so that LVs changed
+        outside of this driver since it was read are seen as they are.
+        """
+        vg = self._get_vg()
+        if fresh:
+            vg.invalidate_cache()
+        return vg.get_volume(volume_name) is None
 
     def _delete_volume(self, volume):
         """Deletes a logical volume."""
@@ -141,32 +389,105 @@ class LVMVolumeDriver(driver.VolumeDriver):
 
     def create_volume_from_snapshot(self, volume, snapshot):
         """Creates a volume from a snapshot."""
-        self._create_volume(volume['name'], self._sizestr(volume['size']))
-        volutils.copy_volume(self.local_path(snapshot),
-                             self.local_path(volume),
-                             snapshot['volume_size'] * 1024,
-                             execute=self._execute)
+        strategy = self._clone_strategy(
+            self._escape_snapshot(snapshot['name']))
+        strategy.clone_snapshot(volume, snapshot)
+
+    def _is_thin(self, lv_name):
+        lv = self._get_vg().get_volume(lv_name)
+        # thin volumes, thin snapshots included, have the 'V' type
+        return bool(lv) and lv['attr'].startswith('V')
+
+    def _clone_strategy(self, src_lv_name):
+        """Return the strategy lvm_clone_strategy picks for the source."""
+        name = self.configuration.lvm_clone_strategy
+        if name == 'auto':
+            name = 'snapshot' if self._is_thin(src_lv_name) else 'copy'
+        if name not in CLONE_STRATEGIES:
+            raise exception.VolumeBackendAPIException(
+                data=_('Unknown lvm_clone_strategy %s') % name)
+        return CLONE_STRATEGIES[name](self)
 
     def delete_volume(self, volume):
         """Deletes a logical volume."""
-        if self._volume_not_present(volume['name']):
+        if self._volume_not_present(volume['name'], fresh=True):
             # If the volume isn't present, then don't attempt to delete
             return True
 
         # TODO(yamahata): lvm can't delete origin volume only without
         # deleting derived snapshots. Can we do something fancy?
-        out, err = self._execute('lvdisplay', '--noheading',
-                                 '-C', '-o', 'Attr',
-                                 '%s/%s' % (self.configuration.volume_group,
-                                            volume['name']),
-                                 run_as_root=True)
-        # fake_execute returns None resulting unit test error
-        if out:
-            out = out.strip()
-            if (out[0] == 'o') or (out[0] == 'O'):
-                raise exception.VolumeIsBusy(volume_name=volume['name'])
+        if self._get_vg().lv_has_snapshot(volume['name']):
+            raise exception.VolumeIsBusy(volume_name=volume['name'])
+
+        if (self.configuration.volume_clear_defer and
+                self.configuration.volume_clear != 'none' and
+                os.path.exists(self.local_path(volume))):
+            self._defer_delete(volume)
+        else:
+            self._delete_volume(volume)
+
+    def _defer_delete(self, volume):
+        """Rename the volume out of the way and wipe it in the background.
+
+        The renamed volume is only removed once it has been wiped; if the
+        service stops first, do_setup starts the wipe over.
+        """
+        wipe_name = self.WIPE_PREFIX + volume['name']
+        self._try_execute('lvrename', self.configuration.volume_group,
+                          volume['name'], wipe_name, run_as_root=True)
+        self._queue_wipe(wipe_name, int(volume['size']) * 1024 or 100)
+
+    def _queue_wipe(self, lv_name, size_in_m):
+        self._wipes.append((lv_name, size_in_m))
+        if self._wipe_pool is None:
+            self._wipe_pool = greenpool.GreenPool(
+                self.configuration.volume_clear_workers)
+        if self._wipe_pool.free():
+            self._wipe_pool.spawn_n(self._run_wipes)
+
+    def _run_wipes(self):
+        while self._wipes:
+            lv_name, size_in_m = self._wipes.popleft()
+            try:
+                self._wipe_volume(lv_name, size_in_m)
+                self._try_execute('lvremove', '-f', '%s/%s' %
+                                  (self.configuration.volume_group, lv_name),
+                                  run_as_root=True)
+            except Exception:
+                LOG.exception(_('Failed to wipe deleted volume %s, it will '
+                                'be retried when the service restarts'),
+                              lv_name)
+
+    def _wipe_volume(self, lv_name, size_in_m):
+        """Wipe a renamed volume within the background wipe budget."""
+        vol_path = self.local_path({'name': lv_name})
+        clear_size = self.configuration.volume_clear_size
+        if clear_size:
+            size_in_m = min(size_in_m, clear_size)
+        ionice = self._ionice_args()
+
+        LOG.info(_("Performing secure delete on volume: %s") % lv_name)
+
+        if self.configuration.volume_clear == 'none':
+            return
+        elif self.configuration.volume_clear == 'shred':
+            clear_cmd = ionice + ['shred', '-n3']
+            if clear_size:
+                clear_cmd.append('-s%dMiB' % size_in_m)
+            clear_cmd.append(vol_path)
+            self._execute(*clear_cmd, run_as_root=True)
+            return
+        elif self.configuration.volume_clear != 'zero':
+            LOG.error(_("Error unrecognized volume_clear option: %s"),
+                      self.configuration.volume_clear)
+            return
 
-        self._delete_volume(volume)
+        if self._wipe_limiter is None:
+            self._wipe_limiter = utils.RateLimiter(
+                self.configuration.volume_clear_rate * units.MiB)
+        volutils.copy_volume('/dev/zero', vol_path, size_in_m, sync=True,
+                             execute=self._execute,
+                             limiter=self._wipe_limiter)
 
     def clear_volume(self, volume):
         """unprovision old volumes to prevent data leaking between users."""
@@ -215,7 +536,8 @@ class LVMVolumeDriver(driver.VolumeDriver):
 
     def delete_snapshot(self, snapshot):
         """Deletes a snapshot."""
-        if self._volume_not_present(self._escape_snapshot(snapshot['name'])):
+        if self._volume_not_present(self._escape_snapshot(snapshot['name']),
+                                    fresh=True):
             # If the snapshot isn't present, then don't attempt to delete
             LOG.warning(_("snapshot: %s not found, "
                           "skipping delete operations") % snapshot['name'])
@@ -232,12 +554,104 @@ class LVMVolumeDriver(driver.VolumeDriver):
         return "/dev/mapper/%s-%s" % (escaped_group, escaped_name)
 
     def copy_image_to_volume(self, context, volume, image_service, image_id):
-        """Fetch the image from image_service and write it to the volume."""
+        """Fetch the image from image_service and write it to the volume.
+
+        With image_golden_volumes set, the volume is cloned from a golden
+        volume of the image instead, unless it is smaller than that.
+        """
+        if self.configuration.image_golden_volumes:
+            image_meta = image_service.show(context, image_id)
+            key = image_cache.cache_key(image_id, image_meta)
+            if key is not None:
+                with self._golden_volume(context, image_service, image_id,
+                                         key, volume['size']) as golden:
+                    lv_name, size_in_g = golden
+                    if int(size_in_g) <= int(volume['size']):
+                        LOG.debug(_('Cloning volume %(id)s from golden '
+                                    'volume %(lv_name)s'),
+                                  {'id': volume['id'], 'lv_name': lv_name})
+                        strategy = self._clone_strategy(lv_name)
+                        strategy.clone_lv(volume, lv_name, size_in_g)
+                        return
         image_utils.fetch_to_raw(context,
                                  image_service,
                                  image_id,
                                  self.local_path(volume))
 
+    @contextlib.contextmanager
+    def _golden_volume(self, context, image_service, image_id, key,
+                       size_in_g):
+        """Yield (name, size) of the golden volume of an image.
+
+        The golden volume is created with the given size if there is none
+        yet, and is not evicted until the block is left. The least recently
+        used golden volumes beyond image_golden_volumes that are not in use
+        are evicted.
+        """
+        lv_name = self.GOLDEN_PREFIX + key
+
+        @utils.synchronized(lv_name, external=True)
+        def _get():
+            if lv_name not in self._golden_volumes:
+                LOG.info(_('Creating golden volume %(lv_name)s of image '
+                           '%(image_id)s'),
+                         {'lv_name': lv_name, 'image_id': image_id})
+                golden = {'name': lv_name, 'id': lv_name, 'size': size_in_g}
+                self.create_volume(golden)
+                try:
+                    image_utils.fetch_to_raw(context, image_service,
+                                             image_id,
+                                             self.local_path(golden))
+                except Exception:
+                    with excutils.save_and_reraise_exception():
+                        self._remove_golden_volume(lv_name)
+                self._golden_volumes[lv_name] = size_in_g
+            self._golden_volumes[lv_name] = self._golden_volumes.pop(lv_name)
+            self._golden_users[lv_name] += 1
+            return self._golden_volumes[lv_name]
+
+        size = _get()
+        try:
+            self._evict_golden_volumes()
+            yield lv_name, size
+        finally:
+            self._golden_users[lv_name] -= 1
+            if not self._golden_users[lv_name]:
+                del self._golden_users[lv_name]
+
+    def _evict_golden_volumes(self):
+        """Delete the least recently used golden volumes not in use."""
+        for name in list(self._golden_volumes):
+            if (len(self._golden_volumes) <=
+                    self.configuration.image_golden_volumes):
+                break
+            if self._golden_users.get(name):
+                continue
+
+            @utils.synchronized(name, external=True)
+            def _evict():
+                # taken or evicted while we waited for the lock
+                if (self._golden_users.get(name) or
+                        name not in self._golden_volumes):
+                    return
+                del self._golden_volumes[name]
+                LOG.info(_('Evicting golden volume %s'), name)
+                self._remove_golden_volume(name)
+
+            _evict()
+
+    def _remove_golden_volume(self, lv_name):
+        """Remove a golden volume without clearing it.
+
+        Golden volumes only ever hold public image data, so they are not
+        wiped like the volumes of users.
+        """
+        if self._volume_not_present(lv_name, fresh=True):
+            return
+        self._try_execute('lvremove', '-f', '%s/%s' %
+                          (self.configuration.volume_group, lv_name),
+                          run_as_root=True)
+
     def copy_volume_to_image(self, context, volume, image_service, image_meta):
         """Copy the volume to the specified image."""
         image_utils.upload_volume(context,
@@ -248,22 +662,9 @@ class LVMVolumeDriver(driver.VolumeDriver):
     def create_cloned_volume(self, volume, src_vref):
         """Creates a clone of the specified volume."""
         LOG.info(_('Creating clone of volume: %s') % src_vref['id'])
-        volume_name = CONF.volume_name_template % src_vref['id']
-        temp_id = 'tmp-snap-%s' % volume['id']
-        temp_snapshot = {'volume_name': volume_name,
-                         'size': src_vref['size'],
-                         'volume_size': src_vref['size'],
-                         'name': 'clone-snap-%s' % volume['id'],
-                         'id': temp_id}
-        self.create_snapshot(temp_snapshot)
-        self._create_volume(volume['name'], self._sizestr(volume['size']))
-        try:
-            volutils.copy_volume(self.local_path(temp_snapshot),
-                                 self.local_path(volume),
-                                 src_vref['size'] * 1024,
-                                 execute=self._execute)
-        finally:
-            self.delete_snapshot(temp_snapshot)
+        strategy = self._clone_strategy(
+            CONF.volume_name_template % src_vref['id'])
+        strategy.clone_volume(volume, src_vref)
 
     def clone_image(self, volume, image_location):
         return None, False
@@ -379,6 +780,42 @@ class LVMISCSIDriver(LVMVolumeDriver, driver.ISCSIDriver):
                                         check_exit_code=False,
                                         old_name=old_name)
 
+    def ensure_exports(self, context, volumes):
+        """Recreates the exports tgtd does not have, several at a time.
+
+        tgtd keeps its targets across restarts of the volume service, so
+        usually most of them are still there.
+        """
+        if not isinstance(self.tgtadm, iscsi.TgtAdm):
+            return super(LVMISCSIDriver, self).ensure_exports(context,
+                                                              volumes)
+
+        targets = self.tgtadm.get_targets()
+        missing = [volume for volume in volumes
+                   if not self._export_exists(volume, targets)]
+        LOG.debug(_("Recreating %(missing)d of %(total)d exports"),
+                  {'missing': len(missing), 'total': len(volumes)})
+
+        def ensure_export(volume):
+            self.ensure_export(context, volume)
+
+        # NOTE: iterating over imap re-raises the first failure, as the
+        # serial loop did
+        pool = greenpool.GreenPool(self.configuration.iscsi_export_workers)
+        for _result in pool.imap(ensure_export, missing):
+            pass
+
+    def _export_exists(self, volume, targets):
+        if (volume['provider_location'] is not None and
+                volume['name'] not in volume['provider_location']):
+            # ensure_export has to fix up the name, see _fix_id_migration
+            return False
+        iscsi_name = "%s%s" % (self.configuration.iscsi_target_prefix,
+                               volume['name'])
+        return (iscsi_name in targets and
+                os.path.exists(os.path.join(CONF.volumes_dir,
+                                            volume['name'])))
+
     def _fix_id_migration(self, context, volume):
         """Fix provider_location and dev files to address bug 1065702.
 
@@ -559,23 +996,29 @@ class LVMISCSIDriver(LVMVolumeDriver, driver.ISCSIDriver):
         data['free_capacity_gb'] = 0
         data['reserved_percentage'] = self.configuration.reserved_percentage
         data['QoS_support'] = False
+        data['clone_progress'] = dict(self.clone_progress)
 
+        # served from the metadata cached by the brick LVM object
         try:
-            out, err = self._execute('vgs', '--noheadings', '--nosuffix',
-                                     '--unit=G', '-o', 'name,size,free',
-                                     self.configuration.volume_group,
-                                     run_as_root=True)
+            vg_info = self._get_vg().update_volume_group_info()
         except exception.ProcessExecutionError as exc:
             LOG.error(_("Error retrieving volume status: %s"), exc.stderr)
-            out = False
+            vg_info = None
+        except brick_lvm.VolumeGroupNotFound as exc:
+            LOG.error(_("Error retrieving volume status: %s"), exc)
+            vg_info = None
 
-        if out:
-            volume = out.split()
-            data['total_capacity_gb'] = float(volume[1].replace(',', '.'))
-            data['free_capacity_gb'] = float(volume[2].replace(',', '.'))
+        if vg_info:
+            data['total_capacity_gb'] = self._gigabytes(vg_info['size'])
+            data['free_capacity_gb'] = self._gigabytes(vg_info['available'])
 
         self._stats = data
 
+    @staticmethod
+    def _gigabytes(size):
+        """Return a size vgs printed with --unit=g as a float."""
+        return float(size.rstrip('gG').replace(',', '.'))
+
     def _iscsi_location(self, ip, target, iqn, lun=None):
         return "%s:%s,%s %s %s" % (ip, self.configuration.iscsi_port,
                                    target, iqn, lun)
@@ -616,6 +1059,10 @@ class ThinLVMVolumeDriver(LVMISCSIDriver):
             out, err = self._execute('lvcreate', '-T', '-L', size,
                                      pool_path, run_as_root=True)
 
+    def _is_thin(self, lv_name):
+        """All our volumes live in the thin pool."""
+        return True
+
     def _do_lvm_snapshot(self, src_lvm_name, dest_vref, is_cinder_snap=True):
             if is_cinder_snap:
                 new_name = self._escape_snapshot(dest_vref['name'])
@@ -638,20 +1085,13 @@ class ThinLVMVolumeDriver(LVMISCSIDriver):
 
     def delete_volume(self, volume):
         """Deletes a logical volume."""
-        if self._volume_not_present(volume['name']):
+        if self._volume_not_present(volume['name'], fresh=True):
             return True
         self._try_execute('lvremove', '-f', "%s/%s" %
                           (self.configuration.volume_group,
                            self._escape_snapshot(volume['name'])),
                           run_as_root=True)
 
-    def create_cloned_volume(self, volume, src_vref):
-        """Creates a clone of the specified volume."""
-        LOG.info(_('Creating clone of volume: %s') % src_vref['id'])
-        orig_lv_name = "%s/%s" % (self.configuration.volume_group,
-                                  src_vref['name'])
-        self._do_lvm_snapshot(orig_lv_name, volume, False)
-
     def create_snapshot(self, snapshot):
         """Creates a snapshot of a volume."""
         orig_lv_name = "%s/%s" % (self.configuration.volume_group,
@@ -682,4 +1122,5 @@ class ThinLVMVolumeDriver(LVMISCSIDriver):
         data['QoS_support'] = False
         data['total_capacity_gb'] = 'infinite'
         data['free_capacity_gb'] = 'infinite'
+        data['clone_progress'] = dict(self.clone_progress)
         self._stats = data
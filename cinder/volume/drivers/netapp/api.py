@@ -21,14 +21,96 @@ NetApp api for ONTAP and OnCommand DFM.
 Contains classes required to issue api calls to ONTAP and OnCommand DFM.
 """
 
+import base64
+import httplib
+import socket
+import time
+
+from eventlet import semaphore
 from lxml import etree
-import urllib2
 
 from cinder.openstack.common import log as logging
 
 LOG = logging.getLogger(__name__)
 
 
+class HTTPConnectionPool(object):
+    """Keep-alive HTTP or HTTPS connections to a server.
+
+    At most max_size requests are sent at once; the others wait for a
+    connection. Connections idle for longer than IDLE_TIMEOUT seconds are
+    closed rather than reused. A reused connection which turns out to have
+    been closed by the server is replaced, and the request sent again, only
+    when the server cannot have acted on it: the request could not be sent,
+    or the connection was closed without a byte of response.
+    """
+
+    IDLE_TIMEOUT = 30
+
+    def __init__(self, protocol, host, port, max_size, timeout=None):
+        self.protocol = protocol
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._semaphore = semaphore.Semaphore(max_size)
+        # (connection, time it was last used), most recently used last
+        self._idle = []
+
+    def _connect(self):
+        if self.protocol == NaServer.TRANSPORT_TYPE_HTTPS:
+            connection_class = httplib.HTTPSConnection
+        else:
+            connection_class = httplib.HTTPConnection
+        return connection_class('%s:%s' % (self.host, self.port),
+                                timeout=self.timeout)
+
+    def _get(self):
+        """Return (connection, whether it was used before)."""
+        while self._idle:
+            connection, used_at = self._idle.pop()
+            if time.time() - used_at < self.IDLE_TIMEOUT:
+                return connection, True
+            connection.close()
+        return self._connect(), False
+
+    @staticmethod
+    def _no_response(error):
+        """Whether error is the server closing without responding."""
+        if not isinstance(error, httplib.BadStatusLine):
+            return False
+        # older versions of httplib raise it with the empty line read
+        return (error.line in ('', "''") or
+                error.line.startswith('No status line received'))
+
+    def post(self, path, body, headers):
+        """POST body to path; returns (status, reason, response body)."""
+        with self._semaphore:
+            while True:
+                connection, reused = self._get()
+                sent = False
+                try:
+                    connection.request('POST', path, body, headers)
+                    sent = True
+                    response = connection.getresponse()
+                    data = response.read()
+                except (httplib.HTTPException, socket.error) as e:
+                    connection.close()
+                    # a timed out request may still be acted on
+                    if (reused and not isinstance(e, socket.timeout) and
+                            (not sent or self._no_response(e))):
+                        continue
+                    raise
+                if response.will_close:
+                    connection.close()
+                else:
+                    self._idle.append((connection, time.time()))
+                return response.status, response.reason, data
+
+    def close(self):
+        while self._idle:
+            self._idle.pop()[0].close()
+
+
 class NaServer(object):
     """Encapsulates server connection logic."""
 
@@ -41,12 +123,17 @@ class NaServer(object):
     NETAPP_NS = 'http://www.netapp.com/filer/admin'
     STYLE_LOGIN_PASSWORD = 'basic_auth'
     STYLE_CERTIFICATE = 'certificate_auth'
+    DEFAULT_MAX_CONNECTIONS = 4
 
     def __init__(self, host, server_type=SERVER_TYPE_FILER,
                  transport_type=TRANSPORT_TYPE_HTTP,
                  style=STYLE_LOGIN_PASSWORD, username=None,
-                 password=None):
+                 password=None, max_connections=DEFAULT_MAX_CONNECTIONS):
         self._host = host
+        self._pool = None
+        self._max_connections = max_connections
+        # api name : [calls, failed calls, total seconds, slowest seconds]
+        self._api_stats = {}
         self.set_server_type(server_type)
         self.set_transport_type(transport_type)
         self.set_style(style)
@@ -149,6 +236,7 @@ class NaServer(object):
             self._timeout = int(seconds)
         except ValueError:
             raise ValueError('timeout in seconds must be integer')
+        self._refresh_conn = True
 
     def get_timeout(self):
         """Gets the timeout in seconds if set."""
@@ -182,24 +270,47 @@ class NaServer(object):
         self._password = password
         self._refresh_conn = True
 
+    def get_api_stats(self):
+        """Returns the calls, failures and latency of each api invoked.
+
+        The result maps api names to dicts with the number of 'calls' and
+        'failures', and the 'total_time' and 'max_time' in seconds.
+        """
+        return dict((api, {'calls': stats[0], 'failures': stats[1],
+                           'total_time': stats[2], 'max_time': stats[3]})
+                    for api, stats in self._api_stats.items())
+
+    def _record_call(self, api, elapsed, failed):
+        stats = self._api_stats.setdefault(api, [0, 0, 0.0, 0.0])
+        stats[0] += 1
+        if failed:
+            stats[1] += 1
+        stats[2] += elapsed
+        stats[3] = max(stats[3], elapsed)
+        LOG.debug(_('ONTAPI %(api)s on %(host)s took %(elapsed).3fs'),
+                  {'api': api, 'host': self._host, 'elapsed': elapsed})
+
     def invoke_elem(self, na_element, enable_tunneling=False):
         """Invoke the api on the server."""
         if na_element and not isinstance(na_element, NaElement):
             ValueError('NaElement must be supplied to invoke api')
         request = self._create_request(na_element, enable_tunneling)
-        if not hasattr(self, '_opener') or not self._opener \
-                or self._refresh_conn:
-            self._build_opener()
+        if self._pool is None or self._refresh_conn:
+            self._build_pool()
+        headers = {'Content-Type': 'text/xml', 'charset': 'utf-8',
+                   'Content-Length': str(len(request)),
+                   'Authorization': self._auth_header}
+        api = na_element.get_name()
+        start = time.time()
         try:
-            if hasattr(self, '_timeout'):
-                response = self._opener.open(request, timeout=self._timeout)
-            else:
-                response = self._opener.open(request)
-        except urllib2.HTTPError as e:
-            raise NaApiError(e.code, e.msg)
+            status, reason, xml = self._pool.post('/' + self._url, request,
+                                                  headers)
         except Exception as e:
+            self._record_call(api, time.time() - start, True)
             raise NaApiError('Unexpected error', e)
-        xml = response.read()
+        self._record_call(api, time.time() - start, not 200 <= status < 300)
+        if not 200 <= status < 300:
+            raise NaApiError(status, reason)
         return self._get_result(xml)
 
     def invoke_successfully(self, na_element, enable_tunneling=False):
@@ -230,11 +341,7 @@ class NaServer(object):
         if enable_tunneling:
             self._enable_tunnel_request(netapp_elem)
         netapp_elem.add_child_elem(na_element)
-        request_d = netapp_elem.to_string()
-        request = urllib2.Request(
-            self._get_url(), data=request_d,
-            headers={'Content-Type': 'text/xml', 'charset': 'utf-8'})
-        return request
+        return netapp_elem.to_string()
 
     def _enable_tunnel_request(self, netapp_elem):
         """Enables vserver or vfiler tunneling."""
@@ -269,26 +376,26 @@ class NaServer(object):
         processed_response = self._parse_response(response)
         return processed_response.get_child_by_name('results')
 
-    def _get_url(self):
-        return '%s://%s:%s/%s' % (self._protocol, self._host, self._port,
-                                  self._url)
-
-    def _build_opener(self):
+    def _build_pool(self):
+        """Connects anew, to pick up changed connection settings."""
         if self._auth_style == NaServer.STYLE_LOGIN_PASSWORD:
-            auth_handler = self._create_basic_auth_handler()
+            self._auth_header = self._create_basic_auth_header()
         else:
-            auth_handler = self._create_certificate_auth_handler()
-        opener = urllib2.build_opener(auth_handler)
-        self._opener = opener
-
-    def _create_basic_auth_handler(self):
-        password_man = urllib2.HTTPPasswordMgrWithDefaultRealm()
-        password_man.add_password(None, self._get_url(), self._username,
-                                  self._password)
-        auth_handler = urllib2.HTTPBasicAuthHandler(password_man)
-        return auth_handler
-
-    def _create_certificate_auth_handler(self):
+            self._auth_header = self._create_certificate_auth_header()
+        if self._pool is not None:
+            self._pool.close()
+        self._pool = HTTPConnectionPool(self._protocol, self._host,
+                                        self._port, self._max_connections,
+                                        timeout=self.get_timeout())
+        self._refresh_conn = False
+
+    def _create_basic_auth_header(self):
+        # sent with every request rather than after a 401 challenge, which
+        # would double the round trips
+        credentials = '%s:%s' % (self._username, self._password)
+        return 'Basic %s' % base64.b64encode(credentials)
+
+    def _create_certificate_auth_header(self):
         raise NotImplementedError()
 
 
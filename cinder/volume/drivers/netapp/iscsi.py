@@ -28,12 +28,14 @@ import uuid
 
 from cinder import exception
 from cinder.openstack.common import log as logging
+from cinder.openstack.common import timeutils
 from cinder.volume import driver
 from cinder.volume.drivers.netapp.api import NaApiError
 from cinder.volume.drivers.netapp.api import NaElement
 from cinder.volume.drivers.netapp.api import NaServer
 from cinder.volume.drivers.netapp.options import netapp_7mode_opts
 from cinder.volume.drivers.netapp.options import netapp_basicauth_opts
+from cinder.volume.drivers.netapp.options import netapp_cache_opts
 from cinder.volume.drivers.netapp.options import netapp_cluster_opts
 from cinder.volume.drivers.netapp.options import netapp_connection_opts
 from cinder.volume.drivers.netapp.options import netapp_provisioning_opts
@@ -54,6 +56,7 @@ CONF.register_opts(netapp_basicauth_opts)
 CONF.register_opts(netapp_cluster_opts)
 CONF.register_opts(netapp_7mode_opts)
 CONF.register_opts(netapp_provisioning_opts)
+CONF.register_opts(netapp_cache_opts)
 
 
 class NetAppLun(object):
@@ -95,7 +98,15 @@ class NetAppDirectISCSIDriver(driver.ISCSIDriver):
         self.configuration.append_config_values(netapp_basicauth_opts)
         self.configuration.append_config_values(netapp_transport_opts)
         self.configuration.append_config_values(netapp_provisioning_opts)
+        self.configuration.append_config_values(netapp_cache_opts)
         self.lun_table = {}
+        # names of the LUNs listed while the LUN table is refreshed
+        self._listed_luns = None
+        # initiator : igroups it is in, see _get_igroup_by_initiator
+        self._igroup_cache = {}
+        # (LUN path, initiator) : (igroup name, LUN id) it is mapped with
+        self._lun_map_cache = {}
+        self._cache_reconciled_at = None
 
     def _create_client(self, **kwargs):
         """Instantiate a client for NetApp server.
@@ -109,7 +120,8 @@ class NetAppDirectISCSIDriver(driver.ISCSIDriver):
                                transport_type=kwargs['transport_type'],
                                style=NaServer.STYLE_LOGIN_PASSWORD,
                                username=kwargs['login'],
-                               password=kwargs['password'])
+                               password=kwargs['password'],
+                               max_connections=kwargs['max_connections'])
 
     def _do_custom_setup(self):
         """Does custom setup depending on the type of filer."""
@@ -136,7 +148,8 @@ class NetAppDirectISCSIDriver(driver.ISCSIDriver):
             login=self.configuration.netapp_login,
             password=self.configuration.netapp_password,
             hostname=self.configuration.netapp_server_hostname,
-            port=self.configuration.netapp_server_port)
+            port=self.configuration.netapp_server_port,
+            max_connections=self.configuration.netapp_max_connections)
         self._do_custom_setup()
 
     def check_for_setup_error(self):
@@ -146,6 +159,7 @@ class NetAppDirectISCSIDriver(driver.ISCSIDriver):
         """
         self.lun_table = {}
         self._get_lun_list()
+        self._cache_reconciled_at = timeutils.utcnow()
         LOG.debug(_("Success getting LUN list from server"))
 
     def create_volume(self, volume):
@@ -181,6 +195,9 @@ class NetAppDirectISCSIDriver(driver.ISCSIDriver):
         self.client.invoke_successfully(lun_destroy, True)
         LOG.debug(_("Destroyed LUN %s") % name)
         self.lun_table.pop(name)
+        for key in self._lun_map_cache.keys():
+            if key[0] == metadata['Path']:
+                del self._lun_map_cache[key]
 
     def ensure_export(self, context, volume):
         """Driver entry point to get the export info for an existing volume."""
@@ -397,7 +414,9 @@ class NetAppDirectISCSIDriver(driver.ISCSIDriver):
             lun_map.add_new_child('lun-id', lun_id)
         try:
             result = self.client.invoke_successfully(lun_map, True)
-            return result.get_child_content('lun-id-assigned')
+            lun_id = result.get_child_content('lun-id-assigned')
+            self._lun_map_cache[(path, initiator)] = (igroup_name, lun_id)
+            return lun_id
         except NaApiError as e:
             code = e.code
             message = e.message
@@ -405,15 +424,21 @@ class NetAppDirectISCSIDriver(driver.ISCSIDriver):
             msg_fmt = {'code': code, 'message': message}
             exc_info = sys.exc_info()
             LOG.warn(msg % msg_fmt)
+            # the cached igroups of the initiator may be out of date
+            self._igroup_cache.pop(initiator, None)
             (igroup, lun_id) = self._find_mapped_lun_igroup(path, initiator)
             if lun_id is not None:
+                self._lun_map_cache[(path, initiator)] = (igroup, lun_id)
                 return lun_id
             else:
                 raise exc_info[0], exc_info[1], exc_info[2]
 
     def _unmap_lun(self, path, initiator):
         """Unmaps a lun from given initiator."""
-        (igroup_name, lun_id) = self._find_mapped_lun_igroup(path, initiator)
+        mapping = self._lun_map_cache.pop((path, initiator), None)
+        if mapping is None:
+            mapping = self._find_mapped_lun_igroup(path, initiator)
+        (igroup_name, lun_id) = mapping
         lun_unmap = NaElement.create_node_with_children(
             'lun-unmap',
             **{'path': path,
@@ -442,7 +467,7 @@ class NetAppDirectISCSIDriver(driver.ISCSIDriver):
 
         Creates igroup if not found.
         """
-        igroups = self._get_igroup_by_initiator(initiator=initiator)
+        igroups = self._get_igroups(initiator)
         igroup_name = None
         for igroup in igroups:
             if igroup['initiator-group-os-type'] == os:
@@ -456,8 +481,18 @@ class NetAppDirectISCSIDriver(driver.ISCSIDriver):
             igroup_name = self.IGROUP_PREFIX + str(uuid.uuid4())
             self._create_igroup(igroup_name, initiator_type, os)
             self._add_igroup_initiator(igroup_name, initiator)
+            igroups.append({'initiator-group-os-type': os,
+                            'initiator-group-type': initiator_type,
+                            'initiator-group-name': igroup_name})
         return igroup_name
 
+    def _get_igroups(self, initiator):
+        """Get igroups by initiator, from the cache if they are in it."""
+        if initiator not in self._igroup_cache:
+            self._igroup_cache[initiator] = self._get_igroup_by_initiator(
+                initiator=initiator)
+        return self._igroup_cache[initiator]
+
     def _get_igroup_by_initiator(self, initiator):
         """Get igroups by initiator."""
         raise NotImplementedError()
@@ -503,6 +538,41 @@ class NetAppDirectISCSIDriver(driver.ISCSIDriver):
             msg = _("Object is not a NetApp LUN.")
             raise exception.VolumeBackendAPIException(data=msg)
         self.lun_table[lun.name] = lun
+        if self._listed_luns is not None:
+            self._listed_luns.add(lun.name)
+
+    def _refresh_lun_table(self):
+        """Lists the LUNs on the filer into the LUN table.
+
+        LUNs which are not listed any more are dropped from the table. The
+        table stays in use while it is refreshed.
+        """
+        known = set(self.lun_table)
+        self._listed_luns = set()
+        try:
+            self._get_lun_list()
+            gone = known - self._listed_luns
+        finally:
+            self._listed_luns = None
+        for name in gone:
+            LOG.info(_("LUN %s is gone from the filer") % name)
+            self.lun_table.pop(name, None)
+
+    def _reconcile_caches(self):
+        """Reconciles the cached LUNs, igroups and LUN maps with the filer.
+
+        Done at most once every netapp_cache_reconcile_interval seconds.
+        """
+        interval = self.configuration.netapp_cache_reconcile_interval
+        if (self._cache_reconciled_at is not None and interval > 0 and
+                not timeutils.is_older_than(self._cache_reconciled_at,
+                                            interval)):
+            return
+        LOG.debug(_("Reconciling the LUN table with the filer"))
+        self._refresh_lun_table()
+        self._igroup_cache = {}
+        self._lun_map_cache = {}
+        self._cache_reconciled_at = timeutils.utcnow()
 
     def _clone_lun(self, name, new_name, space_reserved):
         """Clone LUN with the given name to the new name."""
@@ -542,6 +612,7 @@ class NetAppDirectISCSIDriver(driver.ISCSIDriver):
         If 'refresh' is True, run update the stats first.
         """
         if refresh:
+            self._reconcile_caches()
             self._update_volume_status()
 
         return self._stats
@@ -595,7 +666,8 @@ class NetAppDirectCmodeISCSIDriver(NetAppDirectISCSIDriver):
 
     def _create_avl_vol_request(self, vserver, tag=None):
         vol_get_iter = NaElement('volume-get-iter')
-        vol_get_iter.add_new_child('max-records', '100')
+        vol_get_iter.add_new_child(
+            'max-records', str(self.configuration.netapp_max_records))
         if tag:
             vol_get_iter.add_new_child('tag', tag, True)
         query = NaElement('query')
@@ -668,7 +740,8 @@ class NetAppDirectCmodeISCSIDriver(NetAppDirectISCSIDriver):
         tag = None
         while True:
             api = NaElement('lun-get-iter')
-            api.add_new_child('max-records', '100')
+            api.add_new_child(
+                'max-records', str(self.configuration.netapp_max_records))
             if tag:
                 api.add_new_child('tag', tag, True)
             lun_info = NaElement('lun-info')
@@ -676,6 +749,14 @@ class NetAppDirectCmodeISCSIDriver(NetAppDirectISCSIDriver):
             query = NaElement('query')
             query.add_child_elem(lun_info)
             api.add_child_elem(query)
+            # only what _create_lun_meta needs
+            des_attrs = NaElement('desired-attributes')
+            des_attrs.add_node_with_children(
+                'lun-info',
+                **{'vserver': None, 'volume': None, 'qtree': None,
+                   'path': None, 'size': None, 'multiprotocol-type': None,
+                   'is-space-reservation-enabled': None})
+            api.add_child_elem(des_attrs)
             result = self.client.invoke_successfully(api)
             if result.get_child_by_name('num-records') and\
                     int(result.get_child_content('num-records')) >= 1:
@@ -687,7 +768,7 @@ class NetAppDirectCmodeISCSIDriver(NetAppDirectISCSIDriver):
 
     def _find_mapped_lun_igroup(self, path, initiator, os=None):
         """Find the igroup for mapped lun with initiator."""
-        initiator_igroups = self._get_igroup_by_initiator(initiator=initiator)
+        initiator_igroups = self._get_igroups(initiator)
         lun_maps = self._get_lun_map(path)
         if initiator_igroups and lun_maps:
             for igroup in initiator_igroups:
@@ -704,12 +785,18 @@ class NetAppDirectCmodeISCSIDriver(NetAppDirectISCSIDriver):
         map_list = []
         while True:
             lun_map_iter = NaElement('lun-map-get-iter')
-            lun_map_iter.add_new_child('max-records', '100')
+            lun_map_iter.add_new_child(
+                'max-records', str(self.configuration.netapp_max_records))
             if tag:
                 lun_map_iter.add_new_child('tag', tag, True)
             query = NaElement('query')
             lun_map_iter.add_child_elem(query)
             query.add_node_with_children('lun-map-info', **{'path': path})
+            des_attrs = NaElement('desired-attributes')
+            des_attrs.add_node_with_children(
+                'lun-map-info',
+                **{'initiator-group': None, 'lun-id': None, 'vserver': None})
+            lun_map_iter.add_child_elem(des_attrs)
             result = self.client.invoke_successfully(lun_map_iter, True)
             tag = result.get_child_content('next-tag')
             if result.get_child_content('num-records') and \
@@ -733,7 +820,8 @@ class NetAppDirectCmodeISCSIDriver(NetAppDirectISCSIDriver):
         igroup_list = []
         while True:
             igroup_iter = NaElement('igroup-get-iter')
-            igroup_iter.add_new_child('max-records', '100')
+            igroup_iter.add_new_child(
+                'max-records', str(self.configuration.netapp_max_records))
             if tag:
                 igroup_iter.add_new_child('tag', tag, True)
             query = NaElement('query')
@@ -42,7 +42,11 @@ netapp_connection_opts = [
                help='Host name for the storage controller'),
     cfg.IntOpt('netapp_server_port',
                default=80,
-               help='Port number for the storage controller'), ]
+               help='Port number for the storage controller'),
+    cfg.IntOpt('netapp_max_connections',
+               default=4,
+               help='Maximum number of api requests sent to the storage '
+                    'controller at once, over keep-alive connections'), ]
 
 netapp_transport_opts = [
     cfg.StrOpt('netapp_transport_type',
@@ -66,6 +70,18 @@ netapp_provisioning_opts = [
                default=None,
                help='Comma separated volumes to be used for provisioning'), ]
 
+netapp_cache_opts = [
+    cfg.IntOpt('netapp_cache_reconcile_interval',
+               default=600,
+               help='Seconds between reconciliations of the cached LUNs, '
+                    'igroups and LUN maps with the storage controller, '
+                    'done as volume stats are updated. 0 => at every '
+                    'update'),
+    cfg.IntOpt('netapp_max_records',
+               default=1000,
+               help='Records asked for per page when listing LUNs, '
+                    'igroups, LUN maps and volumes of a cluster'), ]
+
 netapp_cluster_opts = [
     cfg.StrOpt('netapp_vserver',
                default='openstack',
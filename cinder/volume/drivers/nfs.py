@@ -17,15 +17,23 @@
 
 import errno
 import hashlib
+import json
 import os
+import random
 
+from eventlet import greenpool
+from eventlet import greenthread
 from oslo.config import cfg
 
 from cinder import exception
 from cinder.image import image_utils
+from cinder.openstack.common import importutils
 from cinder.openstack.common import log as logging
+from cinder.openstack.common import timeutils
 from cinder import units
+from cinder.volume import blockcopy
 from cinder.volume import driver
+from cinder.volume import utils as volume_utils
 
 LOG = logging.getLogger(__name__)
 
@@ -57,15 +65,325 @@ volume_opts = [
                        'number, the destination will no longer be valid.'))
 ]
 
+remotefs_opts = [
+    cfg.IntOpt('remotefs_allocated_reconcile_interval',
+               default=600,
+               help=('Seconds between reconciling the tracked space '
+                     'allocated on each share with a full du walk of the '
+                     'mount point. Allocations made by this driver are '
+                     'tracked in between. Set to 0 to walk the share on '
+                     'every capacity check.')),
+    cfg.IntOpt('remotefs_capacity_cache_ttl',
+               default=5,
+               help=('Seconds for which the capacity probed on a share is '
+                     'reused when choosing shares for new volumes. Set to 0 '
+                     'to probe the shares on every volume create.')),
+    cfg.StrOpt('remotefs_share_selection_policy',
+               default=None,
+               help=('Policy used to choose among the shares with room for '
+                     'a new volume: least_allocated, most_free, '
+                     'weighted_random, round_robin or the full class path of '
+                     'a ShareSelectionPolicy subclass. Defaults to '
+                     'least_allocated for NFS and most_free for GlusterFS.')),
+    cfg.StrOpt('remotefs_preallocation',
+               default='auto',
+               help=('How the blocks of volumes which are not sparsed are '
+                     'allocated: fallocate, write (zeros over the whole '
+                     'file), auto (fallocate where the share supports '
+                     'it, write elsewhere) or the import path of a '
+                     'Preallocator subclass.')),
+    cfg.IntOpt('remotefs_preallocation_workers',
+               default=4,
+               help=('Number of blocks written at once when volumes are '
+                     'preallocated by writing zeros.')),
+    cfg.BoolOpt('remotefs_preallocation_background',
+                default=False,
+                help=('Return from creating a volume which is not sparsed '
+                      'as soon as the file has its size, and fallocate it '
+                      'in the background. Volumes preallocated by writing '
+                      'zeros are always written before the create '
+                      'returns.')),
+    cfg.ListOpt('remotefs_clone_methods',
+                default=['reflink', 'qcow2', 'copy'],
+                help=('Ways of cloning volumes and taking snapshots, tried '
+                      'in order: reflink (the file system of the share '
+                      'shares the blocks of the files), qcow2 (qcow2 '
+                      'overlay backed by the snapshot, only for volumes '
+                      'created from snapshots) and copy (full copy, '
+                      'throttled by volume_copy_rate).')),
+]
+
 VERSION = '1.1'
 
 CONF = cfg.CONF
 CONF.register_opts(volume_opts)
+CONF.register_opts(remotefs_opts)
+
+
+class ShareSelectionPolicy(object):
+    """Chooses the share a new volume is placed on.
+
+    Candidates are the shares that passed the driver's capacity checks,
+    given as a list of (share, (total_size, total_available,
+    total_allocated)) tuples in the order the shares are configured.
+    """
+
+    def select(self, candidates):
+        raise NotImplementedError()
+
+
+class LeastAllocatedPolicy(ShareSelectionPolicy):
+    """Choose the share with the least space allocated to volumes."""
+
+    def select(self, candidates):
+        return min(candidates, key=lambda c: c[1][2])[0]
+
+
+class MostFreePolicy(ShareSelectionPolicy):
+    """Choose the share with the most space available."""
+
+    def select(self, candidates):
+        return max(candidates, key=lambda c: c[1][1])[0]
+
+
+class WeightedRandomPolicy(ShareSelectionPolicy):
+    """Choose a random share, weighted by the space available on it."""
+
+    def select(self, candidates):
+        total = sum(c[1][1] for c in candidates)
+        if total <= 0:
+            return random.choice(candidates)[0]
+
+        point = random.uniform(0, total)
+        for share, capacity in candidates:
+            point -= capacity[1]
+            if point <= 0:
+                return share
+        return candidates[-1][0]
+
+
+class RoundRobinPolicy(ShareSelectionPolicy):
+    """Rotate through the shares, skipping the ones without room."""
+
+    def __init__(self):
+        self._last_share = None
+
+    def select(self, candidates):
+        shares = [c[0] for c in candidates]
+        index = 0
+        if self._last_share in shares:
+            index = (shares.index(self._last_share) + 1) % len(shares)
+        self._last_share = shares[index]
+        return self._last_share
+
+
+SHARE_SELECTION_POLICIES = {
+    'least_allocated': LeastAllocatedPolicy,
+    'most_free': MostFreePolicy,
+    'weighted_random': WeightedRandomPolicy,
+    'round_robin': RoundRobinPolicy,
+}
+
+
+class Preallocator(object):
+    """Allocates all the blocks of a volume file which already has its size.
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def in_place(self, path):
+        """Whether preallocating the file leaves its data untouched.
+
+        Only then may the volume be used while it is preallocated.
+        """
+        return False
+
+    def preallocate(self, path, size_in_g, progress=None):
+        raise NotImplementedError()
+
+
+class FallocatePreallocator(Preallocator):
+    """Allocates the file with fallocate, which writes no data."""
+
+    def in_place(self, path):
+        return True
+
+    def preallocate(self, path, size_in_g, progress=None):
+        self.driver._execute('fallocate', '-l', '%sG' % size_in_g, path,
+                             run_as_root=True)
+
+
+class WritePreallocator(Preallocator):
+    """Allocates the file by writing zeros over all of it.
+
+    Large blocks are written by remotefs_preallocation_workers workers at
+    once.
+    """
+
+    BLOCK_SIZE = 4 * units.MiB
+
+    def preallocate(self, path, size_in_g, progress=None):
+        blockcopy.copy(blockcopy.ZERO_SOURCE, path, size_in_g * units.GiB,
+                       self.BLOCK_SIZE, execute=self.driver._execute,
+                       progress=progress, rate=0, sparse=False,
+                       workers=(self.driver.configuration.
+                                remotefs_preallocation_workers))
+
+
+class AutoPreallocator(Preallocator):
+    """Uses fallocate where the share supports it, writes zeros elsewhere.
+
+    Support is probed once per directory, by fallocating the first byte
+    of the first file preallocated there.
+    """
+
+    def __init__(self, driver):
+        super(AutoPreallocator, self).__init__(driver)
+        self._fallocate = FallocatePreallocator(driver)
+        self._write = WritePreallocator(driver)
+        # directory : whether fallocate works there
+        self._supported = {}
+
+    def _pick(self, path):
+        directory = os.path.dirname(path)
+        if directory not in self._supported:
+            try:
+                self.driver._execute('fallocate', '-l', '1', path,
+                                     run_as_root=True)
+                self._supported[directory] = True
+            except exception.ProcessExecutionError:
+                LOG.info(_('fallocate is not supported in %s, volumes '
+                           'there are preallocated by writing zeros'),
+                         directory)
+                self._supported[directory] = False
+        if self._supported[directory]:
+            return self._fallocate
+        return self._write
+
+    def in_place(self, path):
+        return self._pick(path).in_place(path)
+
+    def preallocate(self, path, size_in_g, progress=None):
+        self._pick(path).preallocate(path, size_in_g, progress=progress)
+
+
+PREALLOCATORS = {
+    'fallocate': FallocatePreallocator,
+    'write': WritePreallocator,
+    'auto': AutoPreallocator,
+}
+
+
+class FileCloneStrategy(object):
+    """Makes a file on a share a copy of another one in the same directory.
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def clone(self, src, dest, size_in_g, immutable):
+        """Clone src to dest, or return None if this strategy cannot.
+
+        :param immutable: whether src never changes after it is cloned
+        :returns: the info of dest, see RemoteFsDriver._read_info
+        """
+        raise NotImplementedError()
+
+
+class ReflinkCloneStrategy(FileCloneStrategy):
+    """Clones by sharing the blocks of src until either file is written.
+
+    Needs a file system which supports reflinks on the share (Btrfs, XFS
+    or OCFS2, exported over NFS 4.2 for NFS shares). Support is probed
+    once per directory, by cloning the first file cloned there.
+    """
+
+    def __init__(self, driver):
+        super(ReflinkCloneStrategy, self).__init__(driver)
+        # directory : whether reflinks work there
+        self._supported = {}
+
+    def clone(self, src, dest, size_in_g, immutable):
+        directory = os.path.dirname(dest)
+        if not self._supported.get(directory, True):
+            return None
+        try:
+            self.driver._execute('cp', '--reflink=always', src, dest,
+                                 run_as_root=True)
+        except exception.ProcessExecutionError:
+            if directory in self._supported:
+                raise
+            LOG.info(_('Reflinks are not supported in %s, files there are '
+                       'cloned some other way'), directory)
+            self._supported[directory] = False
+            self.driver._execute('rm', '-f', dest, run_as_root=True)
+            return None
+        self._supported[directory] = True
+        return self.driver._read_info(src)
+
+
+class Qcow2CloneStrategy(FileCloneStrategy):
+    """Clones an immutable src into a qcow2 overlay backed by it.
+
+    The overlay names src relative to its own directory, so that it is
+    found wherever the share is mounted. The format of src is recorded in
+    the overlay rather than probed by whoever opens it.
+    """
+
+    def clone(self, src, dest, size_in_g, immutable):
+        if not immutable:
+            return None
+        backing_file = os.path.basename(src)
+        backing_fmt = self.driver._read_info(src).get('format', 'raw')
+        self.driver._execute('qemu-img', 'create', '-f', 'qcow2', '-o',
+                             'backing_file=%s,backing_fmt=%s' %
+                             (backing_file, backing_fmt),
+                             dest, '%sG' % size_in_g, run_as_root=True)
+        return {'format': 'qcow2', 'backing_file': backing_file}
+
+
+class CopyCloneStrategy(FileCloneStrategy):
+    """Clones by copying all of src, at most volume_copy_rate MiB/s."""
+
+    def clone(self, src, dest, size_in_g, immutable):
+        volume_utils.copy_volume(src, dest, size_in_g * units.KiB,
+                                 execute=self.driver._execute)
+        return self.driver._read_info(src)
+
+
+CLONE_STRATEGIES = {
+    'reflink': ReflinkCloneStrategy,
+    'qcow2': Qcow2CloneStrategy,
+    'copy': CopyCloneStrategy,
+}
 
 
 class RemoteFsDriver(driver.VolumeDriver):
     """Common base for drivers that work like NFS."""
 
+    default_share_selection_policy = 'least_allocated'
+
+    # what the driver records about a file is kept next to it, in a file
+    # with this suffix
+    INFO_SUFFIX = '.info'
+
+    def __init__(self, *args, **kwargs):
+        super(RemoteFsDriver, self).__init__(*args, **kwargs)
+        if self.configuration:
+            self.configuration.append_config_values(remotefs_opts)
+        # share : apparent bytes allocated by files on the share
+        self._allocated = {}
+        # share : time the allocation was last reconciled with du
+        self._allocated_reconciled_at = {}
+        # share : (time probed, capacity info)
+        self._capacity_cache = {}
+        self._share_selection_policy = None
+        self._preallocator = None
+        self._clone_strategies = None
+        # percentage allocated of the files being preallocated, by path
+        self.preallocation_progress = {}
+
     def check_for_setup_error(self):
         """Just to override parent behavior."""
         pass
@@ -76,11 +394,125 @@ class RemoteFsDriver(driver.VolumeDriver):
     def delete_volume(self, volume):
         raise NotImplementedError()
 
+    def create_snapshot(self, snapshot):
+        """Creates a snapshot as a file next to the file of its volume."""
+        volume = snapshot['volume']
+        self._ensure_share_mounted(volume['provider_location'])
+        snapshot_path = self._snapshot_path(snapshot)
+        self._clone_file(self.local_path(volume), snapshot_path,
+                         volume['size'])
+        self._set_rw_permissions_for_all(snapshot_path)
+        self._update_allocated_space(volume['provider_location'],
+                                     snapshot['volume_size'])
+
     def delete_snapshot(self, snapshot):
-        """Do nothing for this driver, but allow manager to handle deletion
-           of snapshot in error state.
+        """Deletes a snapshot.
+
+        Snapshots in error state may have no file, which is fine.
         """
-        pass
+        share = snapshot['volume']['provider_location']
+        if not share:
+            return
+        self._ensure_share_mounted(share)
+        snapshot_path = self._snapshot_path(snapshot)
+        if self._has_dependents(snapshot_path):
+            raise exception.SnapshotIsBusy(snapshot_name=snapshot['name'])
+        self._execute('rm', '-f', snapshot_path, run_as_root=True)
+        self._delete_info(snapshot_path)
+        self._update_allocated_space(share, -snapshot['volume_size'])
+
+    def create_volume_from_snapshot(self, volume, snapshot):
+        """Creates a volume from a snapshot, on the share of the snapshot."""
+        return self._create_clone(volume,
+                                  snapshot['volume']['provider_location'],
+                                  self._snapshot_path(snapshot),
+                                  snapshot['volume_size'], immutable=True)
+
+    def create_cloned_volume(self, volume, src_vref):
+        """Creates a clone of a volume, on the share of the volume."""
+        return self._create_clone(volume, src_vref['provider_location'],
+                                  self.local_path(src_vref),
+                                  src_vref['size'], immutable=False)
+
+    def _create_clone(self, volume, share, src, src_size, immutable):
+        self._ensure_share_mounted(share)
+        volume['provider_location'] = share
+        volume_path = self.local_path(volume)
+        self._clone_file(src, volume_path, src_size, immutable=immutable)
+        self._set_rw_permissions_for_all(volume_path)
+        if volume['size'] > src_size:
+            image_utils.resize_image(volume_path, volume['size'])
+        self._update_allocated_space(share, volume['size'])
+        return {'provider_location': share}
+
+    def _snapshot_path(self, snapshot):
+        return os.path.join(
+            os.path.dirname(self.local_path(snapshot['volume'])),
+            snapshot['name'])
+
+    def _get_clone_strategies(self):
+        """Return the strategies remotefs_clone_methods tries, in order."""
+        if self._clone_strategies is None:
+            strategies = []
+            for name in self.configuration.remotefs_clone_methods:
+                if name not in CLONE_STRATEGIES:
+                    raise exception.VolumeBackendAPIException(
+                        data=_('Unknown remotefs_clone_methods entry %s') %
+                        name)
+                strategies.append(CLONE_STRATEGIES[name](self))
+            self._clone_strategies = strategies
+        return self._clone_strategies
+
+    def _clone_file(self, src, dest, size_in_g, immutable=False):
+        """Make dest, in the directory of src, a copy of src.
+
+        :param immutable: whether src never changes, so that dest may be
+                          backed by it
+        """
+        for strategy in self._get_clone_strategies():
+            info = strategy.clone(src, dest, size_in_g, immutable)
+            if info is not None:
+                self._write_info(dest, info)
+                return
+        raise exception.VolumeBackendAPIException(
+            data=_('None of remotefs_clone_methods can clone %s') % src)
+
+    def _read_info(self, path):
+        """Return what the driver recorded about a volume or snapshot file.
+
+        Nothing is recorded for raw files. qcow2 overlays have their
+        'format' and the 'backing_file' they depend on recorded, so that
+        neither has to be probed from data the tenant may have written.
+        """
+        try:
+            with open(path + self.INFO_SUFFIX) as f:
+                return json.load(f)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return {}
+
+    def _write_info(self, path, info):
+        if info:
+            self._execute('tee', path + self.INFO_SUFFIX,
+                          process_input=json.dumps(info), run_as_root=True)
+
+    def _delete_info(self, path):
+        if os.path.exists(path + self.INFO_SUFFIX):
+            self._execute('rm', '-f', path + self.INFO_SUFFIX,
+                          run_as_root=True)
+
+    def _has_dependents(self, path):
+        """Whether a qcow2 overlay in the directory of path is backed by it.
+        """
+        directory, name = os.path.split(path)
+        for info_name in os.listdir(directory):
+            if (info_name.endswith(self.INFO_SUFFIX) and
+                    self._read_info(os.path.join(
+                        directory, info_name[:-len(self.INFO_SUFFIX)])).get(
+                            'backing_file') == name):
+                return True
+        return False
 
     def ensure_export(self, ctx, volume):
         raise NotImplementedError()
@@ -91,17 +523,139 @@ class RemoteFsDriver(driver.VolumeDriver):
                       path, run_as_root=True)
 
     def _create_regular_file(self, path, size):
-        """Creates regular file of given size. Takes a lot of time for large
-        files.
+        """Creates regular file of given size, with all its blocks allocated.
+
+        With remotefs_preallocation_background, the blocks are allocated
+        in the background when that leaves the data of the file untouched.
         """
+        self._create_sparsed_file(path, size)
+        preallocator = self._get_preallocator()
+        if (self.configuration.remotefs_preallocation_background and
+                preallocator.in_place(path)):
+            greenthread.spawn_n(self._preallocate_in_background,
+                                preallocator, path, size)
+        else:
+            self._preallocate(preallocator, path, size)
+
+    def _get_preallocator(self):
+        """Return the strategy used to allocate the blocks of volumes."""
+        if self._preallocator is None:
+            name = self.configuration.remotefs_preallocation
+            if name in PREALLOCATORS:
+                preallocator_class = PREALLOCATORS[name]
+            else:
+                preallocator_class = importutils.import_class(name)
+            self._preallocator = preallocator_class(self)
+        return self._preallocator
+
+    def _preallocate(self, preallocator, path, size):
+        logged = [0]
+
+        def report(done, total):
+            percent = done * 100 // total
+            self.preallocation_progress[path] = percent
+            if percent >= logged[0] + 10:
+                logged[0] = percent - percent % 10
+                LOG.info(_('Preallocating %(path)s: %(percent)d%% done'),
+                         {'path': path, 'percent': percent})
+
+        self.preallocation_progress[path] = 0
+        try:
+            preallocator.preallocate(path, size, progress=report)
+        finally:
+            self.preallocation_progress.pop(path, None)
 
-        block_size_mb = 1
-        block_count = size * units.GiB / (block_size_mb * units.MiB)
+    def _preallocate_in_background(self, preallocator, path, size):
+        try:
+            self._preallocate(preallocator, path, size)
+        except Exception:
+            LOG.exception(_('Failed to preallocate %s, it is left sparse'),
+                          path)
+
+    def _get_allocated_space(self, share):
+        """Return apparent bytes allocated on the share.
+
+        The share is walked with du the first time it is seen and then
+        once every remotefs_allocated_reconcile_interval seconds; in
+        between, the value is kept current from the volumes and snapshots
+        this driver creates and deletes.
+        :param share: example 172.18.194.100:/var/nfs
+        """
+        interval = self.configuration.remotefs_allocated_reconcile_interval
+        reconciled_at = self._allocated_reconciled_at.get(share)
+
+        if (reconciled_at is None or interval <= 0 or
+                timeutils.is_older_than(reconciled_at, interval)):
+            mount_point = self._get_mount_point_for_share(share)
+            # .snapshot directories of filers hold the array's own
+            # snapshots, not files of this driver
+            du, _ = self._execute('du', '-sb', '--apparent-size',
+                                  '--exclude', '.snapshot', mount_point,
+                                  run_as_root=True)
+            self._allocated[share] = float(du.split()[0])
+            self._allocated_reconciled_at[share] = timeutils.utcnow()
+
+        return self._allocated[share]
+
+    def _update_allocated_space(self, share, size_in_gib):
+        """Account for a volume or snapshot file added to the share.
+
+        A negative size accounts for a removed file. Shares which
+        have not been walked yet are left alone, the next du walk will
+        pick the change up.
+        """
+        self._capacity_cache.pop(share, None)
+        if share not in self._allocated:
+            return
+        allocated = self._allocated[share] + size_in_gib * units.GiB
+        self._allocated[share] = max(0, allocated)
 
-        self._execute('dd', 'if=/dev/zero', 'of=%s' % path,
-                      'bs=%dM' % block_size_mb,
-                      'count=%d' % block_count,
-                      run_as_root=True)
+    def _get_capacity_info(self, share):
+        """Return (total_size, total_available, total_allocated) in bytes.
+
+        :param share: example 172.18.194.100:/var/nfs
+        """
+        raise NotImplementedError()
+
+    def _get_shares_capacity(self, shares):
+        """Return a dict of share : capacity info for the given shares.
+
+        Shares are probed concurrently and the results are reused for
+        remotefs_capacity_cache_ttl seconds, or until a volume is created
+        on or deleted from the share.
+        """
+        ttl = self.configuration.remotefs_capacity_cache_ttl
+        capacities = {}
+        stale_shares = []
+
+        for share in shares:
+            cached = self._capacity_cache.get(share)
+            if (cached is not None and ttl > 0 and
+                    not timeutils.is_older_than(cached[0], ttl)):
+                capacities[share] = cached[1]
+            else:
+                stale_shares.append(share)
+
+        if stale_shares:
+            pool = greenpool.GreenPool(len(stale_shares))
+            probed = pool.imap(self._get_capacity_info, stale_shares)
+            for share, capacity in zip(stale_shares, probed):
+                self._capacity_cache[share] = (timeutils.utcnow(), capacity)
+                capacities[share] = capacity
+
+        return capacities
+
+    def _get_share_selection_policy(self):
+        """Return the policy used to choose among candidate shares."""
+        if self._share_selection_policy is None:
+            name = (self.configuration.remotefs_share_selection_policy or
+                    self.default_share_selection_policy)
+            if name in SHARE_SELECTION_POLICIES:
+                policy_class = SHARE_SELECTION_POLICIES[name]
+            else:
+                policy_class = importutils.import_class(name)
+            self._share_selection_policy = policy_class()
+        return self._share_selection_policy
 
     def _set_rw_permissions_for_all(self, path):
         """Sets 666 permissions for the path."""
@@ -147,10 +701,13 @@ class RemoteFsDriver(driver.VolumeDriver):
 
     def copy_volume_to_image(self, context, volume, image_service, image_meta):
         """Copy the volume to the specified image."""
+        volume_path = self.local_path(volume)
         image_utils.upload_volume(context,
                                   image_service,
                                   image_meta,
-                                  self.local_path(volume))
+                                  volume_path,
+                                  self._read_info(volume_path).get('format',
+                                                                   'raw'))
 
     def _read_config_file(self, config_file):
         # Returns list of lines in file
@@ -233,9 +790,6 @@ class NfsDriver(RemoteFsDriver):
             else:
                 raise
 
-    def create_cloned_volume(self, volume, src_vref):
-        raise NotImplementedError()
-
     def create_volume(self, volume):
         """Creates a volume"""
 
@@ -246,6 +800,8 @@ class NfsDriver(RemoteFsDriver):
         LOG.info(_('casted to %s') % volume['provider_location'])
 
         self._do_create_volume(volume)
+        self._update_allocated_space(volume['provider_location'],
+                                     volume['size'])
 
         return {'provider_location': volume['provider_location']}
 
@@ -262,6 +818,9 @@ class NfsDriver(RemoteFsDriver):
         mounted_path = self.local_path(volume)
 
         self._execute('rm', '-f', mounted_path, run_as_root=True)
+        self._delete_info(mounted_path)
+        self._update_allocated_space(volume['provider_location'],
+                                     -volume['size'])
 
     def ensure_export(self, ctx, volume):
         """Synchronously recreates an export for a logical volume."""
@@ -283,6 +842,9 @@ class NfsDriver(RemoteFsDriver):
                 'name': volume['name']}
         if volume['provider_location'] in self.shares:
             data['options'] = self.shares[volume['provider_location']]
+        info = self._read_info(self.local_path(volume))
+        if 'format' in info:
+            data['format'] = info['format']
         return {
             'driver_volume_type': 'nfs',
             'data': data
@@ -337,7 +899,8 @@ class NfsDriver(RemoteFsDriver):
         available for the new volume.
 
         For instances with more than one share that meets the criteria, the
-        share with the least "allocated" space will be selected.
+        share is chosen by remotefs_share_selection_policy, by default the
+        one with the least "allocated" space.
 
         :param volume_size_in_gib: int size in GB
         """
@@ -345,17 +908,17 @@ class NfsDriver(RemoteFsDriver):
         if not self._mounted_shares:
             raise exception.NfsNoSharesMounted()
 
-        target_share = None
-        target_share_reserved = 0
+        candidates = []
 
         used_ratio = self.configuration.nfs_used_ratio
         oversub_ratio = self.configuration.nfs_oversub_ratio
 
         requested_volume_size = volume_size_in_gib * units.GiB
 
+        capacities = self._get_shares_capacity(self._mounted_shares)
         for nfs_share in self._mounted_shares:
             total_size, total_available, total_allocated = \
-                self._get_capacity_info(nfs_share)
+                capacities[nfs_share]
             apparent_size = max(0, total_size * oversub_ratio)
             apparent_available = max(0, apparent_size - total_allocated)
             used = (total_size - total_available) / total_size
@@ -375,18 +938,14 @@ class NfsDriver(RemoteFsDriver):
                           nfs_share)
                 continue
 
-            if target_share is not None:
-                if target_share_reserved > total_allocated:
-                    target_share = nfs_share
-                    target_share_reserved = total_allocated
-            else:
-                target_share = nfs_share
-                target_share_reserved = total_allocated
+            candidates.append((nfs_share, capacities[nfs_share]))
 
-        if target_share is None:
+        if not candidates:
             raise exception.NfsNoSuitableShareFound(
                 volume_size=volume_size_in_gib)
 
+        target_share = self._get_share_selection_policy().select(candidates)
+
         LOG.debug(_('Selected %s as target nfs share.'), target_share)
 
         return target_share
@@ -410,9 +969,7 @@ class NfsDriver(RemoteFsDriver):
         total_available = block_size * blocks_avail
         total_size = block_size * blocks_total
 
-        du, _ = self._execute('du', '-sb', '--apparent-size', '--exclude',
-                              '*snapshot*', mount_point, run_as_root=True)
-        total_allocated = float(du.split()[0])
+        total_allocated = self._get_allocated_space(nfs_share)
         return total_size, total_available, total_allocated
 
     def _mount_nfs(self, nfs_share, mount_path, ensure=False):
@@ -459,8 +1016,9 @@ class NfsDriver(RemoteFsDriver):
 
         global_capacity = 0
         global_free = 0
+        capacities = self._get_shares_capacity(self._mounted_shares)
         for nfs_share in self._mounted_shares:
-            capacity, free, allocated = self._get_capacity_info(nfs_share)
+            capacity, free, allocated = capacities[nfs_share]
             global_capacity += capacity
             global_free += free
 
@@ -14,6 +14,7 @@
 """RADOS Block Device Driver"""
 
 from __future__ import absolute_import
+import collections
 import io
 import json
 import os
@@ -24,10 +25,11 @@ from oslo.config import cfg
 
 from cinder.backup.drivers import ceph as ceph_backup
 from cinder import exception
+from cinder.image import cache as image_cache
 from cinder.image import image_utils
-from cinder.openstack.common import fileutils
 from cinder.openstack.common import log as logging
 from cinder import units
+from cinder import utils
 from cinder.volume import driver
 
 try:
@@ -240,10 +242,18 @@ CONF.register_opts(rbd_opts)
 
 class RBDDriver(driver.VolumeDriver):
     """Implements RADOS block device (RBD) volume commands."""
+
+    # golden images of glance images are named with this prefix, and
+    # cloned from this snapshot of theirs
+    GOLDEN_PREFIX = 'cinder-image-'
+    GOLDEN_SNAP = 'golden'
+
     def __init__(self, *args, **kwargs):
         super(RBDDriver, self).__init__(*args, **kwargs)
         self.configuration.append_config_values(rbd_opts)
         self._stats = {}
+        # golden images, least recently used first; None until listed
+        self._golden_images = None
         # allow overrides for testing
         self.rados = kwargs.get('rados', rados)
         self.rbd = kwargs.get('rbd', rbd)
@@ -359,6 +369,9 @@ class RBDDriver(driver.VolumeDriver):
         else:
             size = int(volume['size']) * 1024 ** 3
 
+        self._create_image(volume['name'], size)
+
+    def _create_image(self, name, size):
         old_format = True
         features = 0
         if self._supports_layering():
@@ -367,7 +380,7 @@ class RBDDriver(driver.VolumeDriver):
 
         with RADOSClient(self) as client:
             self.rbd.RBD().create(client.ioctx,
-                                  str(volume['name']),
+                                  str(name),
                                   size,
                                   old_format=old_format,
                                   features=features)
@@ -532,7 +545,58 @@ class RBDDriver(driver.VolumeDriver):
         if tmp_dir and not os.path.exists(tmp_dir):
             os.makedirs(tmp_dir)
 
-    def copy_image_to_volume(self, context, volume, image_service, image_id):
+    def _stream_image_to_volume(self, context, volume, image_service,
+                                image_id, image_meta):
+        """Write a raw image into the volume through librbd as it downloads.
+
+        Runs of zeros are skipped, so the volume stays sparse. Returns
+        False, with nothing written, if the image is not actually raw.
+        """
+        self.delete_volume(volume)
+        self._create_image(volume['name'], int(image_meta['size']))
+        with RBDVolumeProxy(self, volume['name']) as vol:
+            rbd_meta = RBDImageMetadata(vol.volume,
+                                        self.configuration.rbd_pool,
+                                        self.configuration.rbd_user,
+                                        self.configuration.rbd_ceph_conf)
+            try:
+                image_utils.fetch_stream(context, image_service, image_id,
+                                         image_meta,
+                                         RBDImageIOWrapper(rbd_meta),
+                                         sparse=True)
+                return True
+            except image_utils.NotRawImage as e:
+                LOG.warn(_("Image %(image_id)s is declared raw but looks "
+                           "like %(fmt)s, converting it instead") %
+                         {'image_id': image_id, 'fmt': e.file_format})
+        return False
+
+    def _import(self, path, volume):
+        # keep using the command line import instead of librbd since it
+        # detects zeroes to preserve sparseness in the image
+        args = ['rbd', 'import',
+                '--pool', self.configuration.rbd_pool,
+                path, volume['name']]
+        if self._supports_layering():
+            args += ['--new-format']
+        args += self._ceph_args()
+        self._try_execute(*args)
+
+    def _write_image(self, context, volume, image_service, image_id,
+                     image_meta):
+        """Replace the volume with an image of the raw size of the image."""
+        if (image_utils.can_stream(image_meta) and
+                self._stream_image_to_volume(context, volume, image_service,
+                                             image_id, image_meta)):
+            return
+
+        with image_utils.fetch_cached(context, image_service, image_id,
+                                      image_meta) as cached:
+            if cached is not None:
+                self.delete_volume(volume)
+                self._import(cached, volume)
+                return
+
         self._ensure_tmp_exists()
         tmp_dir = self.configuration.volume_tmp_dir
 
@@ -541,33 +605,114 @@ class RBDDriver(driver.VolumeDriver):
                                      tmp.name)
 
             self.delete_volume(volume)
+            self._import(tmp.name, volume)
 
-            # keep using the command line import instead of librbd since it
-            # detects zeroes to preserve sparseness in the image
-            args = ['rbd', 'import',
-                    '--pool', self.configuration.rbd_pool,
-                    tmp.name, volume['name']]
-            if self._supports_layering():
-                args += ['--new-format']
-            args += self._ceph_args()
-            self._try_execute(*args)
+    def _list_golden_images(self):
+        with RADOSClient(self) as client:
+            names = self.rbd.RBD().list(client.ioctx)
+        return collections.OrderedDict(
+            (name, True) for name in names
+            if name.startswith(self.GOLDEN_PREFIX))
+
+    def _golden_image(self, context, image_service, image_id, image_meta,
+                      key):
+        """Return the name of the golden image of a glance image.
+
+        The golden image is written, and its snapshot taken, if there is
+        none yet. The least recently used golden images beyond
+        image_golden_volumes are removed, unless volumes are still cloned
+        from them.
+        """
+        name = self.GOLDEN_PREFIX + key
+
+        @utils.synchronized(name, external=True)
+        def _get():
+            if self._golden_images is None:
+                self._golden_images = self._list_golden_images()
+            if name in self._golden_images:
+                del self._golden_images[name]
+                self._golden_images[name] = True
+                return
+            LOG.info(_('Creating golden image %(name)s of image '
+                       '%(image_id)s'), {'name': name, 'image_id': image_id})
+            golden = {'name': name}
+            # _write_image replaces an existing image
+            self._create_image(name, units.MiB)
+            self._write_image(context, golden, image_service, image_id,
+                              image_meta)
+            with RBDVolumeProxy(self, name) as vol:
+                vol.create_snap(self.GOLDEN_SNAP)
+                vol.protect_snap(self.GOLDEN_SNAP)
+            self._golden_images[name] = True
+            for old_name in list(self._golden_images):
+                if (len(self._golden_images) <=
+                        self.configuration.image_golden_volumes):
+                    break
+                if old_name != name and self._remove_golden_image(old_name):
+                    del self._golden_images[old_name]
+
+        _get()
+        return name
+
+    def _remove_golden_image(self, name):
+        """Remove a golden image; False if volumes depend on it."""
+        with RBDVolumeProxy(self, name) as vol:
+            try:
+                vol.unprotect_snap(self.GOLDEN_SNAP)
+            except self.rbd.ImageBusy:
+                LOG.debug(_('Keeping golden image %s, volumes are cloned '
+                            'from it'), name)
+                return False
+            vol.remove_snap(self.GOLDEN_SNAP)
+        LOG.info(_('Evicting golden image %s'), name)
+        with RADOSClient(self) as client:
+            self.rbd.RBD().remove(client.ioctx, str(name))
+        return True
+
+    def copy_image_to_volume(self, context, volume, image_service, image_id):
+        image_meta = image_service.show(context, image_id)
+        key = image_cache.cache_key(image_id, image_meta)
+        if (self.configuration.image_golden_volumes and key is not None and
+                self._supports_layering()):
+            golden = self._golden_image(context, image_service, image_id,
+                                        image_meta, key)
+            self.delete_volume(volume)
+            self._clone(volume, self.configuration.rbd_pool, golden,
+                        self.GOLDEN_SNAP)
+        else:
+            self._write_image(context, volume, image_service, image_id,
+                              image_meta)
         self._resize(volume)
 
+    def _qemu_source(self, volume):
+        """Return the rbd: URI qemu-img reads the volume through."""
+        source = 'rbd:%s/%s' % (self.configuration.rbd_pool, volume['name'])
+        if self.configuration.rbd_user:
+            source += ':id=%s' % self.configuration.rbd_user
+        if self.configuration.rbd_ceph_conf:
+            source += ':conf=%s' % self.configuration.rbd_ceph_conf
+        return source
+
     def copy_volume_to_image(self, context, volume, image_service, image_meta):
-        self._ensure_tmp_exists()
+        """Upload the volume to the image without exporting it first.
 
-        tmp_dir = self.configuration.volume_tmp_dir or '/tmp'
-        tmp_file = os.path.join(tmp_dir,
-                                volume['name'] + '-' + image_meta['id'])
-        with fileutils.remove_path_on_error(tmp_file):
-            args = ['rbd', 'export',
-                    '--pool', self.configuration.rbd_pool,
-                    volume['name'], tmp_file]
-            args += self._ceph_args()
-            self._try_execute(*args)
-            image_utils.upload_volume(context, image_service,
-                                      image_meta, tmp_file)
-        os.unlink(tmp_file)
+        Raw images are read from the volume through librbd as they are
+        uploaded; qemu-img reads the volume directly to convert it to
+        other formats.
+        """
+        if image_meta['disk_format'] != 'raw':
+            image_utils.upload_volume(context, image_service, image_meta,
+                                      self._qemu_source(volume))
+            return
+
+        with RBDVolumeProxy(self, volume['name'], read_only=True) as vol:
+            rbd_meta = RBDImageMetadata(vol.volume,
+                                        self.configuration.rbd_pool,
+                                        self.configuration.rbd_user,
+                                        self.configuration.rbd_ceph_conf)
+            image_utils.upload_stream(context, image_service,
+                                      image_meta['id'],
+                                      RBDImageIOWrapper(rbd_meta))
 
     def backup_volume(self, context, backup, backup_service):
         """Create a new backup from an existing volume."""
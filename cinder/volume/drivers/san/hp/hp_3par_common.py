@@ -44,7 +44,6 @@ import paramiko
 import pprint
 from random import randint
 import re
-import time
 import uuid
 
 from eventlet import greenthread
@@ -57,6 +56,8 @@ from cinder import exception
 from cinder.openstack.common import excutils
 from cinder.openstack.common import log as logging
 from cinder import utils
+from cinder.volume import jobtracker
+from cinder.volume import statscache
 from cinder.volume import volume_types
 
 
@@ -334,6 +335,10 @@ exit
                                          password=self.config.san_password,
                                          privatekey=
                                          self.config.san_private_key,
+                                         failover_ips=
+                                         self.config.san_failover_ips,
+                                         max_idle_time=
+                                         self.config.ssh_max_idle_time,
                                          min_size=
                                          self.config.ssh_min_pool_conn,
                                          max_size=
@@ -344,8 +349,9 @@ exit
                 while attempts > 0:
                     attempts -= 1
                     try:
-                        return self._ssh_execute(ssh, command,
-                                                 check_exit_code=check_exit)
+                        with self.sshpool.timed(command):
+                            return self._ssh_execute(
+                                ssh, command, check_exit_code=check_exit)
                     except Exception as e:
                         LOG.error(e)
                         greenthread.sleep(randint(20, 500) / 100.0)
@@ -545,7 +551,7 @@ exit
                  'volume_backend_name': None}
 
         try:
-            cpg = self.client.getCPG(self.config.hp3par_cpg)
+            cpg = self._get_cpg_usage(self.config.hp3par_cpg)
             if 'limitMiB' not in cpg['SDGrowth']:
                 total_capacity = 'infinite'
                 free_capacity = 'infinite'
@@ -564,6 +570,18 @@ exit
 
         self.stats = stats
 
+    def _get_cpg_usage(self, cpg_name):
+        """Return the growth limit and usage of a CPG.
+
+        They are shared with the other backends of the node using the CPG.
+        """
+        def _collect():
+            cpg = self.client.getCPG(cpg_name)
+            return {'SDGrowth': cpg['SDGrowth'], 'UsrUsage': cpg['UsrUsage']}
+
+        key = 'hp3par-%s-cpg-%s' % (self.config.san_ip, cpg_name)
+        return statscache.get_array_stats_cache().get(key, _collect)
+
     def create_vlun(self, volume, host):
         """
         In order to export a volume on a 3PAR box, we have to
@@ -828,22 +846,20 @@ exit
             self._copy_volume(orig_name, vol_name)
 
             # this can take a long time to complete
-            done = False
-            while not done:
+            def _poll_copy():
                 status = self._get_volume_state(vol_name)
                 if status == 'normal':
-                    done = True
+                    return True
                 elif status == 'copy_target':
                     LOG.debug("3Par still copying %s => %s"
                               % (orig_name, vol_name))
+                    return jobtracker.RUNNING
                 else:
                     msg = _("Unexpected state while cloning %s") % status
                     LOG.warn(msg)
                     raise exception.CinderException(msg)
 
-                if not done:
-                    # wait 5 seconds between tests
-                    time.sleep(5)
+            jobtracker.get_job_tracker().wait(_poll_copy, name=vol_name)
 
             return new_vol
         except hpexceptions.HTTPForbidden:
@@ -41,6 +41,10 @@ san_opts = [
     cfg.StrOpt('san_ip',
                default='',
                help='IP address of SAN controller'),
+    cfg.ListOpt('san_failover_ips',
+                default=[],
+                help='IP addresses of the SAN controller to connect to '
+                     'over SSH when san_ip cannot be reached'),
     cfg.StrOpt('san_login',
                default='admin',
                help='Username for SAN controller'),
@@ -70,6 +74,10 @@ san_opts = [
     cfg.IntOpt('ssh_max_pool_conn',
                default=5,
                help='Maximum ssh connections in the pool'),
+    cfg.IntOpt('ssh_max_idle_time',
+               default=300,
+               help='Seconds an ssh connection may sit idle in the pool '
+                    'before it is replaced. 0 => never'),
 ]
 
 CONF = cfg.CONF
@@ -108,12 +116,16 @@ class SanISCSIDriver(ISCSIDriver):
             privatekey = self.configuration.san_private_key
             min_size = self.configuration.ssh_min_pool_conn
             max_size = self.configuration.ssh_max_pool_conn
+            failover_ips = self.configuration.san_failover_ips
+            max_idle_time = self.configuration.ssh_max_idle_time
             self.sshpool = utils.SSHPool(self.configuration.san_ip,
                                          self.configuration.san_ssh_port,
                                          self.configuration.ssh_conn_timeout,
                                          self.configuration.san_login,
                                          password=password,
                                          privatekey=privatekey,
+                                         failover_ips=failover_ips,
+                                         max_idle_time=max_idle_time,
                                          min_size=min_size,
                                          max_size=max_size)
         last_exception = None
@@ -123,10 +135,17 @@ class SanISCSIDriver(ISCSIDriver):
                 while attempts > 0:
                     attempts -= 1
                     try:
-                        return utils.ssh_execute(
-                            ssh,
-                            command,
-                            check_exit_code=check_exit_code)
+                        # Each command gets an exec channel of its own
+                        # rather than the pooled shell() channel: only an
+                        # exec channel reports the exit status that
+                        # check_exit_code needs, and no prompt is known to
+                        # tell where the output of a command ends on the
+                        # CLIs of the arrays these drivers manage.
+                        with self.sshpool.timed(command):
+                            return utils.ssh_execute(
+                                ssh,
+                                command,
+                                check_exit_code=check_exit_code)
                     except Exception as e:
                         LOG.error(e)
                         last_exception = e
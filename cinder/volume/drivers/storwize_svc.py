@@ -52,8 +52,10 @@ from cinder import exception
 from cinder.openstack.common import excutils
 from cinder.openstack.common import log as logging
 from cinder.openstack.common import strutils
+from cinder.openstack.common import timeutils
 from cinder import utils
 from cinder.volume.drivers.san import san
+from cinder.volume import jobtracker
 from cinder.volume import volume_types
 
 VERSION = 1.1
@@ -98,6 +100,11 @@ storwize_svc_opts = [
     cfg.BoolOpt('storwize_svc_multihostmap_enabled',
                 default=True,
                 help='Allows vdisk to multi host mapping'),
+    cfg.IntOpt('storwize_svc_inventory_refresh_interval',
+               default=300,
+               help='Seconds the hosts and CHAP secrets listed from the '
+                    'storage system are trusted before they are listed '
+                    'again'),
 ]
 
 
@@ -127,6 +134,14 @@ class StorwizeSVCDriver(san.SanISCSIDriver):
         self._compression_enabled = False
         self._context = None
 
+        # Hosts, their ports and CHAP secrets as last listed from the
+        # storage system, kept up to date with our own changes
+        self._host_names = set()
+        self._host_ports = {}
+        self._port_hosts = {}
+        self._chap_secrets = {}
+        self._inventory_refreshed_at = None
+
         # Build cleanup translation tables for host names
         invalid_ch_in_host = ''
         for num in range(0, 128):
@@ -342,6 +357,85 @@ class StorwizeSVCDriver(san.SanISCSIDriver):
     def remove_export(self, ctxt, volume):
         pass
 
+    def _refresh_inventory(self):
+        """List the hosts and CHAP secrets of the system.
+
+        Ports can only be listed one host at a time, so the ports already
+        known are kept for the hosts that still exist.
+        """
+
+        LOG.debug(_('enter: _refresh_inventory'))
+
+        host_names = set()
+        generator = self._port_conf_generator('svcinfo lshost')
+        header = next(generator, None)
+        for host_data in generator:
+            try:
+                host_names.add(host_data['name'])
+            except KeyError:
+                self._handle_keyerror('lshost', header)
+
+        chap_secrets = {}
+        if 'iSCSI' in self._enabled_protocols:
+            chap_secrets = self._list_chap_secrets()
+
+        for host_name in set(self._host_ports) - host_names:
+            self._forget_host(host_name)
+        self._host_names = host_names
+        self._chap_secrets = chap_secrets
+        self._inventory_refreshed_at = timeutils.utcnow()
+
+        LOG.debug(_('leave: _refresh_inventory: %d hosts') % len(host_names))
+
+    def _list_chap_secrets(self, host_name=None):
+        """Return the CHAP secrets of all hosts, or of the given one."""
+        cmd = 'svcinfo lsiscsiauth'
+        if host_name is not None:
+            cmd += ' -filtervalue name=%s' % host_name
+        chap_secrets = {}
+        generator = self._port_conf_generator(cmd)
+        header = next(generator, None)
+        for auth_data in generator:
+            try:
+                chap_secret = None
+                if auth_data['iscsi_auth_method'] == 'chap':
+                    chap_secret = auth_data['iscsi_chap_secret']
+                chap_secrets[auth_data['name']] = chap_secret
+            except KeyError:
+                self._handle_keyerror('lsiscsiauth', header)
+        return chap_secrets
+
+    def _ensure_inventory(self):
+        """Refresh the inventory if it is too old; True if it was."""
+        interval = self.configuration.storwize_svc_inventory_refresh_interval
+        if (self._inventory_refreshed_at is None or
+                timeutils.is_older_than(self._inventory_refreshed_at,
+                                        interval)):
+            self._refresh_inventory()
+            return True
+        return False
+
+    def _add_host_ports(self, host_name, ports):
+        self._host_ports.setdefault(host_name, set()).update(ports)
+        for port in ports:
+            self._port_hosts[port] = host_name
+
+    def _forget_host(self, host_name):
+        self._host_names.discard(host_name)
+        for port in self._host_ports.pop(host_name, ()):
+            if self._port_hosts.get(port) == host_name:
+                del self._port_hosts[port]
+        self._chap_secrets.pop(host_name, None)
+
+    def _connector_ports(self, connector):
+        """Return the iSCSI name and lowercase WWPNs of a connector."""
+        ports = []
+        if 'initiator' in connector:
+            ports.append(connector['initiator'])
+        if 'wwpns' in connector:
+            ports.extend(str(wwpn).lower() for wwpn in connector['wwpns'])
+        return ports
+
     def _add_chapsecret_to_host(self, host_name):
         """Generate and store a randomly-generated CHAP secret for the host."""
 
@@ -352,6 +446,7 @@ class StorwizeSVCDriver(san.SanISCSIDriver):
         # No output should be returned from chhost
         self._assert_ssh_return(len(out.strip()) == 0,
                                 '_add_chapsecret_to_host', ssh_cmd, out, err)
+        self._chap_secrets[host_name] = chap_secret
         return chap_secret
 
     def _get_chap_secret_for_host(self, host_name):
@@ -360,38 +455,13 @@ class StorwizeSVCDriver(san.SanISCSIDriver):
         LOG.debug(_('enter: _get_chap_secret_for_host: host name %s')
                   % host_name)
 
-        ssh_cmd = 'svcinfo lsiscsiauth -delim !'
-        out, err = self._run_ssh(ssh_cmd)
-
-        if not len(out.strip()):
-            return None
-
-        host_lines = out.strip().split('\n')
-        self._assert_ssh_return(len(host_lines), '_get_chap_secret_for_host',
-                                ssh_cmd, out, err)
-
-        header = host_lines.pop(0).split('!')
-        self._assert_ssh_return('name' in header, '_get_chap_secret_for_host',
-                                ssh_cmd, out, err)
-        self._assert_ssh_return('iscsi_auth_method' in header,
-                                '_get_chap_secret_for_host', ssh_cmd, out, err)
-        self._assert_ssh_return('iscsi_chap_secret' in header,
-                                '_get_chap_secret_for_host', ssh_cmd, out, err)
-        name_index = header.index('name')
-        method_index = header.index('iscsi_auth_method')
-        secret_index = header.index('iscsi_chap_secret')
-
-        chap_secret = None
-        host_found = False
-        for line in host_lines:
-            info = line.split('!')
-            if info[name_index] == host_name:
-                host_found = True
-                if info[method_index] == 'chap':
-                    chap_secret = info[secret_index]
-
-        self._assert_ssh_return(host_found, '_get_chap_secret_for_host',
-                                ssh_cmd, out, err)
+        refreshed = self._ensure_inventory()
+        chap_secret = self._chap_secrets.get(host_name)
+        if chap_secret is None and not refreshed:
+            # Another node may have set a secret since the inventory was
+            # listed; setting a new one would break its sessions
+            chap_secret = self._list_chap_secrets(host_name).get(host_name)
+            self._chap_secrets[host_name] = chap_secret
 
         LOG.debug(_('leave: _get_chap_secret_for_host: host name '
                     '%(host_name)s with secret %(chap_secret)s')
@@ -449,73 +519,79 @@ class StorwizeSVCDriver(san.SanISCSIDriver):
                 # host from this WWPN-based query. Just pick
                 # the name from first line.
                 hostname = host_lines[0].split('!')[name_idx]
+                self._port_hosts[str(wwpn).lower()] = hostname
                 return hostname
 
         # Didn't find a host
         return None
 
     def _find_host_exhaustive(self, connector, hosts):
+        ports = set(self._connector_ports(connector))
         for host in hosts:
             ssh_cmd = 'svcinfo lshost -delim ! %s' % host
             out, err = self._run_ssh(ssh_cmd)
             self._assert_ssh_return(len(out.strip()),
                                     '_find_host_exhaustive',
                                     ssh_cmd, out, err)
+            host_ports = []
             for attr_line in out.split('\n'):
                 # If '!' not found, return the string and two empty strings
                 attr_name, foo, attr_val = attr_line.partition('!')
-                if (attr_name == 'iscsi_name' and
-                        'initiator' in connector and
-                        attr_val == connector['initiator']):
-                    return host
-                elif (attr_name == 'WWPN' and
-                      'wwpns' in connector and
-                      attr_val.lower() in
-                      map(str.lower, map(str, connector['wwpns']))):
-                        return host
+                if attr_name == 'iscsi_name':
+                    host_ports.append(attr_val)
+                elif attr_name == 'WWPN':
+                    host_ports.append(attr_val.lower())
+            self._add_host_ports(host, host_ports)
+            if ports.intersection(host_ports):
+                return host
         return None
 
     def _get_host_from_connector(self, connector):
-        """List the hosts defined in the storage.
+        """Look up the host defined in the storage for a connector.
 
         Return the host name with the given connection info, or None if there
-        is no host fitting that information.
+        is no host fitting that information. Hosts are looked up in the
+        inventory first; the storage is only queried host by host for ports
+        that are not in it after a refresh.
 
         """
 
         prefix = self._connector_to_hostname_prefix(connector)
         LOG.debug(_('enter: _get_host_from_connector: prefix %s') % prefix)
 
-        # Get list of host in the storage
-        ssh_cmd = 'svcinfo lshost -delim !'
-        out, err = self._run_ssh(ssh_cmd)
-
-        if not len(out.strip()):
-            return None
-
-        # If we have FC information, we have a faster lookup option
-        hostname = None
-        if 'wwpns' in connector:
-            hostname = self._find_host_from_wwpn(connector)
-
-        # If we don't have a hostname yet, try the long way
-        if not hostname:
-            host_lines = out.strip().split('\n')
-            self._assert_ssh_return(len(host_lines),
-                                    '_get_host_from_connector',
-                                    ssh_cmd, out, err)
-            header = host_lines.pop(0).split('!')
-            self._assert_ssh_return('name' in header,
-                                    '_get_host_from_connector',
-                                    ssh_cmd, out, err)
-            name_index = header.index('name')
-            hosts = map(lambda x: x.split('!')[name_index], host_lines)
-            hostname = self._find_host_exhaustive(connector, hosts)
+        ports = self._connector_ports(connector)
+        refreshed = self._ensure_inventory()
+        hostname = self._find_cached_host(ports)
+        if hostname is None and not refreshed:
+            # The host may have been defined by someone else since
+            self._refresh_inventory()
+            hostname = self._find_cached_host(ports)
+
+        if hostname is None and self._host_names:
+            # If we have FC information, we have a faster lookup option
+            if 'wwpns' in connector:
+                hostname = self._find_host_from_wwpn(connector)
+
+            # If we don't have a hostname yet, try the long way, starting
+            # with the hosts named after this one
+            if not hostname:
+                hosts = sorted((host for host in self._host_names
+                                if host not in self._host_ports),
+                               key=lambda host: (not host.startswith(prefix),
+                                                 host))
+                hostname = self._find_host_exhaustive(connector, hosts)
 
         LOG.debug(_('leave: _get_host_from_connector: host %s') % hostname)
 
         return hostname
 
+    def _find_cached_host(self, ports):
+        for port in ports:
+            hostname = self._port_hosts.get(port)
+            if hostname in self._host_names:
+                return hostname
+        return None
+
     def _create_host(self, connector):
         """Create a new host on the storage system.
 
@@ -552,11 +628,15 @@ class StorwizeSVCDriver(san.SanISCSIDriver):
             ssh_cmd = ('svctask addhostport -force %s %s' % (port, host_name))
             out, err = self._run_ssh(ssh_cmd)
 
+        self._host_names.add(host_name)
+        self._add_host_ports(host_name, self._connector_ports(connector))
+        self._chap_secrets[host_name] = None
+
         LOG.debug(_('leave: _create_host: host %(host)s - %(host_name)s') %
                   {'host': connector['host'], 'host_name': host_name})
         return host_name
 
-    def _get_hostvdisk_mappings(self, host_name):
+    def _list_hostvdisk_mappings(self, host_name):
         """Return the defined storage mappings for a host."""
 
         return_data = {}
@@ -579,8 +659,10 @@ class StorwizeSVCDriver(san.SanISCSIDriver):
                     'host %(host_name)s')
                   % {'volume_name': volume_name, 'host_name': host_name})
 
-        # Check if this volume is already mapped to this host
-        mapping_data = self._get_hostvdisk_mappings(host_name)
+        # Check if this volume is already mapped to this host. The SCSI ids
+        # in use change with every mapping made by anyone, so they are
+        # listed afresh rather than kept in the inventory
+        mapping_data = self._list_hostvdisk_mappings(host_name)
 
         mapped_flag = False
         result_lun = '-1'
@@ -641,6 +723,7 @@ class StorwizeSVCDriver(san.SanISCSIDriver):
         # No output should be returned from rmhost
         self._assert_ssh_return(len(out.strip()) == 0,
                                 '_delete_host', ssh_cmd, out, err)
+        self._forget_host(host_name)
 
         LOG.debug(_('leave: _delete_host: host %s ') % host_name)
 
@@ -711,7 +794,12 @@ class StorwizeSVCDriver(san.SanISCSIDriver):
                 chap_secret = self._add_chapsecret_to_host(host_name)
 
         volume_attributes = self._get_vdisk_attributes(volume_name)
-        lun_id = self._map_vol_to_host(volume_name, host_name)
+        try:
+            lun_id = self._map_vol_to_host(volume_name, host_name)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                # The inventory may be out of date; list it again next time
+                self._inventory_refreshed_at = None
 
         self._driver_assert(volume_attributes is not None,
                             _('initialize_connection: Failed to get attributes'
@@ -818,7 +906,7 @@ class StorwizeSVCDriver(san.SanISCSIDriver):
               'for connector'))
 
         # Check if vdisk-host mapping exists, remove if it does
-        mapping_data = self._get_hostvdisk_mappings(host_name)
+        mapping_data = self._list_hostvdisk_mappings(host_name)
         if vol_name in mapping_data:
             ssh_cmd = 'svctask rmvdiskhostmap -host %s %s' % \
                 (host_name, vol_name)
@@ -1033,19 +1121,14 @@ class StorwizeSVCDriver(san.SanISCSIDriver):
 
     def _prepare_fc_map(self, fc_map_id, source, target):
         self._call_prepare_fc_map(fc_map_id, source, target)
-        mapping_ready = False
-        wait_time = 5
-        # Allow waiting of up to timeout (set as parameter)
-        timeout = self.configuration.storwize_svc_flashcopy_timeout
-        max_retries = (timeout / wait_time) + 1
-        for try_number in range(1, max_retries):
+
+        def _poll_fc_map():
             mapping_attrs = self._get_flashcopy_mapping_attributes(fc_map_id)
             if (mapping_attrs is None or
                     'status' not in mapping_attrs):
-                break
+                return False
             if mapping_attrs['status'] == 'prepared':
-                mapping_ready = True
-                break
+                return True
             elif mapping_attrs['status'] == 'stopped':
                 self._call_prepare_fc_map(fc_map_id, source, target)
             elif mapping_attrs['status'] != 'preparing':
@@ -1057,8 +1140,15 @@ class StorwizeSVCDriver(san.SanISCSIDriver):
                                     'id': fc_map_id,
                                     'attr': mapping_attrs})
                 raise exception.VolumeBackendAPIException(data=exception_msg)
-            # Need to wait for mapping to be prepared, wait a few seconds
-            time.sleep(wait_time)
+            return jobtracker.RUNNING
+
+        # Allow waiting of up to timeout (set as parameter)
+        timeout = self.configuration.storwize_svc_flashcopy_timeout
+        try:
+            mapping_ready = jobtracker.get_job_tracker().wait(
+                _poll_fc_map, name='fcmap %s' % fc_map_id, timeout=timeout)
+        except exception.VolumeJobTimeout:
+            mapping_ready = False
 
         if not mapping_ready:
             exception_msg = (_('Mapping %(id)s prepare failed to complete '
@@ -0,0 +1,200 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2013 OpenStack, LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Tracking of long-running jobs on storage arrays.
+
+Drivers hand the tracker a function that polls a job. A single greenthread
+polls all the jobs of the process: first right away, then at intervals
+growing from job_poll_initial_interval up to job_poll_max_interval, so
+that short jobs are noticed quickly without querying the array over and
+over for long ones.
+"""
+
+import heapq
+import itertools
+import sys
+import time
+
+from eventlet import event
+from eventlet import greenthread
+from eventlet import queue
+from oslo.config import cfg
+
+from cinder import exception
+from cinder.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+job_tracker_opts = [
+    cfg.FloatOpt('job_poll_initial_interval',
+                 default=0.5,
+                 help='Seconds between the first polls of a job running '
+                      'on a storage array'),
+    cfg.FloatOpt('job_poll_max_interval',
+                 default=10.0,
+                 help='Maximum seconds between polls of a job running on '
+                      'a storage array'),
+    cfg.FloatOpt('job_poll_backoff',
+                 default=2.0,
+                 help='Factor the interval between polls of a job grows '
+                      'by after every poll'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(job_tracker_opts)
+
+# Returned by poll functions while their job is running
+RUNNING = object()
+
+
+class Job(object):
+    """A job polled by a JobTracker."""
+
+    def __init__(self, name, poll, callback, timeout, interval):
+        self.name = name
+        self.poll = poll
+        self.callback = callback
+        self.timeout = timeout
+        self.deadline = None
+        if timeout is not None:
+            self.deadline = time.time() + timeout
+        self.interval = interval
+        self.polls = 0
+        self._done = event.Event()
+
+    def ready(self):
+        return self._done.ready()
+
+    def wait(self):
+        """Return the result of the job, or raise what it failed with."""
+        return self._done.wait()
+
+
+class JobTracker(object):
+    """Polls jobs until they complete, fail or time out.
+
+    Intervals left as None are read from the configuration for every job.
+    """
+
+    def __init__(self, initial_interval=None, max_interval=None,
+                 backoff=None):
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        # (time of the next poll, sequence number, job)
+        self._jobs = []
+        self._seq = itertools.count()
+        self._wakeup = queue.LightQueue()
+        self._poller = None
+
+    def _setting(self, value, name):
+        if value is None:
+            return getattr(CONF, name)
+        return value
+
+    def track(self, poll, name=None, callback=None, timeout=None):
+        """Start polling a job; returns its Job.
+
+        :param poll: called without arguments; returns RUNNING while the
+                     job runs and its result once it is done, or raises
+                     if it failed
+        :param callback: called with the Job once it is done
+        :param timeout: seconds after which the job fails with
+                        VolumeJobTimeout, None to wait for ever
+        """
+        interval = self._setting(self.initial_interval,
+                                 'job_poll_initial_interval')
+        job = Job(name or repr(poll), poll, callback, timeout, interval)
+        self._schedule(job, time.time())
+        if self._poller is None:
+            self._poller = greenthread.spawn(self._run)
+        else:
+            self._wakeup.put(None)
+        return job
+
+    def wait(self, poll, name=None, timeout=None):
+        """Poll a job until it is done; returns its result."""
+        return self.track(poll, name=name, timeout=timeout).wait()
+
+    def _schedule(self, job, due):
+        if job.deadline is not None:
+            due = min(due, job.deadline)
+        heapq.heappush(self._jobs, (due, next(self._seq), job))
+
+    def _run(self):
+        try:
+            while self._jobs:
+                delay = self._jobs[0][0] - time.time()
+                if delay > 0:
+                    # woken up early when a job is added
+                    try:
+                        self._wakeup.get(timeout=delay)
+                    except queue.Empty:
+                        pass
+                    continue
+                due, seq, job = heapq.heappop(self._jobs)
+                self._poll(job)
+        finally:
+            self._poller = None
+
+    def _poll(self, job):
+        job.polls += 1
+        try:
+            result = job.poll()
+            if result is RUNNING and job.deadline is not None and \
+                    time.time() >= job.deadline:
+                raise exception.VolumeJobTimeout(name=job.name,
+                                                 timeout=job.timeout)
+        except Exception:
+            self._finish(job, exc_info=sys.exc_info())
+            return
+
+        if result is not RUNNING:
+            self._finish(job, result=result)
+            return
+
+        self._schedule(job, time.time() + job.interval)
+        backoff = self._setting(self.backoff, 'job_poll_backoff')
+        max_interval = self._setting(self.max_interval,
+                                     'job_poll_max_interval')
+        job.interval = min(job.interval * backoff, max_interval)
+
+    def _finish(self, job, result=None, exc_info=None):
+        LOG.debug(_('Job %(name)s done after %(polls)d polls'),
+                  {'name': job.name, 'polls': job.polls})
+        if exc_info is None:
+            job._done.send(result)
+        else:
+            job._done.send_exception(*exc_info)
+        if job.callback is not None:
+            try:
+                job.callback(job)
+            except Exception:
+                LOG.exception(_('Completion callback of job %s failed'),
+                              job.name)
+
+
+_tracker = None
+
+
+def get_job_tracker():
+    """Return the job tracker shared by the drivers of the process."""
+    global _tracker
+    if _tracker is None:
+        _tracker = JobTracker()
+    return _tracker
@@ -41,6 +41,7 @@ intact.
 import sys
 import traceback
 
+from eventlet import greenthread
 from oslo.config import cfg
 
 from cinder import context
@@ -140,26 +141,41 @@ class VolumeManager(manager.SchedulerDependentManager):
 
         volumes = self.db.volume_get_all_by_host(ctxt, self.host)
         LOG.debug(_("Re-exporting %s volumes"), len(volumes))
+        exports = []
+        deletes = []
         for volume in volumes:
             if volume['status'] in ['available', 'in-use']:
-                self.driver.ensure_export(ctxt, volume)
+                exports.append(volume)
             elif volume['status'] == 'downloading':
                 LOG.info(_("volume %s stuck in a downloading state"),
                          volume['id'])
                 self.driver.clear_download(ctxt, volume)
                 self.db.volume_update(ctxt, volume['id'], {'status': 'error'})
+            elif volume['status'] == 'deleting':
+                deletes.append(volume)
             else:
                 LOG.info(_("volume %s: skipping export"), volume['name'])
+        self.driver.ensure_exports(ctxt, exports)
 
-        LOG.debug(_('Resuming any in progress delete operations'))
-        for volume in volumes:
-            if volume['status'] == 'deleting':
-                LOG.info(_('Resuming delete on volume: %s') % volume['id'])
-                self.delete_volume(ctxt, volume['id'])
+        # NOTE: deletes can take a long time (e.g. wiping the volume), so
+        # they are resumed in the background rather than holding up the
+        # service
+        if deletes:
+            greenthread.spawn_n(self._resume_deletes, ctxt, deletes)
 
         # collect and publish service capabilities
         self.publish_service_capabilities(ctxt)
 
+    def _resume_deletes(self, context, volumes):
+        LOG.debug(_('Resuming any in progress delete operations'))
+        for volume in volumes:
+            LOG.info(_('Resuming delete on volume: %s') % volume['id'])
+            try:
+                self.delete_volume(context, volume['id'])
+            except Exception:
+                LOG.exception(_('Failed to resume delete on volume: %s'),
+                              volume['id'])
+
     def _create_volume(self, context, volume_ref, snapshot_ref,
                        srcvol_ref, image_service, image_id, image_location):
         cloned = None
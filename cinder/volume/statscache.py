@@ -0,0 +1,119 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2013 OpenStack, LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Pool data of storage arrays shared by the backends of a node.
+
+Several backend sections often manage the same array, each from a volume
+service process of its own. Drivers collect the pool data of an array
+through this cache, under a key made of the array's management address,
+and the data is kept in a file under array_stats_dir. For
+array_stats_cache_interval seconds, the other backends that refresh their
+stats are served from that file instead of querying the array again.
+"""
+
+import json
+import os
+import time
+
+from oslo.config import cfg
+
+from cinder.openstack.common import fileutils
+from cinder.openstack.common import log as logging
+from cinder import utils
+
+
+LOG = logging.getLogger(__name__)
+
+stats_cache_opts = [
+    cfg.StrOpt('array_stats_dir',
+               default='$state_path/array_stats',
+               help='Directory the pool data of storage arrays shared by '
+                    'the backends of the node is kept in'),
+    cfg.IntOpt('array_stats_cache_interval',
+               default=0,
+               help='Seconds the pool data of a storage array collected by '
+                    'one backend serves the other backends using the '
+                    'array. 0 => every backend collects its own'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(stats_cache_opts)
+
+
+class ArrayStatsCache(object):
+    """Pool data of storage arrays, kept in one file per key."""
+
+    PARTIAL_SUFFIX = '.part'
+
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+
+    def _path(self, key):
+        return os.path.join(self.path, key.replace(os.sep, '_'))
+
+    def _read(self, path):
+        """Return the data kept in path, None if it is missing or stale."""
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            return None
+        age = time.time() - entry['collected_at']
+        if not 0 <= age < self.interval:
+            return None
+        return entry['data']
+
+    def get(self, key, collect):
+        """Return the data of key, collecting it if it is too old.
+
+        collect() is called without arguments and must return data JSON
+        represents unchanged: dicts with string keys, lists, strings and
+        numbers. Concurrent misses for a key, in this process or another
+        one, wait for the first of them rather than collecting it again.
+        """
+        if self.interval <= 0:
+            return collect()
+        path = self._path(key)
+        data = self._read(path)
+        if data is not None:
+            LOG.debug(_('Array stats %s found in the cache'), key)
+            return data
+
+        @utils.synchronized('array-stats-%s' % key.replace(os.sep, '_'),
+                            external=True)
+        def _collect():
+            data = self._read(path)
+            if data is not None:
+                return data
+            LOG.debug(_('Collecting array stats %s'), key)
+            data = collect()
+            fileutils.ensure_tree(self.path)
+            partial = path + self.PARTIAL_SUFFIX
+            with fileutils.remove_path_on_error(partial):
+                with open(partial, 'w') as f:
+                    json.dump({'collected_at': time.time(), 'data': data}, f)
+                os.rename(partial, path)
+            return data
+
+        return _collect()
+
+
+def get_array_stats_cache():
+    """Return the cache of the pool data of the arrays of the node."""
+    return ArrayStatsCache(CONF.array_stats_dir,
+                           CONF.array_stats_cache_interval)
@@ -30,6 +30,7 @@ from cinder.openstack.common import strutils
 from cinder.openstack.common import timeutils
 from cinder import units
 from cinder import utils
+from cinder.volume import blockcopy
 
 
 volume_opts = [
@@ -76,6 +77,43 @@ def notify_usage_exists(context, volume_ref, current_period=False):
                               'exists', extra_usage_info=extra_usage_info)
 
 
+def _audit_shard_bounds(shard, shards):
+    """Return the (first, last) ids of a shard of the uuid id space.
+
+    Ids greater than first, and not greater than last, belong to the
+    shard; None leaves that end open.
+    """
+    if not 0 <= shard < shards:
+        raise exception.InvalidInput(
+            reason=_('shard must be between 0 and %d') % (shards - 1))
+    bounds = [None] + ['%08x' % (i * 0x100000000 // shards)
+                       for i in range(1, shards)] + [None]
+    return bounds[shard], bounds[shard + 1]
+
+
+def get_active_by_window_batches(get_active_by_window, context, begin, end,
+                                 batch_size, shard=0, shards=1):
+    """Yield lists of at most batch_size rows active during the window.
+
+    :param get_active_by_window: db.volume_get_active_by_window or
+                                 db.snapshot_get_active_by_window
+    :param shard: which of the shards, equal ranges of the id space, to
+                  return the rows of, so that the audit can be spread
+                  over several processes
+    """
+    marker, last = _audit_shard_bounds(shard, shards)
+    while True:
+        rows = get_active_by_window(context, begin, end,
+                                    marker=marker, limit=batch_size)
+        if last is not None:
+            rows = [row for row in rows if row['id'] <= last]
+        if rows:
+            yield rows
+        if len(rows) < batch_size:
+            return
+        marker = rows[-1]['id']
+
+
 def null_safe_str(s):
     return str(s) if s else ''
 
@@ -176,31 +214,25 @@ def _calculate_count(size_in_m):
 
 
 def copy_volume(srcstr, deststr, size_in_m, sync=False,
-                execute=utils.execute):
-    # Use O_DIRECT to avoid thrashing the system buffer cache
-    extra_flags = ['iflag=direct', 'oflag=direct']
-
-    # Check whether O_DIRECT is supported
-    try:
-        execute('dd', 'count=0', 'if=%s' % srcstr, 'of=%s' % deststr,
-                *extra_flags, run_as_root=True)
-    except exception.ProcessExecutionError:
-        extra_flags = []
-
-    # If the volume is being unprovisioned then
-    # request the data is persisted before returning,
-    # so that it's not discarded from the cache.
-    if sync and not extra_flags:
-        extra_flags.append('conv=fdatasync')
+                execute=utils.execute, progress=None, rate=None,
+                limiter=None):
+    """Copy size_in_m MiB from srcstr, which may be /dev/zero, to deststr.
+
+    :param sync: make sure the data is on disk before returning
+    :param progress: called with (bytes copied, total bytes) as the copy
+                     goes; raising from it aborts the copy
+    :param rate: bytes per second the copy may move, defaults to
+                 volume_copy_rate
+    :param limiter: utils.RateLimiter shared with other copies, to pace
+                    the copy with instead of rate
+    """
+    if (CONF.use_lightweight_copy_for_clone_volume and
+            srcstr != blockcopy.ZERO_SOURCE):
+        execute('cp', '--reflink', srcstr, deststr, run_as_root=True)
+        return
 
     blocksize, count = _calculate_count(size_in_m)
-
-    # Perform the copy
-    if CONF.use_lightweight_copy_for_clone_volume:
-        execute('cp', '--reflink', srcstr, deststr, run_as_root=True)
-    else:
-        blocksize = CONF.volume_dd_blocksize
-        execute('dd', 'if=%s' % srcstr, 'of=%s' % deststr,
-                'count=%d' % count,
-                'bs=%s' % blocksize,
-                *extra_flags, run_as_root=True)
+    blockcopy.copy(srcstr, deststr, size_in_m * units.MiB,
+                   int(strutils.to_bytes(blocksize)), sync=sync,
+                   execute=execute, progress=progress, rate=rate,
+                   limiter=limiter)